@@ -5,14 +5,29 @@ import secrets
 import sqlite3
 from datetime import timedelta
 from pathlib import Path
+from urllib.parse import urlsplit
 
 from flask import Flask, g, jsonify, render_template, request, url_for
-from werkzeug.security import generate_password_hash
 
-from . import admin, auth, cli, db, i18n, public, security, studio
+from . import (
+    admin,
+    assets,
+    auth,
+    cli,
+    db,
+    i18n,
+    maintenance,
+    public,
+    security,
+    serialization,
+    similarity,
+    studio,
+)
 from .i18n import translate
-from .media import HARD_MAX_IMAGE_PIXELS, drain_media_deletions
+from .media import DEFAULT_IMAGE_LADDER, HARD_MAX_IMAGE_PIXELS
+from .passwords import DEFAULT_PASSWORD_HASH_METHOD, valid_hash_method
 from .settings import get_site_copy, get_site_images
+from .turnstile import SITEVERIFY_URL
 
 
 def _bounded_integer(value: object, name: str, minimum: int, maximum: int) -> int:
@@ -25,6 +40,19 @@ def _bounded_integer(value: object, name: str, minimum: int, maximum: int) -> in
     return parsed
 
 
+def _image_ladder(value: object) -> tuple[int, ...]:
+    parts = value.split(",") if isinstance(value, str) else value
+    try:
+        rungs = sorted({int(str(part).strip()) for part in parts if str(part).strip()})
+    except (TypeError, ValueError) as error:
+        raise RuntimeError("FABULA_IMAGE_LADDER must list integer widths") from error
+    if len(rungs) > 8 or any(not 160 <= rung < 2400 for rung in rungs):
+        raise RuntimeError(
+            "FABULA_IMAGE_LADDER must list at most 8 widths between 160 and 2399"
+        )
+    return tuple(rungs)
+
+
 def persistent_secret(data_root: Path) -> str:
     configured = os.environ.get("FABULA_SECRET_KEY")
     if configured:
@@ -67,6 +95,7 @@ def create_app(test_config: dict | None = None) -> Flask:
         MEDIA_ROOT=media_root,
         SITE_MEDIA_ROOT=site_media_root,
         TEMP_ROOT=temp_root,
+        ASSET_BUILD_ROOT=Path(__file__).resolve().parent / "static" / "build",
         MAX_CONTENT_LENGTH=int(os.environ.get("FABULA_MAX_UPLOAD_MB", "25")) * 1024 * 1024,
         SESSION_COOKIE_NAME="fabula_session",
         SESSION_COOKIE_HTTPONLY=True,
@@ -76,6 +105,10 @@ def create_app(test_config: dict | None = None) -> Flask:
         PERMANENT_SESSION_LIFETIME=timedelta(hours=12),
         LOGIN_MAX_ATTEMPTS=int(os.environ.get("FABULA_LOGIN_MAX_ATTEMPTS", "5")),
         LOGIN_WINDOW_SECONDS=int(os.environ.get("FABULA_LOGIN_WINDOW_SECONDS", "900")),
+        LOGIN_LIMITER=os.environ.get("FABULA_LOGIN_LIMITER", "memory").strip().lower(),
+        LOGIN_LIMITER_PERSIST_SECONDS=int(
+            os.environ.get("FABULA_LOGIN_LIMITER_PERSIST_SECONDS", "30")
+        ),
         TRUST_PROXY_HEADERS=os.environ.get("FABULA_TRUST_PROXY_HEADERS", "false").lower() == "true",
         TURNSTILE_SITE_KEY=os.environ.get("FABULA_TURNSTILE_SITE_KEY", "").strip(),
         TURNSTILE_SECRET_KEY=os.environ.get("FABULA_TURNSTILE_SECRET_KEY", "").strip(),
@@ -87,6 +120,16 @@ def create_app(test_config: dict | None = None) -> Flask:
             os.environ.get("FABULA_TURNSTILE_TIMEOUT_SECONDS", "5")
         ),
         TURNSTILE_VERIFIER=None,
+        TURNSTILE_SITEVERIFY_URL=os.environ.get(
+            "FABULA_TURNSTILE_SITEVERIFY_URL", SITEVERIFY_URL
+        ).strip(),
+        TURNSTILE_POOL_SIZE=int(os.environ.get("FABULA_TURNSTILE_POOL_SIZE", "4")),
+        TURNSTILE_BREAKER_THRESHOLD=int(
+            os.environ.get("FABULA_TURNSTILE_BREAKER_THRESHOLD", "5")
+        ),
+        TURNSTILE_BREAKER_RESET_SECONDS=int(
+            os.environ.get("FABULA_TURNSTILE_BREAKER_RESET_SECONDS", "30")
+        ),
         TEMPORARY_PASSWORD_TTL_SECONDS=int(
             os.environ.get("FABULA_TEMPORARY_PASSWORD_TTL_SECONDS", "900")
         ),
@@ -96,7 +139,44 @@ def create_app(test_config: dict | None = None) -> Flask:
         MAX_IMAGE_DIMENSION=int(
             os.environ.get("FABULA_MAX_IMAGE_DIMENSION", "12000")
         ),
-        DUMMY_PASSWORD_HASH=generate_password_hash(secrets.token_urlsafe(32)),
+        IMAGE_LADDER=os.environ.get(
+            "FABULA_IMAGE_LADDER",
+            ",".join(str(rung) for rung in DEFAULT_IMAGE_LADDER),
+        ),
+        IMAGE_WORKERS=int(os.environ.get("FABULA_IMAGE_WORKERS", "2")),
+        IMAGE_MEMORY_BUDGET_MB=int(
+            os.environ.get("FABULA_IMAGE_MEMORY_BUDGET_MB", "320")
+        ),
+        IMAGE_QUEUE_TIMEOUT_SECONDS=int(
+            os.environ.get("FABULA_IMAGE_QUEUE_TIMEOUT_SECONDS", "30")
+        ),
+        SIGNED_MEDIA_URLS=os.environ.get("FABULA_SIGNED_MEDIA_URLS", "false").lower() == "true",
+        MEDIA_EPOCH_TTL_SECONDS=int(
+            os.environ.get("FABULA_MEDIA_EPOCH_TTL_SECONDS", "5")
+        ),
+        MEDIA_OFFLOAD=os.environ.get("FABULA_MEDIA_OFFLOAD", ""),
+        MEDIA_OFFLOAD_PREFIX=os.environ.get(
+            "FABULA_MEDIA_OFFLOAD_PREFIX", "/_fabula_protected"
+        ),
+        MEDIA_STORAGE=os.environ.get("FABULA_MEDIA_STORAGE", "local"),
+        MEDIA_CACHE_ROOT=data_root / "media-cache",
+        MEDIA_CACHE_MB=int(os.environ.get("FABULA_MEDIA_CACHE_MB", "2048")),
+        S3_ENDPOINT=os.environ.get("FABULA_S3_ENDPOINT", "").strip(),
+        S3_BUCKET=os.environ.get("FABULA_S3_BUCKET", "").strip(),
+        S3_REGION=os.environ.get("FABULA_S3_REGION", "us-east-1").strip(),
+        S3_ACCESS_KEY_ID=os.environ.get("FABULA_S3_ACCESS_KEY_ID", "").strip(),
+        S3_SECRET_ACCESS_KEY=os.environ.get("FABULA_S3_SECRET_ACCESS_KEY", "").strip(),
+        S3_PART_SIZE_MB=int(os.environ.get("FABULA_S3_PART_SIZE_MB", "16")),
+        MAINTENANCE_ENABLED=os.environ.get("FABULA_MAINTENANCE", "true").lower() == "true",
+        PASSWORD_HASH_METHOD=os.environ.get(
+            "FABULA_PASSWORD_HASH_METHOD", DEFAULT_PASSWORD_HASH_METHOD
+        ).strip(),
+        PASSWORD_WORKERS=int(os.environ.get("FABULA_PASSWORD_WORKERS", "2")),
+        PASSWORD_QUEUE_LIMIT=int(os.environ.get("FABULA_PASSWORD_QUEUE_LIMIT", "8")),
+        PASSWORD_QUEUE_TIMEOUT_SECONDS=int(
+            os.environ.get("FABULA_PASSWORD_QUEUE_TIMEOUT_SECONDS", "3")
+        ),
+        DUMMY_PASSWORD_HASH=None,
     )
     if test_config:
         app.config.update(test_config)
@@ -136,7 +216,54 @@ def create_app(test_config: dict | None = None) -> Flask:
         raise RuntimeError(
             "FABULA_TURNSTILE_EXPECTED_HOSTNAMES is required when Turnstile is enabled"
         )
+    siteverify_url = urlsplit(str(app.config["TURNSTILE_SITEVERIFY_URL"]))
+    if siteverify_url.scheme not in {"http", "https"} or not siteverify_url.hostname:
+        raise RuntimeError("FABULA_TURNSTILE_SITEVERIFY_URL must be an http(s) URL")
+    if environment == "production" and siteverify_url.scheme != "https":
+        raise RuntimeError("FABULA_TURNSTILE_SITEVERIFY_URL must use https in production")
+    media_offload = str(app.config["MEDIA_OFFLOAD"]).strip().lower()
+    if media_offload not in {"", "nginx", "sendfile"}:
+        raise RuntimeError("FABULA_MEDIA_OFFLOAD must be empty, nginx, or sendfile")
+    media_offload_prefix = str(app.config["MEDIA_OFFLOAD_PREFIX"]).strip().rstrip("/")
+    if media_offload == "nginx" and not media_offload_prefix.startswith("/"):
+        raise RuntimeError("FABULA_MEDIA_OFFLOAD_PREFIX must be an absolute path")
+    media_storage = str(app.config["MEDIA_STORAGE"]).strip().lower()
+    if media_storage not in {"local", "s3"}:
+        raise RuntimeError("FABULA_MEDIA_STORAGE must be local or s3")
+    if media_storage == "s3":
+        s3_endpoint = urlsplit(str(app.config["S3_ENDPOINT"]))
+        if s3_endpoint.scheme not in {"http", "https"} or not s3_endpoint.hostname:
+            raise RuntimeError("FABULA_S3_ENDPOINT must be an http(s) URL")
+        if not (
+            app.config["S3_BUCKET"]
+            and app.config["S3_ACCESS_KEY_ID"]
+            and app.config["S3_SECRET_ACCESS_KEY"]
+        ):
+            raise RuntimeError(
+                "FABULA_S3_BUCKET, FABULA_S3_ACCESS_KEY_ID and "
+                "FABULA_S3_SECRET_ACCESS_KEY are required for s3 media storage"
+            )
     app.config.update(
+        MEDIA_STORAGE=media_storage,
+        MEDIA_CACHE_BYTES=_bounded_integer(
+            app.config["MEDIA_CACHE_MB"],
+            "FABULA_MEDIA_CACHE_MB",
+            16,
+            1_048_576,
+        )
+        * 1024
+        * 1024,
+        S3_PART_SIZE=_bounded_integer(
+            app.config["S3_PART_SIZE_MB"],
+            "FABULA_S3_PART_SIZE_MB",
+            5,
+            512,
+        )
+        * 1024
+        * 1024,
+        MEDIA_OFFLOAD=media_offload,
+        MEDIA_OFFLOAD_PREFIX=media_offload_prefix,
+        USE_X_SENDFILE=media_offload == "sendfile",
         TURNSTILE_SITE_KEY=turnstile_site_key,
         TURNSTILE_SECRET_KEY=turnstile_secret_key,
         TURNSTILE_EXPECTED_HOSTNAMES=frozenset(expected_hostnames),
@@ -159,8 +286,83 @@ def create_app(test_config: dict | None = None) -> Flask:
             32,
             12_000,
         ),
+        IMAGE_LADDER=_image_ladder(app.config["IMAGE_LADDER"]),
+        IMAGE_WORKERS=_bounded_integer(
+            app.config["IMAGE_WORKERS"],
+            "FABULA_IMAGE_WORKERS",
+            0,
+            8,
+        ),
+        IMAGE_MEMORY_BUDGET_MB=_bounded_integer(
+            app.config["IMAGE_MEMORY_BUDGET_MB"],
+            "FABULA_IMAGE_MEMORY_BUDGET_MB",
+            64,
+            4_096,
+        ),
+        IMAGE_QUEUE_TIMEOUT_SECONDS=_bounded_integer(
+            app.config["IMAGE_QUEUE_TIMEOUT_SECONDS"],
+            "FABULA_IMAGE_QUEUE_TIMEOUT_SECONDS",
+            1,
+            600,
+        ),
+        MEDIA_EPOCH_TTL_SECONDS=_bounded_integer(
+            app.config["MEDIA_EPOCH_TTL_SECONDS"],
+            "FABULA_MEDIA_EPOCH_TTL_SECONDS",
+            0,
+            300,
+        ),
+        LOGIN_LIMITER_PERSIST_SECONDS=_bounded_integer(
+            app.config["LOGIN_LIMITER_PERSIST_SECONDS"],
+            "FABULA_LOGIN_LIMITER_PERSIST_SECONDS",
+            0,
+            3_600,
+        ),
+        TURNSTILE_POOL_SIZE=_bounded_integer(
+            app.config["TURNSTILE_POOL_SIZE"],
+            "FABULA_TURNSTILE_POOL_SIZE",
+            1,
+            32,
+        ),
+        TURNSTILE_BREAKER_THRESHOLD=_bounded_integer(
+            app.config["TURNSTILE_BREAKER_THRESHOLD"],
+            "FABULA_TURNSTILE_BREAKER_THRESHOLD",
+            1,
+            100,
+        ),
+        TURNSTILE_BREAKER_RESET_SECONDS=_bounded_integer(
+            app.config["TURNSTILE_BREAKER_RESET_SECONDS"],
+            "FABULA_TURNSTILE_BREAKER_RESET_SECONDS",
+            1,
+            600,
+        ),
+        PASSWORD_WORKERS=_bounded_integer(
+            app.config["PASSWORD_WORKERS"],
+            "FABULA_PASSWORD_WORKERS",
+            1,
+            16,
+        ),
+        PASSWORD_QUEUE_LIMIT=_bounded_integer(
+            app.config["PASSWORD_QUEUE_LIMIT"],
+            "FABULA_PASSWORD_QUEUE_LIMIT",
+            0,
+            256,
+        ),
+        PASSWORD_QUEUE_TIMEOUT_SECONDS=_bounded_integer(
+            app.config["PASSWORD_QUEUE_TIMEOUT_SECONDS"],
+            "FABULA_PASSWORD_QUEUE_TIMEOUT_SECONDS",
+            1,
+            30,
+        ),
     )
 
+    if app.config["LOGIN_LIMITER"] not in {"memory", "sqlite"}:
+        raise RuntimeError("FABULA_LOGIN_LIMITER must be memory or sqlite")
+    if not valid_hash_method(app.config["PASSWORD_HASH_METHOD"]):
+        raise RuntimeError(
+            "FABULA_PASSWORD_HASH_METHOD must be scrypt:N:r:p with N >= 16384 "
+            "or pbkdf2:sha256:iterations with at least 600000 iterations"
+        )
+
     for directory in (
         Path(app.config["DATABASE_PATH"]).parent,
         Path(app.config["MEDIA_ROOT"]) / "original",
@@ -171,11 +373,13 @@ def create_app(test_config: dict | None = None) -> Flask:
         directory.mkdir(parents=True, exist_ok=True)
 
     db.init_app(app)
-    with app.app_context():
-        drain_media_deletions()
     security.init_app(app)
     i18n.init_app(app)
+    serialization.init_app(app)
+    similarity.init_app(app)
     cli.init_app(app)
+    maintenance.init_app(app)
+    assets.init_app(app)
     app.register_blueprint(public.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(studio.bp)
@@ -214,11 +418,7 @@ def create_app(test_config: dict | None = None) -> Flask:
             else None
         )
         default_home_url = (
-            url_for(
-                "public.media_file",
-                variant="original",
-                storage_name=latest_photo["storage_name"],
-            )
+            public.public_media_url("original", latest_photo["storage_name"])
             if latest_photo is not None
             else None
         )
@@ -1,23 +1,26 @@
 from __future__ import annotations
 
 from flask import Blueprint, current_app, g, jsonify, request, url_for
-from werkzeug.security import generate_password_hash
 
-from .db import get_db
+from .db import connection_pool, get_db
 from .i18n import translate
+from .maintenance import maintenance_scheduler
 from .media import (
     SITE_IMAGE_SLOTS,
+    ImageProcessingBusy,
     InvalidImage,
     delete_site_media,
     drain_media_deletions,
     process_site_image,
     queue_media_deletion,
 )
+from .passwords import hash_password
 from .security import (
     admin_required,
     api_error,
     audit,
     issue_temporary_password,
+    login_limiter,
     refresh_current_user,
     valid_username,
 )
@@ -28,6 +31,7 @@ from .settings import (
     save_site_copy,
     save_site_image,
 )
+from .turnstile import siteverify_client
 
 
 bp = Blueprint("admin", __name__, url_prefix="/api/admin")
@@ -160,7 +164,7 @@ def create_user():
                 username,
                 display_name,
                 role,
-                generate_password_hash(temporary_password),
+                hash_password(temporary_password),
                 expires_at,
             ),
         )
@@ -296,7 +300,7 @@ def reset_password(user_id: int):
             updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
         WHERE id = ?
         """,
-        (generate_password_hash(temporary_password), expires_at, user_id),
+        (hash_password(temporary_password), expires_at, user_id),
     )
     audit("user.password_reset", target_user_id=user_id)
     connection.commit()
@@ -391,6 +395,12 @@ def update_site_image(slot: str):
         processed = process_site_image(uploaded.stream, slot)
     except InvalidImage as error:
         return api_error(str(error))
+    except ImageProcessingBusy:
+        response, status = api_error(translate("服务器繁忙，请稍后再试。"), 503)
+        response.headers["Retry-After"] = str(
+            current_app.config["IMAGE_QUEUE_TIMEOUT_SECONDS"]
+        )
+        return response, status
 
     connection = get_db()
     try:
@@ -458,3 +468,34 @@ def reset_site_image(slot: str):
 @admin_required
 def read_site_copy():
     return jsonify({"site_copy": get_site_copy()})
+
+
+@bp.get("/database-pool")
+@admin_required
+def database_pool_stats():
+    return jsonify(
+        {
+            "database_pool": {
+                profile: connection_pool(profile).stats()
+                for profile in ("writer", "reader")
+            }
+        }
+    )
+
+
+@bp.get("/maintenance")
+@admin_required
+def maintenance_stats():
+    return jsonify({"maintenance": maintenance_scheduler(current_app).stats()})
+
+
+@bp.get("/login-limiter")
+@admin_required
+def login_limiter_stats():
+    return jsonify({"login_limiter": login_limiter().stats()})
+
+
+@bp.get("/turnstile")
+@admin_required
+def turnstile_stats():
+    return jsonify({"siteverify": siteverify_client().stats()})
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import mimetypes
+from pathlib import Path
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is an optional speed-up
+    brotli = None
+
+
+ASSET_MANIFEST_KEY = "fabula.asset_manifest"
+ASSET_MANIFEST_NAME = "manifest.json"
+BUILD_PREFIX = "build/"
+COMPRESSIBLE_SUFFIXES = frozenset({".css", ".js", ".json", ".svg"})
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def _fingerprinted_name(relative: Path, content: bytes) -> Path:
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return relative.with_name(f"{relative.stem}.{digest}{relative.suffix}")
+
+
+def build_assets(static_root: Path, output_root: Path) -> dict[str, str]:
+    """Write content-hashed copies of the static files, plus .gz and .br siblings.
+
+    Returns the manifest mapping each source path to its built path, relative
+    to the static folder. Files from earlier builds that the new manifest no
+    longer names are removed.
+    """
+    manifest = {}
+    written = {output_root / ASSET_MANIFEST_NAME}
+    for source in sorted(static_root.rglob("*")):
+        if not source.is_file() or source.is_relative_to(output_root):
+            continue
+        relative = source.relative_to(static_root)
+        content = source.read_bytes()
+        target = output_root / _fingerprinted_name(relative, content)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        variants = {target: content}
+        if relative.suffix in COMPRESSIBLE_SUFFIXES:
+            variants[target.with_name(target.name + ".gz")] = gzip.compress(
+                content, compresslevel=9, mtime=0
+            )
+            if brotli is not None:
+                variants[target.with_name(target.name + ".br")] = brotli.compress(content)
+        for path, data in variants.items():
+            if not path.exists() or path.read_bytes() != data:
+                path.write_bytes(data)
+            written.add(path)
+        manifest[relative.as_posix()] = (
+            BUILD_PREFIX + target.relative_to(output_root).as_posix()
+        )
+    (output_root / ASSET_MANIFEST_NAME).write_text(
+        json.dumps(manifest, indent=2, sort_keys=True) + "\n",
+        encoding="utf-8",
+    )
+    for path in sorted(output_root.rglob("*"), reverse=True):
+        if path.is_file() and path not in written:
+            path.unlink()
+        elif path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+    return manifest
+
+
+def load_asset_manifest(app) -> dict[str, str]:
+    manifest_path = Path(app.config["ASSET_BUILD_ROOT"]) / ASSET_MANIFEST_NAME
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    app.extensions[ASSET_MANIFEST_KEY] = manifest
+    return manifest
+
+
+def send_built_asset(filename: str):
+    build_root = Path(current_app.config["ASSET_BUILD_ROOT"])
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    served_name = filename
+    for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[candidate] and (build_root / (filename + suffix)).is_file():
+            encoding = candidate
+            served_name = filename + suffix
+            break
+    response = send_from_directory(
+        build_root,
+        served_name,
+        mimetype=mimetype,
+        max_age=IMMUTABLE_MAX_AGE,
+    )
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app) -> None:
+    load_asset_manifest(app)
+    serve_static = app.view_functions["static"]
+
+    def static(filename: str):
+        # Fingerprinted names change with their content, so they can be
+        # cached forever; unhashed paths keep Flask's default handling.
+        if filename.startswith(BUILD_PREFIX):
+            return send_built_asset(filename.removeprefix(BUILD_PREFIX))
+        return serve_static(filename=filename)
+
+    app.view_functions["static"] = static
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == "static":
+            built = app.extensions[ASSET_MANIFEST_KEY].get(values.get("filename"))
+            if built is not None:
+                values["filename"] = built
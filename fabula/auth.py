@@ -5,16 +5,23 @@ from flask import (
     current_app,
     flash,
     g,
+    make_response,
     redirect,
     render_template,
     request,
     session,
     url_for,
 )
-from werkzeug.security import check_password_hash
+from werkzeug.security import check_password_hash, generate_password_hash
 
 from .db import get_db
 from .i18n import translate
+from .passwords import (
+    PasswordHashBusy,
+    dummy_password_hash,
+    needs_rehash,
+    run_password_work,
+)
 from .security import (
     clear_failed_logins,
     client_address,
@@ -36,6 +43,7 @@ def login():
         return redirect(url_for("studio.workspace"))
 
     error = None
+    status = 200
     username = request.form.get("username", "").strip()
     if request.method == "POST":
         fingerprint = login_fingerprint(username)
@@ -58,22 +66,41 @@ def login():
                 ).fetchone()
                 eligible = user is not None and user["status"] != "inactive"
                 candidate_hash = (
-                    user["password_hash"]
-                    if eligible
-                    else current_app.config["DUMMY_PASSWORD_HASH"]
-                )
-                password_valid = check_password_hash(
-                    candidate_hash,
-                    request.form.get("password", ""),
+                    user["password_hash"] if eligible else dummy_password_hash()
                 )
+                password = request.form.get("password", "")
+                try:
+                    password_valid = run_password_work(
+                        check_password_hash,
+                        candidate_hash,
+                        password,
+                    )
+                except PasswordHashBusy:
+                    password_valid = None
                 valid = (
                     eligible
                     and password_valid
                     and temporary_password_is_valid(user)
                 )
-                if not valid:
+                if password_valid is None:
+                    error = translate("登录请求较多，请稍后再试。")
+                    status = 503
+                elif not valid:
                     error = translate("账号或密码不正确。")
                 else:
+                    upgraded_hash = None
+                    if needs_rehash(user["password_hash"]):
+                        # Move the stored hash to the configured parameters
+                        # while the plaintext is at hand; a busy executor just
+                        # defers the upgrade to a later login.
+                        try:
+                            upgraded_hash = run_password_work(
+                                generate_password_hash,
+                                password,
+                                current_app.config["PASSWORD_HASH_METHOD"],
+                            )
+                        except PasswordHashBusy:
+                            pass
                     clear_failed_logins(fingerprint)
                     connection = get_db()
                     if user["status"] == "pending":
@@ -85,6 +112,11 @@ def login():
                             """,
                             (user["id"],),
                         )
+                    if upgraded_hash is not None:
+                        connection.execute(
+                            "UPDATE users SET password_hash = ? WHERE id = ?",
+                            (upgraded_hash, user["id"]),
+                        )
                     connection.execute(
                         """
                         UPDATE users
@@ -108,14 +140,22 @@ def login():
                         return redirect(url_for("studio.workspace", tab="security"))
                     return redirect(next_url or url_for("studio.workspace"))
 
-    return render_template(
-        "login.html",
-        error=error,
-        username=username,
-        site_copy=get_site_copy(),
-        turnstile_enabled=is_enabled(),
-        turnstile_site_key=current_app.config.get("TURNSTILE_SITE_KEY", ""),
+    response = make_response(
+        render_template(
+            "login.html",
+            error=error,
+            username=username,
+            site_copy=get_site_copy(),
+            turnstile_enabled=is_enabled(),
+            turnstile_site_key=current_app.config.get("TURNSTILE_SITE_KEY", ""),
+        ),
+        status,
     )
+    if status == 503:
+        response.headers["Retry-After"] = str(
+            current_app.config["PASSWORD_QUEUE_TIMEOUT_SECONDS"]
+        )
+    return response
 
 
 @bp.post("/logout")
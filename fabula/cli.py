@@ -1,20 +1,41 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import os
+import shutil
 import time
+from datetime import date
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import click
-from flask import current_app
+from flask import current_app, g, session
 from flask.cli import with_appcontext
-from werkzeug.security import generate_password_hash
 
-from .db import get_db, init_db
-from .media import delete_media, process_image
+from .assets import build_assets, load_asset_manifest
+from .db import decode_cursor, get_db, init_db, publication_revision, publication_total
+from .i18n import CLIENT_CATALOGS, DEFAULT_LOCALE, SUPPORTED_LOCALES, compiled_catalog
+from .media import (
+    delete_media,
+    image_features_from_file,
+    migrate_media_batch,
+    photo_variants,
+    process_image,
+    stored_media_path,
+)
+from .passwords import benchmark_hash_methods, hash_password
+from .public import public_albums, public_photos, render_index, robots, sitemap
 from .security import audit, valid_password, valid_username
-from .settings import save_site_copy
+from .serialization import benchmark_feed_serialization, json_provider_name
+from .settings import get_site_images, save_site_copy
+from .storage import StandInObjectStoreServer
+from .turnstile import StandInSiteverifyServer
 
 
+EXPORT_MANIFEST = ".fabula-export.json"
+EXPORT_FEED_PAGE_SIZE = 24
+
 DEMO_USERS = [
     ("lin.qiu", "林秋", "admin", "active", "fabula-demo-2026", 0, 1),
     ("zhou.wang", "周望", "photographer", "active", "fabula-user-2026", 0, 0),
@@ -87,7 +108,7 @@ def bootstrap_admin(username: str, display_name: str, password: str) -> None:
             (
                 username,
                 display_name.strip(),
-                generate_password_hash(password),
+                hash_password(password),
                 expires_at,
             ),
         )
@@ -133,7 +154,7 @@ def reset_admin_password(username: str, password: str) -> None:
                 updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
             WHERE id = ?
             """,
-            (generate_password_hash(password), expires_at, admin["id"]),
+            (hash_password(password), expires_at, admin["id"]),
         )
         audit(
             "user.password_reset",
@@ -146,6 +167,235 @@ def reset_admin_password(username: str, password: str) -> None:
         raise
 
 
+def _write_export_file(output: Path, relative: str, data: bytes) -> None:
+    destination = output / relative
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temporary = destination.with_name(f".{destination.name}.tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, destination)
+
+
+def _link_export_file(output: Path, relative: str, source: Path) -> None:
+    destination = output / relative
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temporary = destination.with_name(f".{destination.name}.tmp")
+    temporary.unlink(missing_ok=True)
+    try:
+        os.link(source, temporary)
+    except OSError:
+        shutil.copy2(source, temporary)
+    os.replace(temporary, destination)
+
+
+def _export_feed_pages(album_id: int | None) -> list[bytes]:
+    total = publication_total() if album_id is None else publication_total("album", album_id)
+    pages: list[list[dict]] = []
+    cursor = None
+    while True:
+        items, next_cursor = public_photos(album_id, EXPORT_FEED_PAGE_SIZE, cursor)
+        pages.append(items)
+        if next_cursor is None:
+            break
+        cursor = decode_cursor(next_cursor, 3 if album_id is not None else 2)
+    return [
+        json.dumps(
+            {
+                "items": items,
+                "total": total,
+                "next_cursor": str(number + 1) if number < len(pages) else None,
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        for number, items in enumerate(pages, start=1)
+    ]
+
+
+def backfill_image_features(batch_size: int = 100) -> dict[str, int]:
+    """Compute placeholders and perceptual hashes for photos that predate them.
+
+    Features are taken from the thumbs. Each batch is committed on its own, so
+    an interrupted run resumes where it stopped; photos whose thumb cannot be
+    read are counted and skipped.
+    """
+    connection = get_db()
+    stats = {"updated": 0, "failed": 0}
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            """
+            SELECT id, storage_name
+            FROM photos
+            WHERE status = 'ready'
+                AND (placeholder = '' OR perceptual_hash IS NULL)
+                AND id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            return stats
+        for row in rows:
+            last_id = row["id"]
+            try:
+                features = image_features_from_file(
+                    stored_media_path("thumbs", row["storage_name"])
+                )
+            except OSError:
+                current_app.logger.warning(
+                    "Image feature backfill skipped photo %s", row["id"]
+                )
+                stats["failed"] += 1
+                continue
+            connection.execute(
+                """
+                UPDATE photos
+                SET placeholder = ?, dominant_color = ?, perceptual_hash = ?
+                WHERE id = ? AND storage_name = ?
+                """,
+                (
+                    features["placeholder"],
+                    features["dominant_color"],
+                    features["perceptual_hash"],
+                    row["id"],
+                    row["storage_name"],
+                ),
+            )
+            stats["updated"] += 1
+        connection.commit()
+
+
+def export_static(
+    output: Path,
+    base_url: str,
+    locale: str = DEFAULT_LOCALE,
+    force: bool = False,
+) -> dict[str, int] | None:
+    """Export the public site, rewriting only files that changed since the last run.
+
+    Returns None when the publication revision, assets and options all match the
+    previous export, otherwise counts of written, linked and removed files.
+    """
+    parts = urlsplit(base_url)
+    if (
+        parts.scheme not in {"http", "https"}
+        or not parts.netloc
+        or parts.path.strip("/")
+        or parts.query
+        or parts.fragment
+    ):
+        raise click.ClickException("站点地址需为 http(s)://域名 形式，且不能包含路径")
+    if locale not in SUPPORTED_LOCALES:
+        raise click.ClickException("导出语言无效")
+    output = output.resolve()
+    output.mkdir(parents=True, exist_ok=True)
+    static_root = Path(current_app.static_folder)
+    assets = {
+        f"static/{path.relative_to(static_root).as_posix()}": path
+        for path in sorted(static_root.rglob("*"))
+        if path.is_file()
+    }
+    asset_digest = hashlib.sha256()
+    for relative, path in assets.items():
+        stat = path.stat()
+        asset_digest.update(f"{relative}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    key = {
+        "revision": publication_revision(),
+        "base_url": f"{parts.scheme}://{parts.netloc}",
+        "locale": locale,
+        "year": date.today().year,
+        "assets": asset_digest.hexdigest(),
+        "catalog": compiled_catalog(locale)[0] if locale in CLIENT_CATALOGS else None,
+    }
+    try:
+        previous = json.loads((output / EXPORT_MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        previous = {}
+    if not isinstance(previous, dict):
+        previous = {}
+    if not force and previous.get("key") == key:
+        return None
+    previous_files = previous.get("files")
+    if not isinstance(previous_files, dict):
+        previous_files = {}
+
+    files: dict[str, str] = {}
+    stats = {"written": 0, "linked": 0, "removed": 0}
+
+    def unchanged(relative: str, fingerprint: str) -> bool:
+        files[relative] = fingerprint
+        return previous_files.get(relative) == fingerprint and (output / relative).is_file()
+
+    def write(relative: str, data: bytes) -> None:
+        if not unchanged(relative, hashlib.sha256(data).hexdigest()):
+            _write_export_file(output, relative, data)
+            stats["written"] += 1
+
+    def link(relative: str, source: Path, fingerprint: str) -> None:
+        if not unchanged(relative, fingerprint):
+            _link_export_file(output, relative, source)
+            stats["linked"] += 1
+
+    with current_app.test_request_context("/", base_url=key["base_url"]):
+        g.static_export = True
+        session["locale"] = locale
+        albums = public_albums()
+        scopes = [None, *(album["id"] for album in albums)]
+        feeds = {album_id: _export_feed_pages(album_id) for album_id in scopes}
+        for album_id, pages in feeds.items():
+            for number, page in enumerate(pages, start=1):
+                write(f"feed/{album_id or 'all'}/{number}.json", page)
+        initial_pages = feeds[albums[0]["id"] if albums else None]
+        write(
+            "index.html",
+            render_index(
+                csrf_token=lambda: "",
+                next_cursor="2" if len(initial_pages) > 1 else None,
+                static_feed_root="/feed",
+            ).encode("utf-8"),
+        )
+        if locale in CLIENT_CATALOGS:
+            digest, body = compiled_catalog(locale)
+            write(f"i18n/{digest}/{locale}.js", body)
+        write("sitemap.xml", sitemap().get_data())
+        write("robots.txt", robots().get_data())
+
+    rows = get_db().execute(
+        """
+        SELECT p.storage_name, p.derivatives
+        FROM photos p
+        JOIN albums a ON a.id = p.album_id AND a.user_id = p.user_id
+        WHERE p.status = 'ready' AND a.status = 'published'
+        """
+    ).fetchall()
+    for row in rows:
+        for variant in photo_variants(row["derivatives"]):
+            source = stored_media_path(variant, row["storage_name"])
+            if source.is_file():
+                # Storage names never point at different bytes, so presence is enough.
+                link(f"media/{variant}/{row['storage_name']}", source, "media")
+    site_media_root = Path(current_app.config["SITE_MEDIA_ROOT"])
+    for slot, storage_name in get_site_images().items():
+        if storage_name and (site_media_root / storage_name).is_file():
+            link(f"site-media/{slot}/{storage_name}", site_media_root / storage_name, "media")
+    for relative, path in assets.items():
+        stat = path.stat()
+        link(relative, path, f"{stat.st_size}:{stat.st_mtime_ns}")
+
+    for relative in previous_files:
+        stale = (output / str(relative)).resolve()
+        if relative not in files and stale.is_relative_to(output) and stale.is_file():
+            stale.unlink()
+            stats["removed"] += 1
+    _write_export_file(
+        output,
+        EXPORT_MANIFEST,
+        json.dumps({"key": key, "files": files}, indent=2).encode("utf-8"),
+    )
+    return stats
+
+
 @click.command("init-db")
 @with_appcontext
 def init_db_command():
@@ -219,7 +469,7 @@ def seed_demo_command():
                     name,
                     role,
                     status,
-                    generate_password_hash(password),
+                    hash_password(password),
                     must_change,
                     initial,
                 ),
@@ -262,8 +512,9 @@ def seed_demo_command():
                 """
                 INSERT INTO photos (
                     user_id, album_id, storage_name, original_name, title, story,
-                    status, mime_type, width, height, size_bytes
-                ) VALUES (?, ?, ?, ?, ?, ?, 'ready', 'image/webp', ?, ?, ?)
+                    status, mime_type, width, height, size_bytes, derivatives,
+                    placeholder, dominant_color, perceptual_hash
+                ) VALUES (?, ?, ?, ?, ?, ?, 'ready', 'image/webp', ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     user_ids[username],
@@ -275,6 +526,10 @@ def seed_demo_command():
                     processed["width"],
                     processed["height"],
                     processed["size_bytes"],
+                    processed["derivatives"],
+                    processed["placeholder"],
+                    processed["dominant_color"],
+                    processed["perceptual_hash"],
                 ),
             )
 
@@ -295,8 +550,156 @@ def seed_demo_command():
     click.echo("普通用户：zhou.wang / fabula-user-2026")
 
 
+@click.command("export-static")
+@click.argument("output", type=click.Path(file_okay=False, path_type=Path))
+@click.option("--base-url", required=True)
+@click.option(
+    "--locale",
+    type=click.Choice(sorted(SUPPORTED_LOCALES)),
+    default=DEFAULT_LOCALE,
+    show_default=True,
+)
+@click.option("--force", is_flag=True)
+@with_appcontext
+def export_static_command(output: Path, base_url: str, locale: str, force: bool):
+    stats = export_static(output, base_url, locale, force)
+    if stats is None:
+        click.echo("静态站点已是最新，无需重新导出。")
+        return
+    click.echo(
+        f"静态站点已导出：写入 {stats['written']} 个文件，"
+        f"链接 {stats['linked']} 个文件，删除 {stats['removed']} 个文件。"
+    )
+
+
+@click.command("benchmark-password-hash")
+@click.option("--target-ms", type=click.IntRange(50, 2_000), default=250, show_default=True)
+@with_appcontext
+def benchmark_password_hash_command(target_ms: int):
+    results = benchmark_hash_methods(target_ms)
+    for method, elapsed_ms in results:
+        click.echo(f"{method}: {elapsed_ms:.0f} ms")
+    within_target = [method for method, elapsed_ms in results if elapsed_ms <= target_ms]
+    if not within_target:
+        raise click.ClickException("最低强度的哈希参数也超过目标耗时，请提高 --target-ms")
+    recommended = within_target[-1]
+    click.echo(f"建议设置 FABULA_PASSWORD_HASH_METHOD={recommended}")
+    if recommended != current_app.config["PASSWORD_HASH_METHOD"]:
+        click.echo("修改后，用户下次登录时会自动按新参数重新计算密码哈希。")
+
+
+@click.command("benchmark-feed")
+@click.option(
+    "--size",
+    "sizes",
+    type=click.IntRange(1, 5_000),
+    multiple=True,
+    default=(24, 500),
+    show_default=True,
+)
+@click.option("--rounds", type=click.IntRange(1, 10_000), default=200, show_default=True)
+@with_appcontext
+def benchmark_feed_command(sizes: tuple[int, ...], rounds: int):
+    with current_app.test_request_context("/"):
+        results = benchmark_feed_serialization(sizes, rounds)
+        click.echo(f"JSON: {json_provider_name()}")
+    for result in results:
+        click.echo(
+            f"{result['size']} 张/页："
+            f"序列化 {result['serialize_ms']:.2f} ms，"
+            f"items 编码 {result['items_ms']:.2f} ms（{result['items_bytes']} 字节），"
+            f"compact 编码 {result['compact_ms']:.2f} ms（{result['compact_bytes']} 字节）"
+        )
+
+
+@click.command("turnstile-standin")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=click.IntRange(1, 65_535), default=8788, show_default=True)
+@click.option("--hostname", "reply_hostname", default="localhost", show_default=True)
+@click.option("--delay-ms", type=click.IntRange(0, 60_000), default=0, show_default=True)
+def turnstile_standin_command(host: str, port: int, reply_hostname: str, delay_ms: int):
+    server = StandInSiteverifyServer((host, port), reply_hostname, delay_ms=delay_ms)
+    click.echo(
+        f"本地 Siteverify 已启动：http://{host}:{server.server_port}/turnstile/v0/siteverify"
+        "（以 fail 开头的令牌会被拒绝）"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@click.command("object-store-standin")
+@click.option(
+    "--root",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=Path("var/object-store"),
+    show_default=True,
+)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=click.IntRange(1, 65_535), default=8789, show_default=True)
+@click.option("--access-key", default="fabula-local", show_default=True)
+def object_store_standin_command(root: Path, host: str, port: int, access_key: str):
+    server = StandInObjectStoreServer((host, port), root, access_key)
+    click.echo(
+        f"本地对象存储已启动：http://{host}:{server.server_port}"
+        f"（数据目录 {root}，访问密钥 {access_key}）"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@click.command("build-assets")
+@with_appcontext
+def build_assets_command():
+    output_root = Path(current_app.config["ASSET_BUILD_ROOT"])
+    manifest = build_assets(Path(current_app.static_folder), output_root)
+    load_asset_manifest(current_app)
+    click.echo(f"已生成 {len(manifest)} 个带指纹的静态资源：{output_root}")
+
+
+@click.command("backfill-image-features")
+@click.option("--batch-size", type=click.IntRange(1, 1_000), default=100, show_default=True)
+@with_appcontext
+def backfill_image_features_command(batch_size: int):
+    stats = backfill_image_features(batch_size)
+    click.echo(
+        f"占位图与感知哈希已补齐：更新 {stats['updated']} 张照片，"
+        f"{stats['failed']} 张因缩略图无法读取而跳过。"
+    )
+
+
+@click.command("migrate-media-layout")
+@click.option("--batch-size", type=click.IntRange(1, 100_000), default=1_000, show_default=True)
+@click.option("--pause-ms", type=click.IntRange(0, 60_000), default=0, show_default=True)
+@with_appcontext
+def migrate_media_layout_command(batch_size: int, pause_ms: int):
+    if current_app.config["MEDIA_STORAGE"] != "local":
+        raise click.ClickException("只有本地媒体存储需要迁移目录布局")
+    total = 0
+    while moved := migrate_media_batch(batch_size):
+        total += moved
+        click.echo(f"已迁移 {total} 个文件……")
+        time.sleep(pause_ms / 1000)
+    click.echo(f"媒体目录已全部分层存放，本次迁移 {total} 个文件。")
+
+
 def init_app(app) -> None:
     app.cli.add_command(init_db_command)
     app.cli.add_command(bootstrap_admin_command)
     app.cli.add_command(reset_admin_password_command)
     app.cli.add_command(seed_demo_command)
+    app.cli.add_command(export_static_command)
+    app.cli.add_command(backfill_image_features_command)
+    app.cli.add_command(migrate_media_layout_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(benchmark_password_hash_command)
+    app.cli.add_command(benchmark_feed_command)
+    app.cli.add_command(turnstile_standin_command)
+    app.cli.add_command(object_store_standin_command)
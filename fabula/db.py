@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import base64
+import binascii
+import json
 import sqlite3
+import threading
 from pathlib import Path
 
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request
 
 
 SCHEMA = """
@@ -56,10 +60,17 @@ CREATE TABLE IF NOT EXISTS photos (
     story TEXT NOT NULL DEFAULT '',
     status TEXT NOT NULL DEFAULT 'ready'
         CHECK (status IN ('processing', 'ready', 'failed')),
+    processing_error TEXT NOT NULL DEFAULT '',
+    processing_started_at TEXT,
     mime_type TEXT NOT NULL DEFAULT 'image/webp',
     width INTEGER NOT NULL DEFAULT 0,
     height INTEGER NOT NULL DEFAULT 0,
     size_bytes INTEGER NOT NULL DEFAULT 0,
+    derivatives TEXT NOT NULL DEFAULT '',
+    placeholder TEXT NOT NULL DEFAULT '',
+    dominant_color TEXT NOT NULL DEFAULT '',
+    content_hash TEXT,
+    perceptual_hash TEXT,
     created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
     updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
     FOREIGN KEY (album_id, user_id) REFERENCES albums(id, user_id) ON DELETE RESTRICT
@@ -105,6 +116,28 @@ CREATE TABLE IF NOT EXISTS photo_revisions (
     revision INTEGER NOT NULL DEFAULT 0
 );
 
+CREATE TABLE IF NOT EXISTS publication_counters (
+    scope TEXT NOT NULL CHECK (scope IN ('site', 'album', 'user')),
+    scope_id INTEGER NOT NULL,
+    photo_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, scope_id)
+);
+
+CREATE TABLE IF NOT EXISTS publication_revision (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    revision INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS media_epoch (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    epoch INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_revision (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    revision INTEGER NOT NULL DEFAULT 0
+);
+
 CREATE TABLE IF NOT EXISTS media_cleanup_queue (
     storage_name TEXT NOT NULL,
     media_kind TEXT NOT NULL CHECK (media_kind IN ('photo', 'site')),
@@ -115,9 +148,11 @@ CREATE TABLE IF NOT EXISTS media_cleanup_queue (
 );
 
 CREATE INDEX IF NOT EXISTS idx_albums_user ON albums(user_id);
-CREATE INDEX IF NOT EXISTS idx_photos_user_created ON photos(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_photos_user_created_id
+    ON photos(user_id, created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_photos_album ON photos(album_id);
-CREATE INDEX IF NOT EXISTS idx_photos_status_created ON photos(status, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_photos_status_created_id
+    ON photos(status, created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_login_attempts_fingerprint_time
     ON login_attempts(fingerprint, attempted_at);
 CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_events(created_at DESC);
@@ -145,30 +180,477 @@ BEGIN
     VALUES (OLD.user_id, 1)
     ON CONFLICT(user_id) DO UPDATE SET revision = revision + 1;
 END;
+
+CREATE TRIGGER IF NOT EXISTS photos_counters_after_insert
+AFTER INSERT ON photos
+WHEN NEW.status = 'ready'
+BEGIN
+    INSERT INTO publication_counters (scope, scope_id, photo_count)
+    SELECT scope, scope_id, 1
+    FROM (
+        SELECT 'site' AS scope, 0 AS scope_id
+        UNION ALL SELECT 'album', NEW.album_id
+        UNION ALL SELECT 'user', NEW.user_id
+    )
+    WHERE EXISTS (
+        SELECT 1 FROM albums
+        WHERE id = NEW.album_id AND user_id = NEW.user_id AND status = 'published'
+    )
+    ON CONFLICT(scope, scope_id) DO UPDATE SET photo_count = photo_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_counters_after_update
+AFTER UPDATE OF status, album_id, user_id ON photos
+BEGIN
+    UPDATE publication_counters
+    SET photo_count = photo_count - 1
+    WHERE OLD.status = 'ready'
+        AND (
+            (scope = 'site' AND scope_id = 0)
+            OR (scope = 'album' AND scope_id = OLD.album_id)
+            OR (scope = 'user' AND scope_id = OLD.user_id)
+        )
+        AND EXISTS (
+            SELECT 1 FROM albums
+            WHERE id = OLD.album_id AND user_id = OLD.user_id AND status = 'published'
+        );
+    INSERT INTO publication_counters (scope, scope_id, photo_count)
+    SELECT scope, scope_id, 1
+    FROM (
+        SELECT 'site' AS scope, 0 AS scope_id
+        UNION ALL SELECT 'album', NEW.album_id
+        UNION ALL SELECT 'user', NEW.user_id
+    )
+    WHERE NEW.status = 'ready'
+        AND EXISTS (
+            SELECT 1 FROM albums
+            WHERE id = NEW.album_id AND user_id = NEW.user_id AND status = 'published'
+        )
+    ON CONFLICT(scope, scope_id) DO UPDATE SET photo_count = photo_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_counters_after_delete
+AFTER DELETE ON photos
+WHEN OLD.status = 'ready'
+BEGIN
+    UPDATE publication_counters
+    SET photo_count = photo_count - 1
+    WHERE (
+            (scope = 'site' AND scope_id = 0)
+            OR (scope = 'album' AND scope_id = OLD.album_id)
+            OR (scope = 'user' AND scope_id = OLD.user_id)
+        )
+        AND EXISTS (
+            SELECT 1 FROM albums
+            WHERE id = OLD.album_id AND user_id = OLD.user_id AND status = 'published'
+        );
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_counters_after_status
+AFTER UPDATE OF status ON albums
+WHEN (OLD.status = 'published') <> (NEW.status = 'published')
+BEGIN
+    INSERT INTO publication_counters (scope, scope_id, photo_count)
+    SELECT scope, scope_id, delta
+    FROM (
+        SELECT 'site' AS scope, 0 AS scope_id
+        UNION ALL SELECT 'album', NEW.id
+        UNION ALL SELECT 'user', NEW.user_id
+    )
+    JOIN (
+        SELECT COUNT(*) * (CASE WHEN NEW.status = 'published' THEN 1 ELSE -1 END) AS delta
+        FROM photos
+        WHERE album_id = NEW.id AND user_id = NEW.user_id AND status = 'ready'
+    )
+    WHERE delta <> 0
+    ON CONFLICT(scope, scope_id) DO UPDATE
+    SET photo_count = photo_count + excluded.photo_count;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_counters_after_delete
+AFTER DELETE ON albums
+BEGIN
+    DELETE FROM publication_counters WHERE scope = 'album' AND scope_id = OLD.id;
+END;
 """
 
+# These triggers read columns added by migrations, so they are installed only
+# after the migrations have run.
+PUBLICATION_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS photos_publication_after_insert
+AFTER INSERT ON photos
+WHEN NEW.status = 'ready' AND EXISTS (
+    SELECT 1 FROM albums
+    WHERE id = NEW.album_id AND user_id = NEW.user_id AND status = 'published'
+)
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
 
-def get_db() -> sqlite3.Connection:
-    if "db" not in g:
-        database_path = Path(current_app.config["DATABASE_PATH"])
-        database_path.parent.mkdir(parents=True, exist_ok=True)
+CREATE TRIGGER IF NOT EXISTS photos_publication_after_update
+AFTER UPDATE ON photos
+WHEN EXISTS (
+    SELECT 1 FROM albums
+    WHERE id = OLD.album_id AND user_id = OLD.user_id AND status = 'published'
+) OR EXISTS (
+    SELECT 1 FROM albums
+    WHERE id = NEW.album_id AND user_id = NEW.user_id AND status = 'published'
+)
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_publication_after_delete
+AFTER DELETE ON photos
+WHEN EXISTS (
+    SELECT 1 FROM albums
+    WHERE id = OLD.album_id AND user_id = OLD.user_id AND status = 'published'
+)
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_publication_after_insert
+AFTER INSERT ON albums
+WHEN NEW.status = 'published'
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_publication_after_update
+AFTER UPDATE ON albums
+WHEN OLD.status = 'published' OR NEW.status = 'published'
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_publication_after_delete
+AFTER DELETE ON albums
+WHEN OLD.status = 'published'
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_publication_after_update
+AFTER UPDATE OF display_name ON users
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS about_blocks_publication_after_insert
+AFTER INSERT ON about_blocks
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS about_blocks_publication_after_update
+AFTER UPDATE ON about_blocks
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS about_blocks_publication_after_delete
+AFTER DELETE ON about_blocks
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS site_settings_publication_after_insert
+AFTER INSERT ON site_settings
+WHEN NEW.key IN ('site_copy', 'site_images')
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS site_settings_publication_after_update
+AFTER UPDATE ON site_settings
+WHEN NEW.key IN ('site_copy', 'site_images')
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS site_settings_publication_after_delete
+AFTER DELETE ON site_settings
+WHEN OLD.key IN ('site_copy', 'site_images')
+BEGIN
+    INSERT INTO publication_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_revision_after_update
+AFTER UPDATE OF
+    username, display_name, role, status, password_hash, must_change_password,
+    temporary_password_expires_at, session_version, locale
+ON users
+BEGIN
+    INSERT INTO user_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_revision_after_delete
+AFTER DELETE ON users
+BEGIN
+    INSERT INTO user_revision (id, revision)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET revision = revision + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_media_epoch_after_update
+AFTER UPDATE OF status, album_id, user_id ON photos
+WHEN OLD.status = 'ready'
+    AND (
+        NEW.status <> 'ready'
+        OR NEW.album_id IS NOT OLD.album_id
+        OR NEW.user_id <> OLD.user_id
+    )
+    AND EXISTS (
+        SELECT 1 FROM albums
+        WHERE id = OLD.album_id AND user_id = OLD.user_id AND status = 'published'
+    )
+BEGIN
+    INSERT INTO media_epoch (id, epoch)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET epoch = epoch + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_media_epoch_after_delete
+AFTER DELETE ON photos
+WHEN OLD.status = 'ready'
+    AND EXISTS (
+        SELECT 1 FROM albums
+        WHERE id = OLD.album_id AND user_id = OLD.user_id AND status = 'published'
+    )
+BEGIN
+    INSERT INTO media_epoch (id, epoch)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET epoch = epoch + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_media_epoch_after_update
+AFTER UPDATE OF status ON albums
+WHEN OLD.status = 'published' AND NEW.status <> 'published'
+BEGIN
+    INSERT INTO media_epoch (id, epoch)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET epoch = epoch + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS albums_media_epoch_after_delete
+AFTER DELETE ON albums
+WHEN OLD.status = 'published'
+BEGIN
+    INSERT INTO media_epoch (id, epoch)
+    VALUES (1, 1)
+    ON CONFLICT(id) DO UPDATE SET epoch = epoch + 1;
+END;
+"""
+
+
+CONNECTION_POOLS_KEY = "fabula.db_pools"
+READ_ONLY_METHODS = frozenset({"GET", "HEAD"})
+# Writers trade the fsync on every commit for one per checkpoint; under WAL a
+# power loss can only drop the most recent commits, never corrupt the file.
+WRITER_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA wal_autocheckpoint = 2000",
+)
+READER_PRAGMAS = (
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA cache_size = -16384",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA query_only = ON",
+)
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections, one per thread, configured once.
+
+    A thread that asks for a second connection while its own is checked out
+    (a nested application context) gets a private one that is closed on
+    release, so the outer transaction is never rolled back underneath it.
+    """
+
+    def __init__(self, database_path: Path, pragmas: tuple[str, ...]):
+        self.database_path = Path(database_path)
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: dict[int, sqlite3.Connection] = {}
+        self._in_use = 0
+        self._counters = {
+            "created": 0,
+            "reused": 0,
+            "overflow": 0,
+            "discarded": 0,
+            "rolled_back": 0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
         connection = sqlite3.connect(
-            database_path,
+            self.database_path,
             detect_types=sqlite3.PARSE_DECLTYPES,
             timeout=10,
+            check_same_thread=False,
         )
         connection.row_factory = sqlite3.Row
-        connection.execute("PRAGMA foreign_keys = ON")
-        connection.execute("PRAGMA journal_mode = WAL")
-        connection.execute("PRAGMA busy_timeout = 10000")
-        g.db = connection
+        for pragma in self.pragmas:
+            connection.execute(pragma)
+        return connection
+
+    def _count(self, name: str, in_use: int = 0) -> None:
+        with self._lock:
+            self._counters[name] += 1
+            self._in_use += in_use
+
+    def _discard(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+            self._counters["discarded"] += 1
+        self._local.connection = None
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self) -> sqlite3.Connection:
+        if getattr(self._local, "checked_out", False):
+            self._count("overflow", 1)
+            return self._connect()
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            try:
+                connection.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                self._discard(connection)
+                connection = None
+        if connection is None:
+            connection = self._connect()
+            alive = {thread.ident for thread in threading.enumerate()}
+            with self._lock:
+                for ident in [ident for ident in self._connections if ident not in alive]:
+                    self._connections.pop(ident).close()
+                self._connections[threading.get_ident()] = connection
+                self._counters["created"] += 1
+                self._in_use += 1
+            self._local.connection = connection
+        else:
+            self._count("reused", 1)
+        self._local.checked_out = True
+        return connection
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            self._in_use -= 1
+        if connection is not getattr(self._local, "connection", None):
+            connection.close()
+            return
+        self._local.checked_out = False
+        if connection.in_transaction:
+            try:
+                connection.rollback()
+            except sqlite3.Error:
+                self._discard(connection)
+                return
+            self._count("rolled_back")
+
+    def close(self) -> None:
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "open": len(self._connections),
+                "in_use": self._in_use,
+                **self._counters,
+            }
+
+
+def connection_pool(profile: str = "writer") -> ConnectionPool:
+    return current_app.extensions[CONNECTION_POOLS_KEY][profile]
+
+
+def get_db() -> sqlite3.Connection:
+    """Return the reader for GET and HEAD requests and the writer otherwise.
+
+    Once a context holds the writer it keeps using it, so a request never
+    reads around its own uncommitted changes.
+    """
+    if "db" in g:
+        return g.db
+    if has_request_context() and request.method in READ_ONLY_METHODS:
+        if "db_reader" not in g:
+            g.db_reader = connection_pool("reader").acquire()
+        return g.db_reader
+    g.db = connection_pool().acquire()
     return g.db
 
 
+def encode_cursor(values: tuple) -> str:
+    payload = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str | None, size: int) -> tuple | None:
+    """Decode a pagination cursor, raising ValueError if it is malformed."""
+    if not token:
+        return None
+    if len(token) > 512:
+        raise ValueError("cursor is too long")
+    try:
+        payload = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as error:
+        raise ValueError("cursor is not decodable") from error
+    if (
+        not isinstance(values, list)
+        or len(values) != size
+        or not isinstance(values[-1], int)
+        or isinstance(values[-1], bool)
+        or not isinstance(values[-2], str)
+    ):
+        raise ValueError("cursor has an unexpected shape")
+    return tuple(values)
+
+
 def close_db(_error: BaseException | None = None) -> None:
-    connection = g.pop("db", None)
-    if connection is not None:
-        connection.close()
+    for key, profile in (("db", "writer"), ("db_reader", "reader")):
+        connection = g.pop(key, None)
+        if connection is not None:
+            connection_pool(profile).release(connection)
 
 
 def _column_names(connection: sqlite3.Connection, table: str) -> set[str]:
@@ -275,12 +757,130 @@ def _migration_album_publication(connection: sqlite3.Connection) -> None:
     )
 
 
+def _migration_photo_processing_error(connection: sqlite3.Connection) -> None:
+    if "processing_error" in _column_names(connection, "photos"):
+        return
+    connection.execute(
+        "ALTER TABLE photos ADD COLUMN processing_error TEXT NOT NULL DEFAULT ''"
+    )
+
+
+def _migration_photo_derivatives(connection: sqlite3.Connection) -> None:
+    if "derivatives" in _column_names(connection, "photos"):
+        return
+    connection.execute(
+        "ALTER TABLE photos ADD COLUMN derivatives TEXT NOT NULL DEFAULT ''"
+    )
+
+
+def _migration_photo_placeholders(connection: sqlite3.Connection) -> None:
+    columns = _column_names(connection, "photos")
+    if "placeholder" not in columns:
+        connection.execute(
+            "ALTER TABLE photos ADD COLUMN placeholder TEXT NOT NULL DEFAULT ''"
+        )
+    if "dominant_color" not in columns:
+        connection.execute(
+            "ALTER TABLE photos ADD COLUMN dominant_color TEXT NOT NULL DEFAULT ''"
+        )
+
+
+def _migration_photo_content_hash(connection: sqlite3.Connection) -> None:
+    if "content_hash" not in _column_names(connection, "photos"):
+        connection.execute("ALTER TABLE photos ADD COLUMN content_hash TEXT")
+    connection.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_photos_user_content_hash
+        ON photos(user_id, content_hash)
+        WHERE content_hash IS NOT NULL
+        """
+    )
+
+
+def _migration_photo_perceptual_hash(connection: sqlite3.Connection) -> None:
+    if "perceptual_hash" in _column_names(connection, "photos"):
+        return
+    connection.execute("ALTER TABLE photos ADD COLUMN perceptual_hash TEXT")
+
+
+def _migration_photo_processing_claim(connection: sqlite3.Connection) -> None:
+    if "processing_started_at" in _column_names(connection, "photos"):
+        return
+    connection.execute("ALTER TABLE photos ADD COLUMN processing_started_at TEXT")
+
+
+def _migration_keyset_indexes(connection: sqlite3.Connection) -> None:
+    connection.execute("DROP INDEX IF EXISTS idx_photos_user_created")
+    connection.execute("DROP INDEX IF EXISTS idx_photos_status_created")
+    connection.execute("DROP INDEX IF EXISTS idx_photos_album_position")
+    connection.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_photos_album_order
+        ON photos(album_id, album_position, created_at DESC, id DESC)
+        """
+    )
+
+
+def rebuild_publication_counters(connection: sqlite3.Connection) -> None:
+    """Recompute every publication counter from the photos and albums tables."""
+    connection.execute("DELETE FROM publication_counters")
+    connection.execute(
+        """
+        WITH published AS (
+            SELECT p.user_id, p.album_id
+            FROM photos p
+            JOIN albums a ON a.id = p.album_id AND a.user_id = p.user_id
+            WHERE p.status = 'ready' AND a.status = 'published'
+        )
+        INSERT INTO publication_counters (scope, scope_id, photo_count)
+        SELECT 'site', 0, COUNT(*) FROM published
+        UNION ALL
+        SELECT 'album', album_id, COUNT(*) FROM published GROUP BY album_id
+        UNION ALL
+        SELECT 'user', user_id, COUNT(*) FROM published GROUP BY user_id
+        """
+    )
+
+
+def publication_total(scope: str = "site", scope_id: int = 0) -> int:
+    row = get_db().execute(
+        "SELECT photo_count FROM publication_counters WHERE scope = ? AND scope_id = ?",
+        (scope, scope_id),
+    ).fetchone()
+    return max(row["photo_count"], 0) if row is not None else 0
+
+
+def publication_revision() -> int:
+    row = get_db().execute(
+        "SELECT revision FROM publication_revision WHERE id = 1"
+    ).fetchone()
+    return row["revision"] if row is not None else 0
+
+
+def media_epoch() -> int:
+    row = get_db().execute("SELECT epoch FROM media_epoch WHERE id = 1").fetchone()
+    return row["epoch"] if row is not None else 0
+
+
+def user_revision() -> int:
+    row = get_db().execute("SELECT revision FROM user_revision WHERE id = 1").fetchone()
+    return row["revision"] if row is not None else 0
+
+
 MIGRATIONS = (
     (1, _migration_user_locale),
     (2, _migration_album_position),
     (3, _migration_temporary_password_expiry),
     (4, _migration_revision_and_cleanup_tables),
     (5, _migration_album_publication),
+    (6, _migration_photo_processing_error),
+    (7, _migration_photo_derivatives),
+    (8, _migration_keyset_indexes),
+    (9, rebuild_publication_counters),
+    (10, _migration_photo_placeholders),
+    (11, _migration_photo_content_hash),
+    (12, _migration_photo_perceptual_hash),
+    (13, _migration_photo_processing_claim),
 )
 
 
@@ -309,9 +909,14 @@ def init_db() -> None:
     connection = get_db()
     connection.executescript(SCHEMA)
     _apply_migrations(connection)
+    connection.executescript(PUBLICATION_TRIGGERS)
 
 
 def init_app(app) -> None:
+    app.extensions[CONNECTION_POOLS_KEY] = {
+        "writer": ConnectionPool(app.config["DATABASE_PATH"], WRITER_PRAGMAS),
+        "reader": ConnectionPool(app.config["DATABASE_PATH"], READER_PRAGMAS),
+    }
     app.teardown_appcontext(close_db)
     with app.app_context():
         init_db()
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
-from flask import g, has_request_context, session
+import hashlib
+import json
+from functools import cache
+
+from flask import abort, current_app, g, has_request_context, session, url_for
 
 
 DEFAULT_LOCALE = "zh-CN"
@@ -198,6 +202,7 @@ ENGLISH_TRANSLATIONS = {
     "完成 {current} / {total}": "Completed {current} / {total}",
     "{count} 张照片已加入你的档案": "{count} photos added to your archive",
     "全部照片已在另一个会话中更新": "Your photos were updated in another session",
+    "照片处理状态已更新": "Photo processing status updated",
     "照片已重新归类": "Photo moved to another album",
     "删除这张照片和它的故事？此操作无法在工作台中撤销。": "Delete this photo and its story? This cannot be undone in the studio.",
     "删除已选择的 {count} 张照片？": "Delete the {count} selected photos?",
@@ -285,6 +290,8 @@ ENGLISH_TRANSLATIONS = {
     "只有管理员可以执行此操作": "Only administrators can perform this action.",
     "安全令牌已失效，请刷新页面后重试": "The security token expired. Refresh the page and try again.",
     "登录尝试过多，请稍后再试。": "Too many sign-in attempts. Try again later.",
+    "登录请求较多，请稍后再试。": "The server is busy with other sign-ins. Try again shortly.",
+    "服务器繁忙，请稍后再试。": "The server is busy. Try again shortly.",
     "账号或密码不正确。": "The username or password is incorrect.",
     "请完成人机验证后重试。": "Complete the verification and try again.",
     "人机验证暂时不可用，请稍后再试。": "Verification is temporarily unavailable. Try again later.",
@@ -347,6 +354,7 @@ ENGLISH_TRANSLATIONS = {
     "图片像素数量超过安全处理限制": "The image exceeds the safe pixel limit.",
     "图片尺寸过小": "The image dimensions are too small.",
     "图片文件无效或无法安全处理": "The image is invalid or cannot be processed safely.",
+    "上传在处理完成前中断，请重新上传": "The upload was interrupted before processing finished. Upload it again.",
     "站点配色方案无效": "Invalid site palette.",
     "站点图片位置无效": "Invalid site image placement.",
     "请选择站点图片": "Choose a site image.",
@@ -378,18 +386,64 @@ def translate(message: str, **values: object) -> str:
     return translated.format(**values) if values else translated
 
 
-def client_catalog() -> dict[str, str]:
-    return ENGLISH_TRANSLATIONS if get_locale() == "en" else {}
+CLIENT_CATALOGS = {"en": ENGLISH_TRANSLATIONS}
+CATALOG_MAX_AGE = 31536000
+
+
+@cache
+def compiled_catalog(locale: str) -> tuple[str, bytes]:
+    body = (
+        "window.FabulaCatalog = "
+        + json.dumps(
+            CLIENT_CATALOGS[locale],
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        + ";\n"
+    ).encode("utf-8")
+    return hashlib.sha256(body).hexdigest()[:12], body
+
+
+def client_catalog_url() -> str | None:
+    # The source locale needs no catalog; other locales load a script whose
+    # URL changes only when the translations do.
+    locale = get_locale()
+    if locale not in CLIENT_CATALOGS:
+        return None
+    digest, _body = compiled_catalog(locale)
+    return url_for("i18n_catalog", digest=digest, locale=locale)
+
+
+def client_catalog_asset(digest: str, locale: str):
+    if locale not in CLIENT_CATALOGS:
+        abort(404)
+    current_digest, body = compiled_catalog(locale)
+    response = current_app.response_class(body, mimetype="text/javascript")
+    if digest == current_digest:
+        response.cache_control.public = True
+        response.cache_control.max_age = CATALOG_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # A page cached before a deploy still gets today's strings.
+        response.cache_control.no_cache = True
+    return response
 
 
 def init_app(app) -> None:
+    app.add_url_rule(
+        "/i18n/<digest>/<locale>.js",
+        endpoint="i18n_catalog",
+        view_func=client_catalog_asset,
+    )
+
     @app.context_processor
     def inject_i18n_context():
         locale = get_locale()
         return {
             "t": translate,
             "current_locale": locale,
-            "client_i18n": client_catalog(),
+            "client_i18n_url": client_catalog_url(),
             "locale_switch_label": "English" if locale == "zh-CN" else "中文",
             "locale_switch_target": "en" if locale == "zh-CN" else "zh-CN",
         }
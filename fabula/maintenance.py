@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import threading
+import time
+from pathlib import Path
+
+from .db import get_db
+from .media import drain_media_deletions, resume_photo_processing, sweep_temp_files
+from .security import prune_login_attempts
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX development machines
+    fcntl = None
+
+
+MAINTENANCE_KEY = "fabula.maintenance"
+MAINTENANCE_TICK_SECONDS = 5.0
+
+
+def checkpoint_wal() -> list[int]:
+    busy, log_frames, checkpointed = get_db().execute(
+        "PRAGMA wal_checkpoint(PASSIVE)"
+    ).fetchone()
+    return [busy, log_frames, checkpointed]
+
+
+def optimize_database() -> None:
+    get_db().execute("PRAGMA optimize")
+
+
+MAINTENANCE_JOBS = (
+    ("media_cleanup", 60, drain_media_deletions),
+    ("photo_processing", 60, resume_photo_processing),
+    ("login_attempts", 300, prune_login_attempts),
+    ("wal_checkpoint", 300, checkpoint_wal),
+    ("temp_sweep", 3600, sweep_temp_files),
+    ("optimize", 21_600, optimize_database),
+)
+
+
+class MaintenanceScheduler:
+    """Runs periodic upkeep jobs on one thread in one worker process.
+
+    Workers compete for an exclusive lock on a file beside the database; the
+    holder runs the jobs and the others keep retrying, so a new leader takes
+    over as soon as the old process exits.
+    """
+
+    def __init__(self, app, jobs=MAINTENANCE_JOBS):
+        self.app = app
+        self.jobs = jobs
+        self.lock_path = Path(app.config["DATABASE_PATH"]).with_name("maintenance.lock")
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._next_run = {name: 0.0 for name, _interval, _job in jobs}
+        self._stats = {
+            name: {
+                "interval_seconds": interval,
+                "runs": 0,
+                "failures": 0,
+                "last_run_at": None,
+                "last_duration_ms": None,
+                "last_result": None,
+                "last_error": "",
+            }
+            for name, interval, _job in jobs
+        }
+        self._stats_lock = threading.Lock()
+
+    @property
+    def leader(self) -> bool:
+        return self._lock_file is not None
+
+    def _try_lead(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._lock_file = lock_file
+        return True
+
+    def run_pending(self, now: float | None = None) -> list[str]:
+        if not self._try_lead():
+            return []
+        now = time.monotonic() if now is None else now
+        ran = []
+        for name, interval, job in self.jobs:
+            if now < self._next_run[name]:
+                continue
+            self._next_run[name] = now + interval
+            started = time.perf_counter()
+            error = ""
+            result = None
+            with self.app.app_context():
+                try:
+                    result = job()
+                except Exception as exc:
+                    error = f"{type(exc).__name__}: {exc}"[:500]
+                    self.app.logger.exception("Maintenance job %s failed", name)
+            with self._stats_lock:
+                stats = self._stats[name]
+                stats["runs"] += 1
+                stats["failures"] += bool(error)
+                stats["last_run_at"] = int(time.time())
+                stats["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                stats["last_result"] = result
+                stats["last_error"] = error
+            ran.append(name)
+        return ran
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                self.app.logger.exception("Maintenance scheduler pass failed")
+            self._stop.wait(MAINTENANCE_TICK_SECONDS)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name="fabula-maintenance",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "leader": self.leader,
+                "jobs": {name: dict(values) for name, values in self._stats.items()},
+            }
+
+
+def maintenance_scheduler(app) -> MaintenanceScheduler:
+    return app.extensions[MAINTENANCE_KEY]
+
+
+def init_app(app) -> None:
+    scheduler = MaintenanceScheduler(app)
+    app.extensions[MAINTENANCE_KEY] = scheduler
+    if not app.config["MAINTENANCE_ENABLED"] or app.testing:
+        return
+
+    # Started by the first request, so only processes that serve the app run
+    # upkeep; `flask` commands such as build-assets or export-static load the
+    # app without ever handling a request.
+    @app.before_request
+    def start_maintenance():
+        if not scheduler.running:
+            scheduler.start()
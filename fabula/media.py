@@ -1,10 +1,20 @@
 from __future__ import annotations
 
+import base64
+import hashlib
+import multiprocessing
 import os
 import re
+import shutil
 import tempfile
 import threading
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import BytesIO
 from pathlib import Path
 
 from flask import current_app
@@ -13,16 +23,28 @@ from pillow_heif import register_heif_opener
 
 from .db import get_db
 from .i18n import translate
+from .storage import media_storage
 
 
 STORAGE_PATTERN = re.compile(r"^[a-f0-9]{32}\.webp$")
+DERIVATIVE_VARIANT_PATTERN = re.compile(r"^w[0-9]{3,4}$")
 SITE_STORAGE_PATTERN = re.compile(r"^(home|login)-[a-f0-9]{32}\.webp$")
 SITE_IMAGE_SLOTS = frozenset({"home", "login"})
 ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "HEIF"}
 HARD_MAX_IMAGE_PIXELS = 50_000_000
 ORIGINAL_MAX_SIZE = (2400, 2400)
+THUMB_MAX_SIZE = (1000, 1000)
+DEFAULT_IMAGE_LADDER = (480, 800, 1200, 1600)
+WORKER_MEMORY_FLOOR = 96 * 1024 * 1024
+ENCODER_OVERHEAD_BYTES = 16 * 1024 * 1024
+WORKER_MAX_TASKS = 64
+PLACEHOLDER_MAX_SIZE = (16, 16)
+PLACEHOLDER_QUALITY = 40
+DOMINANT_COLOR_SAMPLE_SIZE = (64, 64)
+DOMINANT_COLOR_PALETTE = 8
+# A processing claim not refreshed for this long belongs to a dead worker.
+PROCESSING_CLAIM_SECONDS = 300
 Image.MAX_IMAGE_PIXELS = HARD_MAX_IMAGE_PIXELS
-IMAGE_PROCESSING_LOCK = threading.Lock()
 
 register_heif_opener(
     thumbnails=False,
@@ -36,20 +58,147 @@ class InvalidImage(ValueError):
     pass
 
 
-def _paths(storage_name: str) -> tuple[Path, Path]:
-    media_root = Path(current_app.config["MEDIA_ROOT"])
-    return (
-        media_root / "original" / storage_name,
-        media_root / "thumbs" / storage_name,
-    )
+class ImageProcessingBusy(Exception):
+    """Raised when the memory budget stays exhausted past the queue timeout."""
+
+
+class MemoryBudget:
+    """Admits image jobs while their estimated decode memory fits the budget."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.reserved = 0
+        self._condition = threading.Condition()
+
+    def resize(self, capacity: int) -> None:
+        # Jobs admitted under the old capacity keep their reservations, so
+        # a smaller budget takes effect as they finish.
+        with self._condition:
+            self.capacity = capacity
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, amount: int, timeout: float | None = None):
+        with self._condition:
+            amount = min(max(amount, 1), self.capacity)
+            admitted = self._condition.wait_for(
+                lambda: self.reserved + amount <= self.capacity,
+                timeout,
+            )
+            if not admitted:
+                raise ImageProcessingBusy
+            self.reserved += amount
+        try:
+            yield amount
+        finally:
+            with self._condition:
+                self.reserved -= amount
+                self._condition.notify_all()
+
+
+_pool_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 0
+_budget: MemoryBudget | None = None
+
+
+def image_memory_budget() -> MemoryBudget:
+    global _budget
+    capacity = int(current_app.config["IMAGE_MEMORY_BUDGET_MB"]) * 1024 * 1024
+    with _pool_lock:
+        if _budget is None:
+            _budget = MemoryBudget(capacity)
+        elif _budget.capacity != capacity:
+            _budget.resize(capacity)
+        return _budget
+
+
+def image_worker_count() -> int:
+    configured = int(current_app.config["IMAGE_WORKERS"])
+    if configured <= 0:
+        return 0
+    budget = int(current_app.config["IMAGE_MEMORY_BUDGET_MB"]) * 1024 * 1024
+    return max(1, min(configured, budget // WORKER_MEMORY_FLOOR))
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=WORKER_MAX_TASKS,
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_process_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def media_shard(storage_name: str) -> str:
+    """Return the two-level fan-out directory of a storage name, e.g. ``3f/a2``.
+
+    Spreading files over 65,536 leaf directories keeps every directory small
+    enough for fast lookups and backups however large the library grows.
+    """
+    digest = hashlib.sha256(storage_name.encode("ascii")).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}"
+
 
+def media_key(variant: str, storage_name: str) -> str:
+    return f"{variant}/{media_shard(storage_name)}/{storage_name}"
 
-def _save_webp(image: Image.Image, destination: Path, quality: int) -> None:
+
+def stored_media_path(variant: str, storage_name: str) -> Path:
+    """Return a local path to read a media file from.
+
+    On local storage this is the file itself, sharded or, until
+    ``migrate-media-layout`` moves it, in the old flat layout. An object store
+    fetches the file into the node's disk cache first.
+    """
+    return media_storage().local_path(media_key(variant, storage_name))
+
+
+def derivative_variant(width: int) -> str:
+    return f"w{width}"
+
+
+def is_media_variant(name: str) -> bool:
+    return name in {"original", "thumbs"} or bool(DERIVATIVE_VARIANT_PATTERN.fullmatch(name))
+
+
+def photo_variants(derivatives: str | None) -> list[str]:
+    """Return the variants stored for a photo, whatever the ladder is now."""
+    return [
+        "original",
+        "thumbs",
+        *(derivative_variant(width) for width in parse_derivatives(derivatives)),
+    ]
+
+
+def format_derivatives(widths) -> str:
+    return ",".join(str(width) for width in sorted(set(widths)))
+
+
+def parse_derivatives(value: str | None) -> list[int]:
+    return [int(part) for part in (value or "").split(",") if part.isdigit()]
+
+
+def _save_webp(image: Image.Image, destination: Path, quality: int, temp_root: str) -> None:
     destination.parent.mkdir(parents=True, exist_ok=True)
     file_descriptor, temporary_name = tempfile.mkstemp(
         prefix="fabula-",
         suffix=".webp",
-        dir=current_app.config["TEMP_ROOT"],
+        dir=temp_root,
     )
     os.close(file_descriptor)
     temporary_path = Path(temporary_name)
@@ -66,29 +215,49 @@ def _save_webp(image: Image.Image, destination: Path, quality: int) -> None:
         temporary_path.unlink(missing_ok=True)
 
 
-def _validate_image_dimensions(image: Image.Image) -> None:
+def _image_limits() -> tuple[int, int]:
+    return (
+        current_app.config["MAX_IMAGE_DIMENSION"],
+        current_app.config["MAX_IMAGE_PIXELS"],
+    )
+
+
+def _validate_image_dimensions(image: Image.Image, limits: tuple[int, int]) -> None:
+    max_dimension, max_pixels = limits
     if (
-        image.width > current_app.config["MAX_IMAGE_DIMENSION"]
-        or image.height > current_app.config["MAX_IMAGE_DIMENSION"]
-        or image.width * image.height > current_app.config["MAX_IMAGE_PIXELS"]
+        image.width > max_dimension
+        or image.height > max_dimension
+        or image.width * image.height > max_pixels
     ):
-        raise InvalidImage(translate("图片像素数量超过安全处理限制"))
+        raise InvalidImage("图片像素数量超过安全处理限制")
 
 
-def _validate_image_header(opened: Image.Image) -> None:
+def _validate_image_header(opened: Image.Image, limits: tuple[int, int]) -> None:
     if opened.format not in ALLOWED_FORMATS:
-        raise InvalidImage(translate("仅支持 JPEG、PNG、WebP 和 HEIF 图片"))
-    _validate_image_dimensions(opened)
+        raise InvalidImage("仅支持 JPEG、PNG、WebP 和 HEIF 图片")
+    _validate_image_dimensions(opened, limits)
+
+
+def _estimated_decode_bytes(opened: Image.Image) -> int:
+    width, height = opened.size
+    if opened.format == "JPEG":
+        scale = min(width // ORIGINAL_MAX_SIZE[0], height // ORIGINAL_MAX_SIZE[1])
+        reduction = next((value for value in (8, 4, 2) if scale >= value), 1)
+        width = (width + reduction - 1) // reduction
+        height = (height + reduction - 1) // reduction
+    bands = max(len(opened.getbands()), 3)
+    # The decoded frame plus one full-size copy from transposition or conversion.
+    return width * height * bands * 2 + ENCODER_OVERHEAD_BYTES
 
 
-def _normalized_image(opened: Image.Image) -> Image.Image:
+def _normalized_image(opened: Image.Image, limits: tuple[int, int]) -> Image.Image:
     if opened.format == "JPEG":
         opened.draft("RGB", ORIGINAL_MAX_SIZE)
     ImageOps.exif_transpose(opened, in_place=True)
     image = opened
-    _validate_image_dimensions(image)
+    _validate_image_dimensions(image, limits)
     if image.width < 32 or image.height < 32:
-        raise InvalidImage(translate("图片尺寸过小"))
+        raise InvalidImage("图片尺寸过小")
     image.thumbnail(ORIGINAL_MAX_SIZE, Image.Resampling.LANCZOS)
     if image.mode not in {"RGB", "RGBA"}:
         image = image.convert("RGB")
@@ -99,6 +268,109 @@ def _normalized_image(opened: Image.Image) -> Image.Image:
     return image
 
 
+def fitted_size(size: tuple[int, int], bound: tuple[int, int]) -> tuple[int, int]:
+    width, height = size
+    scale = min(bound[0] / width, bound[1] / height, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def difference_hash(image: Image.Image) -> str:
+    """Return the 64-bit dHash of an image as 16 hex digits.
+
+    Each bit records whether a pixel of a 9x8 grayscale sample is brighter
+    than its right-hand neighbour, so re-encodes, small crops and exposure
+    tweaks of one frame land within a few bits of each other.
+    """
+    sample = image.convert("L").resize((9, 8), Image.Resampling.BOX)
+    pixels = sample.tobytes()
+    value = 0
+    for row in range(0, 72, 9):
+        for column in range(row, row + 8):
+            value = value << 1 | (pixels[column] > pixels[column + 1])
+    return f"{value:016x}"
+
+
+def image_features(image: Image.Image) -> dict:
+    """Return the placeholder, dominant color and dHash of an RGB image.
+
+    The placeholder is a 16 px inline WebP. The dominant color is the most
+    populated entry of a small median-cut palette, which tracks the subject
+    better than a plain average.
+    """
+    preview = image.copy()
+    preview.thumbnail(PLACEHOLDER_MAX_SIZE, Image.Resampling.BOX)
+    stream = BytesIO()
+    preview.save(stream, "WEBP", quality=PLACEHOLDER_QUALITY, method=6)
+    sample = image.copy()
+    sample.thumbnail(DOMINANT_COLOR_SAMPLE_SIZE, Image.Resampling.BOX)
+    quantized = sample.quantize(DOMINANT_COLOR_PALETTE, Image.Quantize.MEDIANCUT)
+    _count, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3 : index * 3 + 3]
+    return {
+        "placeholder": "data:image/webp;base64,"
+        + base64.b64encode(stream.getvalue()).decode("ascii"),
+        "dominant_color": f"#{red:02x}{green:02x}{blue:02x}",
+        "perceptual_hash": difference_hash(sample),
+    }
+
+
+def image_features_from_file(path: Path) -> dict:
+    with Image.open(path) as opened:
+        return image_features(opened.convert("RGB"))
+
+
+def _render_image(
+    source,
+    limits: tuple[int, int],
+    temp_root: str,
+    renditions: list[tuple[str, tuple[int, int], int, bool]],
+) -> tuple[int, int, list[str], dict]:
+    """Decode once and encode every rendition, largest first.
+
+    Each rendition is resized from the smallest already rendered image that
+    still covers it. Optional renditions are skipped when they would not be
+    smaller than the normalized image. Placeholder, color and perceptual
+    hash are taken from the smallest rendition while it is still in memory.
+    Runs either in the request thread or in a pool worker, so it must not
+    touch the application context.
+    """
+    written = []
+    with Image.open(source) as opened:
+        _validate_image_header(opened, limits)
+        image = _normalized_image(opened, limits)
+        width, height = image.size
+        planned = []
+        for destination, bound, quality, optional in renditions:
+            target = fitted_size(image.size, bound)
+            if optional and target[0] >= width:
+                continue
+            planned.append((target, destination, quality))
+        planned.sort(key=lambda item: item[0][0], reverse=True)
+        current = image
+        for target, destination, quality in planned:
+            if current.size != target:
+                current = current.resize(
+                    target,
+                    Image.Resampling.LANCZOS,
+                    reducing_gap=2.0,
+                )
+            _save_webp(current, Path(destination), quality, temp_root)
+            written.append(destination)
+        features = image_features(current)
+    return width, height, written, features
+
+
+def _spool_source(stream, temp_root: str) -> Path:
+    file_descriptor, temporary_name = tempfile.mkstemp(
+        prefix="fabula-source-",
+        suffix=".upload",
+        dir=temp_root,
+    )
+    with os.fdopen(file_descriptor, "wb") as source_file:
+        shutil.copyfileobj(stream, source_file, 1024 * 1024)
+    return Path(temporary_name)
+
+
 def _log_decode_failure(error: Exception, source_description: str) -> None:
     detail = " ".join(str(error).split())[:240]
     current_app.logger.warning(
@@ -109,54 +381,139 @@ def _log_decode_failure(error: Exception, source_description: str) -> None:
     )
 
 
-def process_image(stream) -> dict:
-    storage_name = f"{uuid.uuid4().hex}.webp"
-    original_path, thumb_path = _paths(storage_name)
+REJECTED_IMAGE_ERRORS = (
+    InvalidImage,
+    Image.DecompressionBombError,
+    UnidentifiedImageError,
+    BrokenProcessPool,
+    OSError,
+    SyntaxError,
+    RuntimeError,
+    EOFError,
+    ValueError,
+    MemoryError,
+)
+
+
+def _rejection(error: Exception, source_description: str) -> InvalidImage:
+    if isinstance(error, InvalidImage):
+        return InvalidImage(translate(str(error)))
+    _log_decode_failure(error, source_description)
+    if isinstance(error, Image.DecompressionBombError):
+        return InvalidImage(translate("图片像素数量超过安全处理限制"))
+    return InvalidImage(translate("图片文件无效或无法安全处理"))
+
+
+def _inspect_header(source, limits: tuple[int, int]) -> tuple[str, int]:
+    with Image.open(source) as opened:
+        source_description = (
+            f"format={opened.format or 'unknown'} "
+            f"dimensions={opened.width}x{opened.height}"
+        )
+        _validate_image_header(opened, limits)
+        estimated_bytes = _estimated_decode_bytes(opened)
+    if not isinstance(source, Path):
+        source.seek(0)
+    return source_description, estimated_bytes
+
+
+def inspect_image(stream) -> None:
+    """Check format and pixel limits from the header without decoding."""
+    try:
+        _inspect_header(stream, _image_limits())
+    except REJECTED_IMAGE_ERRORS as error:
+        raise _rejection(error, "format=unknown dimensions=unknown") from error
+
+
+def _run_image_job(
+    source,
+    renditions: list[tuple[Path, tuple[int, int], int, bool]],
+) -> tuple[int, int, list[str], dict]:
+    limits = _image_limits()
+    temp_root = str(current_app.config["TEMP_ROOT"])
+    job_renditions = [
+        (str(destination), bound, quality, optional)
+        for destination, bound, quality, optional in renditions
+    ]
     source_description = "format=unknown dimensions=unknown"
     try:
-        with IMAGE_PROCESSING_LOCK:
-            with Image.open(stream) as opened:
-                source_description = (
-                    f"format={opened.format or 'unknown'} "
-                    f"dimensions={opened.width}x{opened.height}"
-                )
-                _validate_image_header(opened)
-                image = _normalized_image(opened)
-                width, height = image.size
-                _save_webp(image, original_path, 84)
-                image.thumbnail((1000, 1000), Image.Resampling.LANCZOS)
-                _save_webp(image, thumb_path, 78)
-    except InvalidImage:
-        original_path.unlink(missing_ok=True)
-        thumb_path.unlink(missing_ok=True)
-        raise
-    except Image.DecompressionBombError as error:
-        original_path.unlink(missing_ok=True)
-        thumb_path.unlink(missing_ok=True)
-        _log_decode_failure(error, source_description)
-        raise InvalidImage(translate("图片像素数量超过安全处理限制")) from error
-    except (
-        UnidentifiedImageError,
-        OSError,
-        SyntaxError,
-        RuntimeError,
-        EOFError,
-        ValueError,
-    ) as error:
-        original_path.unlink(missing_ok=True)
-        thumb_path.unlink(missing_ok=True)
-        _log_decode_failure(error, source_description)
-        raise InvalidImage(translate("图片文件无效或无法安全处理")) from error
+        source_description, estimated_bytes = _inspect_header(source, limits)
+        workers = image_worker_count()
+        with image_memory_budget().reserve(
+            estimated_bytes,
+            current_app.config["IMAGE_QUEUE_TIMEOUT_SECONDS"],
+        ):
+            if workers == 0:
+                return _render_image(source, limits, temp_root, job_renditions)
+            spooled = not isinstance(source, Path)
+            source_path = _spool_source(source, temp_root) if spooled else source
+            pool = _process_pool(workers)
+            try:
+                return pool.submit(
+                    _render_image,
+                    str(source_path),
+                    limits,
+                    temp_root,
+                    job_renditions,
+                ).result()
+            except BrokenProcessPool:
+                _discard_process_pool(pool)
+                raise
+            finally:
+                if spooled:
+                    source_path.unlink(missing_ok=True)
+    except REJECTED_IMAGE_ERRORS as error:
+        raise _rejection(error, source_description) from error
+
+
+def new_storage_name() -> str:
+    return f"{uuid.uuid4().hex}.webp"
+
+
+def process_image(source, storage_name: str | None = None) -> dict:
+    storage_name = storage_name or new_storage_name()
+    # Renditions are written to a private staging directory and handed to the
+    # media storage only once all of them succeeded.
+    staging = Path(
+        tempfile.mkdtemp(prefix="fabula-render-", dir=current_app.config["TEMP_ROOT"])
+    )
+    ladder = {
+        derivative_variant(rung): rung for rung in current_app.config["IMAGE_LADDER"]
+    }
+    try:
+        width, height, written, features = _run_image_job(
+            source,
+            [
+                (staging / "original", ORIGINAL_MAX_SIZE, 84, False),
+                (staging / "thumbs", THUMB_MAX_SIZE, 78, False),
+                *(
+                    (staging / variant, (rung, ORIGINAL_MAX_SIZE[1]), 80, True)
+                    for variant, rung in ladder.items()
+                ),
+            ],
+        )
+        size_bytes = (staging / "original").stat().st_size
+        storage = media_storage()
+        for destination in written:
+            variant = Path(destination).name
+            storage.put_file(media_key(variant, storage_name), Path(destination))
     except Exception:
-        original_path.unlink(missing_ok=True)
-        thumb_path.unlink(missing_ok=True)
+        delete_media(storage_name)
         raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
     return {
         "storage_name": storage_name,
         "width": width,
         "height": height,
-        "size_bytes": original_path.stat().st_size,
+        "size_bytes": size_bytes,
+        "derivatives": format_derivatives(
+            ladder[Path(destination).name]
+            for destination in written
+            if Path(destination).name in ladder
+        ),
+        **features,
     }
 
 
@@ -165,36 +522,11 @@ def process_site_image(stream, slot: str) -> dict:
         raise InvalidImage(translate("站点图片位置无效"))
     storage_name = f"{slot}-{uuid.uuid4().hex}.webp"
     destination = Path(current_app.config["SITE_MEDIA_ROOT"]) / storage_name
-    source_description = "format=unknown dimensions=unknown"
     try:
-        with IMAGE_PROCESSING_LOCK:
-            with Image.open(stream) as opened:
-                source_description = (
-                    f"format={opened.format or 'unknown'} "
-                    f"dimensions={opened.width}x{opened.height}"
-                )
-                _validate_image_header(opened)
-                image = _normalized_image(opened)
-                width, height = image.size
-                _save_webp(image, destination, 84)
-    except InvalidImage:
-        destination.unlink(missing_ok=True)
-        raise
-    except Image.DecompressionBombError as error:
-        destination.unlink(missing_ok=True)
-        _log_decode_failure(error, source_description)
-        raise InvalidImage(translate("图片像素数量超过安全处理限制")) from error
-    except (
-        UnidentifiedImageError,
-        OSError,
-        SyntaxError,
-        RuntimeError,
-        EOFError,
-        ValueError,
-    ) as error:
-        destination.unlink(missing_ok=True)
-        _log_decode_failure(error, source_description)
-        raise InvalidImage(translate("图片文件无效或无法安全处理")) from error
+        width, height, _written, _features = _run_image_job(
+            stream,
+            [(destination, ORIGINAL_MAX_SIZE, 84, False)],
+        )
     except Exception:
         destination.unlink(missing_ok=True)
         raise
@@ -207,12 +539,261 @@ def process_site_image(stream, slot: str) -> dict:
     }
 
 
+def upload_source_path(storage_name: str) -> Path:
+    stem = storage_name.removesuffix(".webp")
+    return Path(current_app.config["TEMP_ROOT"]) / f"fabula-upload-{stem}.upload"
+
+
+def spool_upload(stream, storage_name: str) -> tuple[Path, str]:
+    """Write the upload to the temp root, hashing it on the way through.
+
+    Returns the spooled path and the SHA-256 of the raw bytes.
+    """
+    destination = upload_source_path(storage_name)
+    digest = hashlib.sha256()
+    descriptor = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(descriptor, "wb") as source_file:
+            while chunk := stream.read(1024 * 1024):
+                digest.update(chunk)
+                source_file.write(chunk)
+    except Exception:
+        destination.unlink(missing_ok=True)
+        raise
+    return destination, digest.hexdigest()
+
+
+def link_media(source_name: str, storage_name: str, derivatives: str) -> None:
+    """Give ``storage_name`` the rendered files of ``source_name``.
+
+    Local storage hardlinks the files where the filesystem allows it and
+    copies them otherwise; an object store copies them server-side. Either
+    way, deleting one photo later never affects the other.
+    """
+    storage = media_storage()
+    try:
+        for variant in photo_variants(derivatives):
+            storage.copy(media_key(variant, source_name), media_key(variant, storage_name))
+    except Exception:
+        delete_media(storage_name)
+        raise
+
+
+_upload_lock = threading.Lock()
+_upload_executor: ThreadPoolExecutor | None = None
+
+
+def _upload_queue() -> ThreadPoolExecutor:
+    global _upload_executor
+    with _upload_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(
+                max_workers=max(1, image_worker_count()),
+                thread_name_prefix="fabula-upload",
+            )
+        return _upload_executor
+
+
+def enqueue_photo_processing(photo_id: int, storage_name: str) -> None:
+    app = current_app._get_current_object()
+    _upload_queue().submit(_complete_photo_processing, app, photo_id, storage_name)
+
+
+def _claim_photo_processing(connection, photo_id: int, storage_name: str, claim):
+    """Take or refresh the right to render a processing photo.
+
+    A worker may claim a row nobody holds, a row whose claim has gone stale,
+    or a row it claimed itself earlier. Returns the new claim, or ``None``
+    when another worker owns the row or it is no longer processing.
+    """
+    token = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    claimed = connection.execute(
+        """
+        UPDATE photos SET processing_started_at = ?
+        WHERE id = ? AND storage_name = ? AND status = 'processing'
+            AND (
+                processing_started_at IS ?
+                OR processing_started_at < strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)
+            )
+        """,
+        (token, photo_id, storage_name, claim, f"-{PROCESSING_CLAIM_SECONDS} seconds"),
+    ).rowcount
+    connection.commit()
+    return token if claimed else None
+
+
+def _release_photo_processing(
+    connection, photo_id: int, storage_name: str, rendered: bool
+) -> None:
+    """Clean up after losing a photo row to another writer.
+
+    The spooled upload stays while another worker still holds the row. The
+    rendered files are only removed when the row is gone or now names other
+    media; a row that another worker already published shares them.
+    """
+    row = connection.execute(
+        "SELECT storage_name, status FROM photos WHERE id = ?",
+        (photo_id,),
+    ).fetchone()
+    ours = row is not None and row["storage_name"] == storage_name
+    if ours and row["status"] == "processing":
+        return
+    upload_source_path(storage_name).unlink(missing_ok=True)
+    if rendered and not ours:
+        delete_media(storage_name)
+
+
+def _complete_photo_processing(
+    app, photo_id: int, storage_name: str, claim: str | None = None
+) -> None:
+    with app.app_context():
+        connection = get_db()
+        claim = _claim_photo_processing(connection, photo_id, storage_name, claim)
+        if claim is None:
+            _release_photo_processing(
+                connection, photo_id, storage_name, rendered=False
+            )
+            return
+        source_path = upload_source_path(storage_name)
+        processed = None
+        error_message = ""
+        try:
+            processed = process_image(source_path, storage_name)
+        except ImageProcessingBusy:
+            # Keep the spooled upload and go back in line behind the jobs
+            # holding the memory budget.
+            _upload_queue().submit(
+                _complete_photo_processing, app, photo_id, storage_name, claim
+            )
+            return
+        except InvalidImage as error:
+            error_message = str(error)
+        except Exception:
+            current_app.logger.exception("Background processing failed for photo %s", photo_id)
+            error_message = "图片文件无效或无法安全处理"
+
+        if processed is None:
+            updated = connection.execute(
+                """
+                UPDATE photos
+                SET status = 'failed', processing_error = ?,
+                    updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
+                WHERE id = ? AND storage_name = ? AND status = 'processing'
+                    AND processing_started_at = ?
+                """,
+                (error_message, photo_id, storage_name, claim),
+            ).rowcount
+        else:
+            updated = connection.execute(
+                """
+                UPDATE photos
+                SET status = 'ready', width = ?, height = ?, size_bytes = ?,
+                    derivatives = ?, placeholder = ?, dominant_color = ?,
+                    perceptual_hash = ?, processing_error = '',
+                    updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
+                WHERE id = ? AND storage_name = ? AND status = 'processing'
+                    AND processing_started_at = ?
+                """,
+                (
+                    processed["width"],
+                    processed["height"],
+                    processed["size_bytes"],
+                    processed["derivatives"],
+                    processed["placeholder"],
+                    processed["dominant_color"],
+                    processed["perceptual_hash"],
+                    photo_id,
+                    storage_name,
+                    claim,
+                ),
+            ).rowcount
+        connection.commit()
+        if updated:
+            source_path.unlink(missing_ok=True)
+        else:
+            _release_photo_processing(
+                connection, photo_id, storage_name, rendered=processed is not None
+            )
+
+
+def resume_photo_processing() -> int:
+    """Re-queue uploads whose processing was abandoned.
+
+    Runs as a maintenance job on the leader. An upload is abandoned once it
+    has sat unclaimed, or its claim has not been refreshed, for
+    ``PROCESSING_CLAIM_SECONDS``; one whose spooled file is gone is marked
+    failed instead.
+    """
+    connection = get_db()
+    stale = f"-{PROCESSING_CLAIM_SECONDS} seconds"
+    rows = connection.execute(
+        """
+        SELECT id, storage_name FROM photos
+        WHERE status = 'processing'
+            AND COALESCE(processing_started_at, created_at)
+                < strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)
+        ORDER BY id
+        """,
+        (stale,),
+    ).fetchall()
+    resumed = 0
+    for row in rows:
+        if upload_source_path(row["storage_name"]).exists():
+            enqueue_photo_processing(row["id"], row["storage_name"])
+            resumed += 1
+            continue
+        connection.execute(
+            """
+            UPDATE photos
+            SET status = 'failed', processing_error = ?,
+                updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
+            WHERE id = ? AND status = 'processing'
+                AND COALESCE(processing_started_at, created_at)
+                    < strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)
+            """,
+            ("上传在处理完成前中断，请重新上传", row["id"], stale),
+        )
+    connection.commit()
+    return resumed
+
+
 def delete_media(storage_name: str) -> None:
     if not STORAGE_PATTERN.fullmatch(storage_name):
         return
-    original_path, thumb_path = _paths(storage_name)
-    original_path.unlink(missing_ok=True)
-    thumb_path.unlink(missing_ok=True)
+    storage = media_storage()
+    # Every variant present in the store, so renditions of rungs since
+    # dropped from the ladder are removed too.
+    for variant in storage.variants():
+        if is_media_variant(variant):
+            storage.delete(media_key(variant, storage_name))
+
+
+def migrate_media_batch(limit: int) -> int:
+    """Move up to ``limit`` files from the flat layout into their shards.
+
+    Each move is a single rename, so the migration can be interrupted and
+    re-run at any time; readers find a file at one path or the other. A file
+    deleted while the batch runs is skipped.
+    """
+    media_root = Path(current_app.config["MEDIA_ROOT"])
+    moved = 0
+    for directory in media_root.iterdir():
+        if not is_media_variant(directory.name):
+            continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if moved >= limit:
+                    return moved
+                if not entry.is_file() or not STORAGE_PATTERN.fullmatch(entry.name):
+                    continue
+                destination = directory / media_shard(entry.name) / entry.name
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.replace(entry.path, destination)
+                except FileNotFoundError:
+                    continue
+                moved += 1
+    return moved
 
 
 def delete_site_media(storage_name: str | None) -> None:
@@ -285,3 +866,27 @@ def drain_media_deletions(limit: int = 100) -> int:
         connection.commit()
         completed += 1
     return completed
+
+
+# Scratch files left behind by a crashed encode or pool hand-off. Spooled
+# uploads ("fabula-upload-*") are not listed: the photo_processing job
+# resumes them.
+STALE_TEMP_PATTERNS = ("fabula-*.webp", "fabula-source-*.upload", "fabula-render-*")
+
+
+def sweep_temp_files(max_age: int = 3600) -> int:
+    cutoff = time.time() - max_age
+    temp_root = Path(current_app.config["TEMP_ROOT"])
+    removed = 0
+    for pattern in STALE_TEMP_PATTERNS:
+        for path in temp_root.glob(pattern):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    if path.is_dir():
+                        shutil.rmtree(path)
+                    else:
+                        path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
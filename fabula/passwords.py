@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+
+DEFAULT_PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+PASSWORD_HASH_PATTERN = re.compile(r"^(?:scrypt:(\d+):(\d+):(\d+)|pbkdf2:sha256:(\d+))$")
+BENCHMARK_SCRYPT_COSTS = (16_384, 32_768, 65_536)
+
+
+class PasswordHashBusy(Exception):
+    """Raised when every password hashing slot stays taken past the queue timeout."""
+
+
+def valid_hash_method(method: str) -> bool:
+    match = PASSWORD_HASH_PATTERN.fullmatch(method)
+    if match is None:
+        return False
+    cost, block_size, parallelism, iterations = match.groups()
+    if iterations is not None:
+        return int(iterations) >= 600_000
+    cost = int(cost)
+    return (
+        cost >= BENCHMARK_SCRYPT_COSTS[0]
+        and cost & (cost - 1) == 0
+        and 1 <= int(block_size) <= 32
+        and 1 <= int(parallelism) <= 16
+    )
+
+
+def hash_password(password: str) -> str:
+    return generate_password_hash(
+        password,
+        method=current_app.config["PASSWORD_HASH_METHOD"],
+    )
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return password_hash.split("$", 1)[0] != current_app.config["PASSWORD_HASH_METHOD"]
+
+
+_dummy_lock = threading.Lock()
+
+
+def dummy_password_hash() -> str:
+    # Missing and inactive accounts are checked against this hash so that
+    # they cost the same as a real one. It is created on first use instead of
+    # delaying every worker start by one full hash.
+    with _dummy_lock:
+        if not current_app.config.get("DUMMY_PASSWORD_HASH"):
+            current_app.config["DUMMY_PASSWORD_HASH"] = hash_password(
+                secrets.token_urlsafe(32)
+            )
+        return current_app.config["DUMMY_PASSWORD_HASH"]
+
+
+_executor_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+_executor_workers = 0
+_slots: threading.BoundedSemaphore | None = None
+_slot_count = 0
+
+
+def _password_executor() -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    global _executor, _executor_workers, _slots, _slot_count
+    workers = int(current_app.config["PASSWORD_WORKERS"])
+    slot_count = workers + int(current_app.config["PASSWORD_QUEUE_LIMIT"])
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="fabula-password",
+            )
+            _executor_workers = workers
+        if _slots is None or _slot_count != slot_count:
+            _slots = threading.BoundedSemaphore(slot_count)
+            _slot_count = slot_count
+        return _executor, _slots
+
+
+def run_password_work(function, *args):
+    """Run one hash computation on the shared password executor.
+
+    At most PASSWORD_WORKERS hashes run at once and PASSWORD_QUEUE_LIMIT more
+    may wait; a caller that cannot get a slot within the queue timeout gets
+    PasswordHashBusy instead of tying up its request thread.
+    """
+    executor, slots = _password_executor()
+    if not slots.acquire(timeout=current_app.config["PASSWORD_QUEUE_TIMEOUT_SECONDS"]):
+        raise PasswordHashBusy
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+
+def benchmark_hash_methods(target_ms: int) -> list[tuple[str, float]]:
+    results = []
+    for cost in BENCHMARK_SCRYPT_COSTS:
+        method = f"scrypt:{cost}:8:1"
+        started = time.perf_counter()
+        generate_password_hash("benchmark-password-2026", method=method)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        results.append((method, elapsed_ms))
+        if elapsed_ms > target_ms:
+            break
+    return results
@@ -1,84 +1,286 @@
 from __future__ import annotations
 
+import hashlib
+import hmac
+import mimetypes
+import os
 import re
+import time
 from datetime import date
 
 from flask import (
     Blueprint,
     Response,
     abort,
+    current_app,
     g,
-    jsonify,
+    make_response,
     render_template,
     request,
     send_from_directory,
+    session,
     url_for,
 )
 
-from .db import get_db
-from .i18n import translate
-from .media import SITE_IMAGE_SLOTS, SITE_STORAGE_PATTERN, STORAGE_PATTERN
+from .db import (
+    decode_cursor,
+    encode_cursor,
+    get_db,
+    media_epoch,
+    publication_revision,
+    publication_total,
+)
+from .i18n import get_locale, translate
+from .media import (
+    ORIGINAL_MAX_SIZE,
+    SITE_IMAGE_SLOTS,
+    SITE_STORAGE_PATTERN,
+    STORAGE_PATTERN,
+    THUMB_MAX_SIZE,
+    derivative_variant,
+    fitted_size,
+    is_media_variant,
+    parse_derivatives,
+    photo_variants,
+    stored_media_path,
+)
+from .serialization import PUBLIC_FEED_FIELDS, feed_response
 from .settings import get_site_copy, get_site_images
+from .storage import media_storage
 
 
 bp = Blueprint("public", __name__)
+GRID_IMAGE_SIZES = "(max-width: 560px) 100vw, (max-width: 1080px) 50vw, 42vw"
+HOMEPAGE_CACHE_KEY = "fabula.homepage"
+MEDIA_EPOCH_CACHE_KEY = "fabula.media_epoch"
+SIGNED_MEDIA_MAX_AGE = 31536000
 
 
-def serialize_photo(row) -> dict:
-    return {
-        "id": row["id"],
-        "title": row["title"],
-        "story": row["story"],
-        "photographer": row["photographer"],
-        "owner_id": row["user_id"],
-        "album_id": row["album_id"],
-        "album": row["album_name"] or translate("未分类"),
-        "width": row["width"],
-        "height": row["height"],
-        "image_url": url_for("public.media_file", variant="original", storage_name=row["storage_name"]),
-        "thumb_url": url_for("public.media_file", variant="thumbs", storage_name=row["storage_name"]),
-    }
+def media_signature(epoch: int, variant: str, storage_name: str) -> str:
+    message = f"media:{epoch}:{variant}:{storage_name}".encode("utf-8")
+    key = str(current_app.config["SECRET_KEY"]).encode("utf-8")
+    return hmac.new(key, message, hashlib.sha256).hexdigest()[:32]
 
 
-def public_photos(album_id: int | None, limit: int, offset: int) -> list[dict]:
-    parameters: list[object] = []
-    where = ["p.status = 'ready'", "a.status = 'published'"]
-    order_by = "p.created_at DESC, p.id DESC"
-    if album_id is not None:
-        where.append("p.album_id = ?")
-        parameters.append(album_id)
-        order_by = (
-            "CASE WHEN p.album_position IS NULL THEN 1 ELSE 0 END, "
-            "p.album_position, p.created_at DESC, p.id DESC"
+def current_media_epoch(refresh: bool = False) -> int:
+    """Return the media epoch, rereading it once the cached value is stale."""
+    cached = current_app.extensions.get(MEDIA_EPOCH_CACHE_KEY)
+    now = time.monotonic()
+    if (
+        refresh
+        or cached is None
+        or now - cached[1] >= current_app.config["MEDIA_EPOCH_TTL_SECONDS"]
+    ):
+        cached = (media_epoch(), now)
+        current_app.extensions[MEDIA_EPOCH_CACHE_KEY] = cached
+    return cached[0]
+
+
+class MediaUrls:
+    """Builds media URLs from a route prefix resolved once, not per row.
+
+    Storage names and variant names never need escaping, so formatting them
+    onto the prefix gives the same result as ``url_for`` at a fraction of the
+    cost on large pages.
+    """
+
+    def __init__(self, signed: bool) -> None:
+        self.epoch = None
+        if not signed:
+            template = url_for("public.media_file", variant="variant", storage_name="name")
+            self.prefix = template.removesuffix("variant/name")
+            return
+        # Pages must embed the epoch that is current right now, or a cached page
+        # would keep pointing at URLs that stop verifying a few seconds later.
+        if "media_epoch" not in g:
+            g.media_epoch = current_media_epoch(refresh=True)
+        self.epoch = g.media_epoch
+        template = url_for(
+            "public.signed_media_file",
+            epoch=self.epoch,
+            signature="signature",
+            variant="variant",
+            storage_name="name",
         )
-    parameters.extend([limit, offset])
-    rows = get_db().execute(
+        self.prefix = template.removesuffix("signature/variant/name")
+
+    def __call__(self, variant: str, storage_name: str) -> str:
+        if self.epoch is None:
+            return f"{self.prefix}{variant}/{storage_name}"
+        signature = media_signature(self.epoch, variant, storage_name)
+        return f"{self.prefix}{signature}/{variant}/{storage_name}"
+
+
+def media_urls() -> MediaUrls:
+    if "media_urls" not in g:
+        g.media_urls = MediaUrls(
+            bool(current_app.config["SIGNED_MEDIA_URLS"] and not g.get("static_export"))
+        )
+    return g.media_urls
+
+
+def public_media_url(variant: str, storage_name: str) -> str:
+    return media_urls()(variant, storage_name)
+
+
+def photo_srcset(row) -> str:
+    size = (row["width"], row["height"])
+    if not all(size):
+        return ""
+    candidates = [
+        (fitted_size(size, (rung, ORIGINAL_MAX_SIZE[1]))[0], derivative_variant(rung))
+        for rung in parse_derivatives(row["derivatives"])
+    ]
+    candidates.append((fitted_size(size, THUMB_MAX_SIZE)[0], "thumbs"))
+    candidates.append((row["width"], "original"))
+    entries = {}
+    for width, variant in sorted(candidates):
+        entries.setdefault(width, variant)
+    return ", ".join(
+        f"{public_media_url(variant, row['storage_name'])} {width}w"
+        for width, variant in entries.items()
+    )
+
+
+def photo_serializer():
+    """Return a feed row serializer with the per-request lookups done once."""
+    urls = media_urls()
+    uncategorized = translate("未分类")
+
+    def serialize(row) -> dict:
+        storage_name = row["storage_name"]
+        return {
+            "id": row["id"],
+            "title": row["title"],
+            "story": row["story"],
+            "photographer": row["photographer"],
+            "owner_id": row["user_id"],
+            "album_id": row["album_id"],
+            "album": row["album_name"] or uncategorized,
+            "width": row["width"],
+            "height": row["height"],
+            "placeholder": row["placeholder"],
+            "color": row["dominant_color"],
+            "image_url": urls("original", storage_name),
+            "thumb_url": urls("thumbs", storage_name),
+            "srcset": photo_srcset(row),
+        }
+
+    return serialize
+
+
+def _public_photo_rows(
+    where: list[str],
+    parameters: list[object],
+    order_by: str,
+    limit: int,
+) -> list:
+    return get_db().execute(
         f"""
-        SELECT p.*, u.display_name AS photographer, a.name AS album_name
+        SELECT
+            p.id, p.user_id, p.album_id, p.album_position, p.storage_name,
+            p.title, p.story, p.width, p.height, p.derivatives, p.placeholder,
+            p.dominant_color, p.created_at,
+            u.display_name AS photographer, a.name AS album_name
         FROM photos p
         JOIN users u ON u.id = p.user_id
         JOIN albums a ON a.id = p.album_id AND a.user_id = p.user_id
-        WHERE {" AND ".join(where)}
+        WHERE {" AND ".join(["p.status = 'ready'", "a.status = 'published'", *where])}
         ORDER BY {order_by}
-        LIMIT ? OFFSET ?
+        LIMIT ?
         """,
-        parameters,
+        [*parameters, limit],
     ).fetchall()
-    return [serialize_photo(row) for row in rows]
+
+
+def public_photos(
+    album_id: int | None,
+    limit: int,
+    cursor: tuple | None = None,
+) -> tuple[list[dict], str | None]:
+    if album_id is None:
+        where: list[str] = []
+        parameters: list[object] = []
+        if cursor is not None:
+            created_at, photo_id = cursor
+            where.append("p.created_at <= ? AND (p.created_at < ? OR p.id < ?)")
+            parameters.extend([created_at, created_at, photo_id])
+        rows = _public_photo_rows(
+            where, parameters, "p.created_at DESC, p.id DESC", limit + 1
+        )
+    else:
+        # Positioned photos come first in album order, then unpositioned ones
+        # newest first. Each phase is its own query so idx_photos_album_order
+        # serves both the seek and the order; a cursor without a position
+        # means the first phase is done.
+        rows = []
+        if cursor is None or cursor[0] is not None:
+            where = ["p.album_id = ?", "p.album_position IS NOT NULL"]
+            parameters = [album_id]
+            if cursor is not None:
+                position, created_at, photo_id = cursor
+                where.append(
+                    "p.album_position >= ? AND (p.album_position > ? "
+                    "OR p.created_at < ? OR (p.created_at = ? AND p.id < ?))"
+                )
+                parameters.extend(
+                    [position, position, created_at, created_at, photo_id]
+                )
+            rows = _public_photo_rows(
+                where,
+                parameters,
+                "p.album_position, p.created_at DESC, p.id DESC",
+                limit + 1,
+            )
+        if len(rows) <= limit:
+            where = ["p.album_id = ?", "p.album_position IS NULL"]
+            parameters = [album_id]
+            if cursor is not None and cursor[0] is None:
+                _position, created_at, photo_id = cursor
+                where.append("p.created_at <= ? AND (p.created_at < ? OR p.id < ?)")
+                parameters.extend([created_at, created_at, photo_id])
+            rows += _public_photo_rows(
+                where,
+                parameters,
+                "p.created_at DESC, p.id DESC",
+                limit + 1 - len(rows),
+            )
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        key = (last["created_at"], last["id"])
+        if album_id is not None:
+            key = (last["album_position"], *key)
+        next_cursor = encode_cursor(key)
+    serialize = photo_serializer()
+    return [serialize(row) for row in rows[:limit]], next_cursor
+
+
+def feed_cursor(album_id: int | None) -> tuple | None:
+    try:
+        cursor = decode_cursor(
+            request.args.get("cursor"),
+            3 if album_id is not None else 2,
+        )
+    except ValueError:
+        abort(400)
+    if cursor is not None and album_id is not None:
+        position = cursor[0]
+        if position is not None and (
+            isinstance(position, bool) or not isinstance(position, int)
+        ):
+            abort(400)
+    return cursor
 
 
 def public_albums() -> list[dict]:
     rows = get_db().execute(
         """
-        SELECT a.id, a.name, u.display_name AS photographer, COUNT(p.id) AS photo_count
+        SELECT a.id, a.name, u.display_name AS photographer, c.photo_count
         FROM albums a
         JOIN users u ON u.id = a.user_id
-        JOIN photos p
-            ON p.album_id = a.id
-            AND p.user_id = a.user_id
-            AND p.status = 'ready'
-        WHERE a.status = 'published'
-        GROUP BY a.id
+        JOIN publication_counters c ON c.scope = 'album' AND c.scope_id = a.id
+        WHERE a.status = 'published' AND c.photo_count > 0
         ORDER BY a.created_at, a.id
         """
     ).fetchall()
@@ -92,7 +294,6 @@ def public_profiles() -> list[dict]:
             SELECT
                 p.user_id,
                 p.storage_name,
-                COUNT(*) OVER (PARTITION BY p.user_id) AS photo_count,
                 ROW_NUMBER() OVER (
                     PARTITION BY p.user_id
                     ORDER BY p.created_at DESC, p.id DESC
@@ -110,11 +311,12 @@ def public_profiles() -> list[dict]:
             ab.gear_json,
             ab.contact_json,
             rp.storage_name AS cover_name,
-            COALESCE(rp.photo_count, 0) AS photo_count
+            COALESCE(c.photo_count, 0) AS photo_count
         FROM users u
         JOIN about_blocks ab ON ab.user_id = u.id
         LEFT JOIN ranked_photos rp
             ON rp.user_id = u.id AND rp.row_number = 1
+        LEFT JOIN publication_counters c ON c.scope = 'user' AND c.scope_id = u.id
         WHERE trim(ab.title) <> '' OR trim(ab.bio) <> ''
         ORDER BY u.id
         """
@@ -140,11 +342,7 @@ def public_profiles() -> list[dict]:
         item["gear"] = [structured_item(value) for value in item["gear"]]
         item["contact"] = [structured_item(value) for value in item["contact"]]
         if item["cover_name"]:
-            item["cover_url"] = url_for(
-                "public.media_file",
-                variant="original",
-                storage_name=item["cover_name"],
-            )
+            item["cover_url"] = public_media_url("original", item["cover_name"])
         else:
             item["cover_url"] = None
         profiles.append(item)
@@ -160,76 +358,79 @@ def structured_item(value: object) -> dict:
     return {"label": "", "value": text}
 
 
-@bp.get("/")
-def index():
+def render_index(**overrides) -> str:
     albums = public_albums()
     initial_album_id = albums[0]["id"] if albums else None
-    initial_photo_total = albums[0]["photo_count"] if albums else 0
-    photos = public_photos(album_id=initial_album_id, limit=24, offset=0)
-    total = get_db().execute(
-        """
-        SELECT COUNT(*)
-        FROM photos p
-        JOIN albums a ON a.id = p.album_id AND a.user_id = p.user_id
-        WHERE p.status = 'ready' AND a.status = 'published'
-        """
-    ).fetchone()[0]
-    return render_template(
-        "public.html",
-        site_copy=get_site_copy(),
-        photos=photos,
-        total_photos=total,
-        initial_photo_total=initial_photo_total,
-        albums=albums,
-        profiles=public_profiles(),
-        current_year=date.today().year,
-    )
+    photos, next_cursor = public_photos(album_id=initial_album_id, limit=24)
+    context = {
+        "site_copy": get_site_copy(),
+        "photos": photos,
+        "next_cursor": next_cursor,
+        "total_photos": publication_total(),
+        "albums": albums,
+        "profiles": public_profiles(),
+        "grid_image_sizes": GRID_IMAGE_SIZES,
+        "current_year": date.today().year,
+    }
+    context.update(overrides)
+    return render_template("public.html", **context)
+
+
+@bp.get("/")
+def index():
+    if getattr(g, "user", None) is not None or "_flashes" in session:
+        return render_index()
+    # Anonymous visitors all see the same page, which only changes when the
+    # publication revision does. It needs no CSRF token because it sends no
+    # unsafe requests.
+    key = (get_locale(), date.today().year)
+    revision = publication_revision()
+    cache = current_app.extensions.setdefault(HOMEPAGE_CACHE_KEY, {})
+    cached = cache.get(key)
+    if cached is None or cached[0] != revision:
+        body = render_index(csrf_token=lambda: "").encode("utf-8")
+        cached = (revision, body, hashlib.sha256(body).hexdigest()[:32])
+        cache[key] = cached
+    response = make_response(cached[1])
+    response.set_etag(cached[2])
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 
 @bp.get("/api/public/photos")
 def photo_feed():
     limit = min(max(request.args.get("limit", 24, type=int), 1), 24)
-    offset = max(request.args.get("offset", 0, type=int), 0)
     album_id = request.args.get("album_id", type=int)
-    items = public_photos(album_id=album_id, limit=limit, offset=offset)
-    count_parameters: list[object] = []
-    count_where = ["p.status = 'ready'", "a.status = 'published'"]
-    if album_id is not None:
-        count_where.append("p.album_id = ?")
-        count_parameters.append(album_id)
-    total = get_db().execute(
-        f"""
-        SELECT COUNT(*)
-        FROM photos p
-        JOIN albums a ON a.id = p.album_id AND a.user_id = p.user_id
-        WHERE {' AND '.join(count_where)}
-        """,
-        count_parameters,
-    ).fetchone()[0]
-    next_offset = offset + len(items)
-    return jsonify(
-        {
-            "items": items,
-            "total": total,
-            "next_offset": next_offset if next_offset < total else None,
-        }
+    items, next_cursor = public_photos(
+        album_id=album_id,
+        limit=limit,
+        cursor=feed_cursor(album_id),
     )
+    if album_id is None:
+        total = publication_total()
+    else:
+        total = publication_total("album", album_id)
+    return feed_response(PUBLIC_FEED_FIELDS, items, total, next_cursor)
 
 
 @bp.get("/media/<variant>/<storage_name>")
 def media_file(variant: str, storage_name: str):
-    if variant not in {"original", "thumbs"} or not STORAGE_PATTERN.fullmatch(storage_name):
+    if not is_media_variant(variant) or not STORAGE_PATTERN.fullmatch(storage_name):
         abort(404)
     row = get_db().execute(
         """
-        SELECT p.status, p.user_id, a.status AS album_status
+        SELECT p.status, p.user_id, p.derivatives, a.status AS album_status
         FROM photos p
         LEFT JOIN albums a ON a.id = p.album_id AND a.user_id = p.user_id
         WHERE p.storage_name = ?
         """,
         (storage_name,),
     ).fetchone()
-    if row is None or row["status"] != "ready":
+    if (
+        row is None
+        or row["status"] != "ready"
+        or variant not in photo_variants(row["derivatives"])
+    ):
         abort(404)
     publicly_available = row["album_status"] == "published"
     owned_by_current_user = (
@@ -237,13 +438,7 @@ def media_file(variant: str, storage_name: str):
     )
     if not publicly_available and not owned_by_current_user:
         abort(404)
-    directory = current_media_directory(variant)
-    response = send_from_directory(
-        directory,
-        storage_name,
-        max_age=0,
-        conditional=True,
-    )
+    response = send_media(*media_location(variant, storage_name), storage_name, 0)
     if publicly_available:
         response.headers["Cache-Control"] = "public, max-age=0, must-revalidate"
     else:
@@ -251,6 +446,35 @@ def media_file(variant: str, storage_name: str):
     return response
 
 
+@bp.get("/media/<int:epoch>/<signature>/<variant>/<storage_name>")
+def signed_media_file(epoch: int, signature: str, variant: str, storage_name: str):
+    if (
+        not current_app.config["SIGNED_MEDIA_URLS"]
+        or not is_media_variant(variant)
+        or not STORAGE_PATTERN.fullmatch(storage_name)
+        or not hmac.compare_digest(
+            signature, media_signature(epoch, variant, storage_name)
+        )
+    ):
+        abort(404)
+    # A newer epoch than the cached one means another worker has rotated it
+    # since; an older one is refused without touching the database.
+    current = current_media_epoch()
+    if epoch > current:
+        current = current_media_epoch(refresh=True)
+    if epoch != current:
+        abort(404)
+    response = send_media(
+        *media_location(variant, storage_name),
+        storage_name,
+        SIGNED_MEDIA_MAX_AGE,
+    )
+    response.headers["Cache-Control"] = (
+        f"public, max-age={SIGNED_MEDIA_MAX_AGE}, immutable"
+    )
+    return response
+
+
 @bp.get("/site-media/<slot>/<storage_name>")
 def site_media_file(slot: str, storage_name: str):
     if (
@@ -259,18 +483,38 @@ def site_media_file(slot: str, storage_name: str):
         or get_site_images().get(slot) != storage_name
     ):
         abort(404)
-    return send_from_directory(
-        current_site_media_directory(),
-        storage_name,
-        max_age=31536000,
-        conditional=True,
+    return send_media(current_site_media_directory(), "site", storage_name, 31536000)
+
+
+def send_media(directory: str, internal_directory: str, storage_name: str, max_age: int):
+    """Send an authorized media file, or hand it to the reverse proxy to send."""
+    if current_app.config["MEDIA_OFFLOAD"] != "nginx":
+        # In "sendfile" mode Flask itself answers with an X-Sendfile header.
+        return send_from_directory(
+            directory,
+            storage_name,
+            max_age=max_age,
+            conditional=True,
+        )
+    if not os.path.isfile(os.path.join(directory, storage_name)):
+        abort(404)
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(storage_name)[0] or "application/octet-stream"
     )
+    response.headers["X-Accel-Redirect"] = (
+        f"{current_app.config['MEDIA_OFFLOAD_PREFIX']}/{internal_directory}/{storage_name}"
+    )
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
 
 
-def current_media_directory(variant: str) -> str:
-    from flask import current_app
-
-    return str(current_app.config["MEDIA_ROOT"] / variant)
+def media_location(variant: str, storage_name: str) -> tuple[str, str]:
+    """Return the directory holding a media file and its path for the proxy."""
+    storage = media_storage()
+    path = stored_media_path(variant, storage_name)
+    relative = path.parent.relative_to(storage.root)
+    return str(path.parent), f"{storage.internal_prefix}/{relative.as_posix()}"
 
 
 def current_site_media_directory() -> str:
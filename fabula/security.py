@@ -5,7 +5,10 @@ import hmac
 import json
 import re
 import secrets
+import sqlite3
+import threading
 import time
+from collections import OrderedDict
 from functools import wraps
 from urllib.parse import urlsplit
 
@@ -14,18 +17,22 @@ from flask import (
     current_app,
     flash,
     g,
+    has_request_context,
     jsonify,
     redirect,
     request,
     session,
     url_for,
 )
+from flask.ctx import _AppCtxGlobals
 
-from .db import get_db
+from .db import get_db, user_revision
 from .i18n import translate
 
 
 USERNAME_PATTERN = re.compile(r"^[A-Za-z0-9._]{3,32}$")
+USER_CACHE_KEY = "fabula.user_cache"
+USER_CACHE_SIZE = 256
 
 
 def valid_username(value: str) -> bool:
@@ -68,12 +75,38 @@ def api_error(message: str, status: int = 400):
     return jsonify({"success": False, "message": message}), status
 
 
+def _cached_user(user_id: int, session_version: int | None):
+    # Rows are keyed by the session version the cookie carries, and every
+    # entry is dropped as soon as any worker changes a user row.
+    cache = current_app.extensions[USER_CACHE_KEY]
+    key = (user_id, session_version)
+    connection = get_db()
+    revision = user_revision()
+    with cache["lock"]:
+        entry = cache["rows"].get(key)
+        if entry is not None and entry[0] == revision:
+            cache["rows"].move_to_end(key)
+            return entry[1]
+    user = connection.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    if (
+        user is not None
+        and user["session_version"] == session_version
+        and not connection.in_transaction
+    ):
+        with cache["lock"]:
+            cache["rows"][key] = (revision, user)
+            cache["rows"].move_to_end(key)
+            while len(cache["rows"]) > USER_CACHE_SIZE:
+                cache["rows"].popitem(last=False)
+    return user
+
+
 def load_logged_in_user() -> None:
     g.user = None
     user_id = session.get("user_id")
     if not user_id:
         return
-    user = get_db().execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    user = _cached_user(user_id, session.get("session_version"))
     if (
         user is None
         or user["status"] == "inactive"
@@ -84,6 +117,20 @@ def load_logged_in_user() -> None:
     g.user = user
 
 
+class RequestGlobals(_AppCtxGlobals):
+    """Application globals that load ``g.user`` on first access.
+
+    Requests that never look at the signed-in user, such as media and feed
+    fetches, skip the user lookup entirely.
+    """
+
+    def __getattr__(self, name: str):
+        if name == "user" and has_request_context():
+            load_logged_in_user()
+            return self.__dict__["user"]
+        return super().__getattr__(name)
+
+
 def login_required(view):
     @wraps(view)
     def wrapped(**kwargs):
@@ -146,42 +193,205 @@ def login_fingerprint(username: str) -> str:
     return hmac.new(secret, payload, hashlib.sha256).hexdigest()
 
 
-def reserve_login_attempt(fingerprint: str) -> bool:
-    now = int(time.time())
-    cutoff = now - current_app.config["LOGIN_WINDOW_SECONDS"]
-    connection = get_db()
-    try:
-        connection.execute("BEGIN IMMEDIATE")
-        connection.execute(
-            "DELETE FROM login_attempts WHERE attempted_at < ?",
+class SqliteLoginLimiter:
+    """Counts attempts in the login_attempts table, shared by every process."""
+
+    name = "sqlite"
+
+    def reserve(self, fingerprint: str) -> bool:
+        now = int(time.time())
+        cutoff = now - current_app.config["LOGIN_WINDOW_SECONDS"]
+        connection = get_db()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            count = connection.execute(
+                """
+                SELECT COUNT(*)
+                FROM login_attempts
+                WHERE fingerprint = ? AND attempted_at >= ?
+                """,
+                (fingerprint, cutoff),
+            ).fetchone()[0]
+            if count >= current_app.config["LOGIN_MAX_ATTEMPTS"]:
+                connection.commit()
+                return False
+            connection.execute(
+                "INSERT INTO login_attempts (fingerprint, attempted_at) VALUES (?, ?)",
+                (fingerprint, now),
+            )
+            connection.commit()
+            return True
+        except Exception:
+            connection.rollback()
+            raise
+
+    def clear(self, fingerprint: str) -> None:
+        connection = get_db()
+        connection.execute("DELETE FROM login_attempts WHERE fingerprint = ?", (fingerprint,))
+        connection.commit()
+
+    def stats(self) -> dict:
+        cutoff = int(time.time()) - current_app.config["LOGIN_WINDOW_SECONDS"]
+        row = get_db().execute(
+            """
+            SELECT COUNT(DISTINCT fingerprint) AS fingerprints, COUNT(*) AS attempts
+            FROM login_attempts
+            WHERE attempted_at >= ?
+            """,
             (cutoff,),
-        )
-        count = connection.execute(
+        ).fetchone()
+        return {
+            "backend": self.name,
+            "fingerprints": row["fingerprints"],
+            "attempts": row["attempts"],
+        }
+
+
+class MemoryLoginLimiter:
+    """Sliding-window login limiter kept in process memory.
+
+    Reservations never touch SQLite. New attempts and cleared fingerprints are
+    written to login_attempts at most once per LOGIN_LIMITER_PERSIST_SECONDS,
+    piggybacking on a login request, and the window is reloaded from the table
+    the first time a new process checks a login, so limits survive restarts.
+    """
+
+    name = "memory"
+    max_fingerprints = 100_000
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._windows: OrderedDict[str, list[int]] = OrderedDict()
+        self._pending: list[tuple[str, int]] = []
+        self._cleared: set[str] = set()
+        self._restored = False
+        self._flushed_at = time.monotonic()
+
+    def _trim(self, fingerprint: str, cutoff: int) -> list[int]:
+        window = self._windows.get(fingerprint)
+        if window is None:
+            return []
+        while window and window[0] < cutoff:
+            window.pop(0)
+        if not window:
+            del self._windows[fingerprint]
+        return window
+
+    def _restore(self, cutoff: int) -> None:
+        rows = get_db().execute(
             """
-            SELECT COUNT(*)
+            SELECT fingerprint, attempted_at
             FROM login_attempts
-            WHERE fingerprint = ? AND attempted_at >= ?
+            WHERE attempted_at >= ?
+            ORDER BY attempted_at
             """,
-            (fingerprint, cutoff),
-        ).fetchone()[0]
-        if count >= current_app.config["LOGIN_MAX_ATTEMPTS"]:
+            (cutoff,),
+        ).fetchall()
+        for row in rows:
+            self._windows.setdefault(row["fingerprint"], []).append(row["attempted_at"])
+
+    def reserve(self, fingerprint: str) -> bool:
+        now = int(time.time())
+        cutoff = now - current_app.config["LOGIN_WINDOW_SECONDS"]
+        persist = current_app.config["LOGIN_LIMITER_PERSIST_SECONDS"] > 0
+        with self._lock:
+            if persist and not self._restored:
+                self._restore(cutoff)
+                self._restored = True
+            window = self._trim(fingerprint, cutoff)
+            if len(window) >= current_app.config["LOGIN_MAX_ATTEMPTS"]:
+                self._windows.move_to_end(fingerprint)
+                allowed = False
+            else:
+                self._windows.setdefault(fingerprint, window).append(now)
+                self._windows.move_to_end(fingerprint)
+                while len(self._windows) > self.max_fingerprints:
+                    self._windows.popitem(last=False)
+                if persist:
+                    self._pending.append((fingerprint, now))
+                allowed = True
+        if persist:
+            self.flush()
+        return allowed
+
+    def clear(self, fingerprint: str) -> None:
+        with self._lock:
+            self._windows.pop(fingerprint, None)
+            self._pending = [entry for entry in self._pending if entry[0] != fingerprint]
+            if current_app.config["LOGIN_LIMITER_PERSIST_SECONDS"] > 0:
+                self._cleared.add(fingerprint)
+
+    def flush(self, force: bool = False) -> int:
+        interval = current_app.config["LOGIN_LIMITER_PERSIST_SECONDS"]
+        with self._lock:
+            if not force and time.monotonic() - self._flushed_at < interval:
+                return 0
+            pending, self._pending = self._pending, []
+            cleared, self._cleared = self._cleared, set()
+            self._flushed_at = time.monotonic()
+            cutoff = int(time.time()) - current_app.config["LOGIN_WINDOW_SECONDS"]
+            for fingerprint in list(self._windows):
+                self._trim(fingerprint, cutoff)
+        if not pending and not cleared:
+            return 0
+        connection = get_db()
+        try:
+            connection.executemany(
+                "DELETE FROM login_attempts WHERE fingerprint = ?",
+                [(fingerprint,) for fingerprint in cleared],
+            )
+            connection.executemany(
+                "INSERT INTO login_attempts (fingerprint, attempted_at) VALUES (?, ?)",
+                pending,
+            )
             connection.commit()
-            return False
-        connection.execute(
-            "INSERT INTO login_attempts (fingerprint, attempted_at) VALUES (?, ?)",
-            (fingerprint, now),
-        )
-        connection.commit()
-        return True
-    except Exception:
-        connection.rollback()
-        raise
+        except sqlite3.Error:
+            connection.rollback()
+            with self._lock:
+                self._pending[:0] = pending
+                self._cleared |= cleared
+            current_app.logger.warning("Deferred login limiter persistence", exc_info=True)
+            return 0
+        return len(pending)
 
+    def stats(self) -> dict:
+        cutoff = int(time.time()) - current_app.config["LOGIN_WINDOW_SECONDS"]
+        limit = current_app.config["LOGIN_MAX_ATTEMPTS"]
+        with self._lock:
+            windows = [self._trim(fingerprint, cutoff) for fingerprint in list(self._windows)]
+            return {
+                "backend": self.name,
+                "fingerprints": len(self._windows),
+                "attempts": sum(len(window) for window in windows),
+                "blocked": sum(len(window) >= limit for window in windows),
+                "pending_writes": len(self._pending) + len(self._cleared),
+            }
 
-def clear_failed_logins(fingerprint: str) -> None:
+
+LOGIN_LIMITER_KEY = "fabula.login_limiter"
+
+
+def login_limiter():
+    return current_app.extensions[LOGIN_LIMITER_KEY][current_app.config["LOGIN_LIMITER"]]
+
+
+def reserve_login_attempt(fingerprint: str) -> bool:
+    return login_limiter().reserve(fingerprint)
+
+
+def prune_login_attempts() -> int:
+    cutoff = int(time.time()) - current_app.config["LOGIN_WINDOW_SECONDS"]
     connection = get_db()
-    connection.execute("DELETE FROM login_attempts WHERE fingerprint = ?", (fingerprint,))
+    removed = connection.execute(
+        "DELETE FROM login_attempts WHERE attempted_at < ?",
+        (cutoff,),
+    ).rowcount
     connection.commit()
+    return removed
+
+
+def clear_failed_logins(fingerprint: str) -> None:
+    login_limiter().clear(fingerprint)
 
 
 def issue_temporary_password() -> tuple[str, int]:
@@ -217,7 +427,11 @@ def refresh_current_user() -> None:
 
 
 def init_app(app) -> None:
-    app.before_request(load_logged_in_user)
+    app.app_ctx_globals_class = RequestGlobals
+    app.extensions[USER_CACHE_KEY] = {"lock": threading.Lock(), "rows": OrderedDict()}
+    app.extensions[LOGIN_LIMITER_KEY] = {
+        limiter.name: limiter for limiter in (MemoryLoginLimiter(), SqliteLoginLimiter())
+    }
 
     @app.before_request
     def protect_unsafe_methods():
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import time
+from operator import itemgetter
+
+from flask import current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speed-up
+    orjson = None
+
+
+PUBLIC_FEED_FIELDS = (
+    "id",
+    "title",
+    "story",
+    "photographer",
+    "owner_id",
+    "album_id",
+    "album",
+    "width",
+    "height",
+    "placeholder",
+    "color",
+    "image_url",
+    "thumb_url",
+    "srcset",
+)
+STUDIO_FEED_FIELDS = (
+    "id",
+    "title",
+    "story",
+    "original_name",
+    "album_id",
+    "album_position",
+    "album_name",
+    "album_status",
+    "status",
+    "processing_error",
+    "width",
+    "height",
+    "size_bytes",
+    "created_at",
+    "thumb_url",
+)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, with Flask's fallbacks for other types."""
+
+    name = "orjson"
+
+    def dumps(self, obj, **kwargs) -> str:
+        # Dates go through Flask's default hook so they keep the HTTP date format.
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=self.default, option=options).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def json_provider_name() -> str:
+    return getattr(current_app.json, "name", "json")
+
+
+def feed_response(fields: tuple[str, ...], items: list[dict], total: int, next_cursor):
+    """Return a feed page, as field-keyed rows when ``?layout=compact`` asks."""
+    if request.args.get("layout") != "compact":
+        return jsonify({"items": items, "total": total, "next_cursor": next_cursor})
+    # Naming the fields once per page instead of once per photo keeps large
+    # pages noticeably smaller.
+    row = itemgetter(*fields)
+    return jsonify(
+        {
+            "fields": fields,
+            "rows": [row(item) for item in items],
+            "total": total,
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+def _benchmark_rows(count: int) -> list[dict]:
+    return [
+        {
+            "id": count - index,
+            "user_id": 1 + index % 4,
+            "album_id": 1 + index % 6,
+            "album_position": index,
+            "storage_name": f"{index:032x}.webp",
+            "title": f"Photo {index}",
+            "story": "A quiet street after the rain. " * 4,
+            "width": 4000,
+            "height": 2667,
+            "derivatives": "640,1280,1920",
+            "placeholder": "data:image/webp;base64," + "A" * 120,
+            "dominant_color": "#806f62",
+            "created_at": "2026-01-01T00:00:00.000Z",
+            "photographer": "Lin Qiu",
+            "album_name": "" if index % 5 == 0 else "City Notes",
+        }
+        for index in range(count)
+    ]
+
+
+def benchmark_feed_serialization(sizes: tuple[int, ...], rounds: int) -> list[dict]:
+    """Time one public feed page of each size: rows to dicts, then both layouts."""
+    from .public import photo_serializer
+
+    provider = current_app.json
+    row = itemgetter(*PUBLIC_FEED_FIELDS)
+    results = []
+    for size in sizes:
+        rows = _benchmark_rows(size)
+        timings = {"serialize": 0.0, "items": 0.0, "compact": 0.0}
+        for _ in range(rounds):
+            started = time.perf_counter()
+            serialize = photo_serializer()
+            items = [serialize(item) for item in rows]
+            serialized = time.perf_counter()
+            items_body = provider.dumps({"items": items})
+            encoded = time.perf_counter()
+            compact_body = provider.dumps(
+                {"fields": PUBLIC_FEED_FIELDS, "rows": [row(item) for item in items]}
+            )
+            finished = time.perf_counter()
+            timings["serialize"] += serialized - started
+            timings["items"] += encoded - serialized
+            timings["compact"] += finished - encoded
+        results.append(
+            {
+                "size": size,
+                "serialize_ms": timings["serialize"] * 1000 / rounds,
+                "items_ms": timings["items"] * 1000 / rounds,
+                "compact_ms": timings["compact"] * 1000 / rounds,
+                "items_bytes": len(items_body.encode("utf-8")),
+                "compact_bytes": len(compact_body.encode("utf-8")),
+            }
+        )
+    return results
+
+
+def init_app(app) -> None:
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
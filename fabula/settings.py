@@ -2,10 +2,14 @@ from __future__ import annotations
 
 import json
 
+from flask import current_app, g
+
 from .db import get_db
 from .media import SITE_IMAGE_SLOTS, SITE_STORAGE_PATTERN
 
 
+SITE_SETTINGS_CACHE_KEY = "fabula.site_settings"
+
 DEFAULT_SITE_PALETTE = "cinnabar"
 SITE_PALETTES = frozenset({"cinnabar", "celadon", "indigo", "lotus"})
 
@@ -52,14 +56,11 @@ def default_site_copy() -> dict:
     }
 
 
-def get_site_copy() -> dict:
-    row = get_db().execute(
-        "SELECT value FROM site_settings WHERE key = 'site_copy'"
-    ).fetchone()
-    if row is None:
+def _parse_site_copy(value: str | None) -> dict:
+    if value is None:
         return default_site_copy()
     try:
-        stored = json.loads(row["value"])
+        stored = json.loads(value)
     except (TypeError, json.JSONDecodeError):
         return default_site_copy()
     if not isinstance(stored, dict):
@@ -72,6 +73,81 @@ def get_site_copy() -> dict:
     return site_copy
 
 
+def _parse_site_images(value: str | None) -> dict[str, str | None]:
+    images = {slot: None for slot in SITE_IMAGE_SLOTS}
+    if value is None:
+        return images
+    try:
+        stored = json.loads(value)
+    except (TypeError, json.JSONDecodeError):
+        return images
+    if not isinstance(stored, dict):
+        return images
+    for slot in SITE_IMAGE_SLOTS:
+        storage_name = stored.get(slot)
+        if isinstance(storage_name, str) and SITE_STORAGE_PATTERN.fullmatch(storage_name):
+            images[slot] = storage_name
+    return images
+
+
+def settings_revision() -> int:
+    """Return the stored settings revision, read at most once per request."""
+    if "site_settings_revision" not in g:
+        row = get_db().execute(
+            "SELECT value FROM site_settings WHERE key = 'revision'"
+        ).fetchone()
+        try:
+            g.site_settings_revision = int(row["value"]) if row is not None else 0
+        except ValueError:
+            g.site_settings_revision = 0
+    return g.site_settings_revision
+
+
+def _bump_settings_revision() -> None:
+    get_db().execute(
+        """
+        INSERT INTO site_settings (key, value)
+        VALUES ('revision', '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        """
+    )
+    g.pop("site_settings_revision", None)
+
+
+def _site_settings() -> dict:
+    connection = get_db()
+    if connection.in_transaction:
+        # Writers read-modify-write inside their own transaction, so they must
+        # see the current rows and must not publish uncommitted values.
+        revision = None
+    else:
+        revision = settings_revision()
+        cached = current_app.extensions.get(SITE_SETTINGS_CACHE_KEY)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+    values = {
+        row["key"]: row["value"]
+        for row in connection.execute(
+            """
+            SELECT key, value
+            FROM site_settings
+            WHERE key IN ('site_copy', 'site_images')
+            """
+        ).fetchall()
+    }
+    settings = {
+        "site_copy": _parse_site_copy(values.get("site_copy")),
+        "site_images": _parse_site_images(values.get("site_images")),
+    }
+    if revision is not None:
+        current_app.extensions[SITE_SETTINGS_CACHE_KEY] = (revision, settings)
+    return settings
+
+
+def get_site_copy() -> dict:
+    return dict(_site_settings()["site_copy"])
+
+
 def save_site_copy(values: dict) -> dict:
     cleaned = {
         key: str(values.get(key, default)).strip()[: SITE_COPY_LIMITS[key]] or default
@@ -86,27 +162,12 @@ def save_site_copy(values: dict) -> dict:
         """,
         (json.dumps(cleaned, ensure_ascii=False),),
     )
+    _bump_settings_revision()
     return cleaned
 
 
 def get_site_images() -> dict[str, str | None]:
-    images = {slot: None for slot in SITE_IMAGE_SLOTS}
-    row = get_db().execute(
-        "SELECT value FROM site_settings WHERE key = 'site_images'"
-    ).fetchone()
-    if row is None:
-        return images
-    try:
-        stored = json.loads(row["value"])
-    except (TypeError, json.JSONDecodeError):
-        return images
-    if not isinstance(stored, dict):
-        return images
-    for slot in SITE_IMAGE_SLOTS:
-        storage_name = stored.get(slot)
-        if isinstance(storage_name, str) and SITE_STORAGE_PATTERN.fullmatch(storage_name):
-            images[slot] = storage_name
-    return images
+    return dict(_site_settings()["site_images"])
 
 
 def save_site_image(slot: str, storage_name: str | None) -> dict[str, str | None]:
@@ -124,4 +185,5 @@ def save_site_image(slot: str, storage_name: str | None) -> dict[str, str | None
         """,
         (json.dumps(images, ensure_ascii=False),),
     )
+    _bump_settings_revision()
     return images
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import combinations
+from math import comb
+
+from flask import current_app
+
+from .db import get_db
+
+
+SIMILARITY_CACHE_KEY = "fabula.similarity"
+SIMILARITY_CACHE_SIZE = 64
+HASH_BITS = 64
+MAX_HASH_BLOCKS = 16
+
+
+def hamming_distance(left: int, right: int) -> int:
+    return (left ^ right).bit_count()
+
+
+@lru_cache(maxsize=64)
+def _flip_masks(width: int, radius: int) -> tuple[int, ...]:
+    return tuple(
+        sum(1 << position for position in positions)
+        for count in range(radius + 1)
+        for positions in combinations(range(width), count)
+    )
+
+
+def _block_widths(blocks: int) -> list[int]:
+    return [
+        HASH_BITS // blocks + (1 if index < HASH_BITS % blocks else 0)
+        for index in range(blocks)
+    ]
+
+
+def block_count(radius: int, size: int) -> int:
+    """Return the number of blocks with the cheapest expected radius query.
+
+    More blocks make each table key shorter, so fewer variants are probed
+    per block but each probe returns more candidates from a library of
+    ``size`` hashes.
+    """
+    best, best_cost = 1, float("inf")
+    for blocks in range(1, min(radius + 1, MAX_HASH_BLOCKS) + 1):
+        widths = _block_widths(blocks)
+        block_radius = radius // blocks
+        cost = sum(
+            sum(comb(width, count) for count in range(block_radius + 1))
+            * (1 + size / (1 << width))
+            for width in widths
+        )
+        if cost < best_cost:
+            best, best_cost = blocks, cost
+    return best
+
+
+class MultiIndexHash:
+    """Multi-index hashing over 64-bit hashes under Hamming distance.
+
+    The hash is cut into ``blocks`` substrings, each with an exact-match
+    table. Two hashes within ``radius`` bits differ by at most
+    ``radius // blocks`` bits in at least one substring, so a query only
+    probes those few neighbouring keys per table and compares the hashes
+    found there instead of the whole library.
+    """
+
+    def __init__(self, blocks: int) -> None:
+        self.blocks = []
+        shift = 0
+        for width in _block_widths(blocks):
+            self.blocks.append((shift, (1 << width) - 1, width))
+            shift += width
+        self.tables: list[dict[int, list]] = [{} for _ in self.blocks]
+        self.size = 0
+        self.visited = 0
+
+    def add(self, value: int, item) -> None:
+        self.size += 1
+        for (shift, mask, _width), table in zip(self.blocks, self.tables):
+            table.setdefault((value >> shift) & mask, []).append((value, item))
+
+    def search(self, value: int, radius: int) -> list[tuple[int, object]]:
+        block_radius = radius // len(self.blocks)
+        found = {}
+        visited = 0
+        for (shift, mask, width), table in zip(self.blocks, self.tables):
+            key = (value >> shift) & mask
+            for flip in _flip_masks(width, block_radius):
+                bucket = table.get(key ^ flip)
+                if bucket is None:
+                    continue
+                visited += len(bucket)
+                for other, item in bucket:
+                    distance = (value ^ other).bit_count()
+                    if distance <= radius:
+                        found[item] = distance
+        self.visited += visited
+        return [(distance, item) for item, distance in found.items()]
+
+
+def _library_revision(user_id: int) -> int:
+    row = get_db().execute(
+        "SELECT revision FROM photo_revisions WHERE user_id = ?",
+        (user_id,),
+    ).fetchone()
+    return row["revision"] if row is not None else 0
+
+
+def similarity_index(user_id: int) -> dict:
+    """Return a library's photo hashes and the near-duplicate groups found so far.
+
+    The entry is rebuilt only when the library's photo revision moves, so
+    repeated queries at the same distance reuse the computed groups.
+    """
+    cache = current_app.extensions[SIMILARITY_CACHE_KEY]
+    revision = _library_revision(user_id)
+    with cache["lock"]:
+        entry = cache["libraries"].get(user_id)
+        if entry is not None and entry["revision"] == revision:
+            cache["libraries"].move_to_end(user_id)
+            return entry
+    rows = get_db().execute(
+        """
+        SELECT id, perceptual_hash
+        FROM photos
+        WHERE user_id = ? AND status = 'ready' AND perceptual_hash IS NOT NULL
+        """,
+        (user_id,),
+    ).fetchall()
+    entry = {
+        "revision": revision,
+        "hashes": {row["id"]: int(row["perceptual_hash"], 16) for row in rows},
+        "groups": {},
+    }
+    with cache["lock"]:
+        cache["libraries"][user_id] = entry
+        cache["libraries"].move_to_end(user_id)
+        while len(cache["libraries"]) > SIMILARITY_CACHE_SIZE:
+            cache["libraries"].popitem(last=False)
+    return entry
+
+
+def near_duplicate_groups(user_id: int, max_distance: int) -> list[list[int]]:
+    """Group a library's photos whose hashes chain within ``max_distance`` bits.
+
+    Photos inside a group, and the groups themselves, are ordered most
+    recently added first.
+    """
+    entry = similarity_index(user_id)
+    cached = entry["groups"].get(max_distance)
+    if cached is not None:
+        return cached
+    hashes = entry["hashes"]
+    index = MultiIndexHash(block_count(max_distance, len(hashes)))
+    parents = {photo_id: photo_id for photo_id in hashes}
+
+    def root(photo_id: int) -> int:
+        while parents[photo_id] != photo_id:
+            parents[photo_id] = parents[parents[photo_id]]
+            photo_id = parents[photo_id]
+        return photo_id
+
+    # Each photo is matched against the ones indexed before it, so every pair
+    # is compared once.
+    for photo_id, value in hashes.items():
+        for _distance, other_id in index.search(value, max_distance):
+            parents[root(other_id)] = root(photo_id)
+        index.add(value, photo_id)
+    groups: dict[int, list[int]] = {}
+    for photo_id in hashes:
+        groups.setdefault(root(photo_id), []).append(photo_id)
+    result = sorted(
+        (sorted(group, reverse=True) for group in groups.values() if len(group) > 1),
+        key=lambda group: group[0],
+        reverse=True,
+    )
+    entry["groups"][max_distance] = result
+    return result
+
+
+def init_app(app) -> None:
+    app.extensions[SIMILARITY_CACHE_KEY] = {
+        "lock": threading.Lock(),
+        "libraries": OrderedDict(),
+    }
@@ -4,16 +4,9 @@
   const root = document.documentElement;
   const csrfToken = document.querySelector('meta[name="csrf-token"]')?.content || "";
   const toast = document.querySelector("#toast");
-  const catalogElement = document.querySelector("#fabula-i18n");
-  let catalog = {};
+  const catalog = window.FabulaCatalog || {};
   let toastTimer = 0;
 
-  try {
-    catalog = JSON.parse(catalogElement?.textContent || "{}");
-  } catch {
-    catalog = {};
-  }
-
   function t(message, values = {}) {
     const translated = catalog[message] || message;
     return Object.entries(values).reduce(
@@ -113,6 +106,15 @@
     return payload;
   }
 
+  function feedItems(payload) {
+    if (!payload.fields) {
+      return payload.items;
+    }
+    return payload.rows.map((row) => Object.fromEntries(
+      payload.fields.map((field, index) => [field, row[index]]),
+    ));
+  }
+
   function closeDialog(dialog) {
     if (dialog?.open) {
       dialog.close();
@@ -199,6 +201,7 @@
     api,
     closeDialog,
     csrfToken,
+    feedItems,
     openDialog,
     noticeAfterReload,
     showToast,
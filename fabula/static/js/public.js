@@ -19,7 +19,8 @@
     ? configuredCycleMs
     : 30000;
   let activeAlbum = document.querySelector("[data-album-filter].is-active")?.dataset.albumFilter || "";
-  let nextOffset = sentinel?.dataset.nextOffset || "";
+  let nextCursor = sentinel?.dataset.nextCursor || "";
+  const staticFeed = sentinel?.dataset.staticFeed || "";
   let loading = false;
   let pendingGalleryReset = false;
   let collectionCycleTimer = 0;
@@ -152,6 +153,10 @@
     window.Fabula.openDialog(lightbox);
   }
 
+  galleryGrid?.querySelectorAll(".photo-open").forEach((button) => {
+    paintPlaceholder(button, button.dataset.placeholder, button.dataset.color);
+  });
+
   galleryGrid?.addEventListener("click", (event) => {
     const card = event.target.closest(".photo-card");
     if (card && event.target.closest(".photo-open")) {
@@ -206,6 +211,16 @@
     }
   });
 
+  function paintPlaceholder(button, placeholder, color) {
+    // Inline style attributes are blocked by the CSP; CSSOM writes are not.
+    if (color) {
+      button.style.backgroundColor = color;
+    }
+    if (placeholder) {
+      button.style.backgroundImage = `url("${placeholder}")`;
+    }
+  }
+
   function makePhotoCard(photo) {
     const card = document.createElement("article");
     const openButton = document.createElement("button");
@@ -228,6 +243,10 @@
         ? t("打开《{title}》的照片故事", { title: photo.title })
         : t("打开 {photographer} 的照片故事", { photographer: photo.photographer }),
     );
+    if (photo.srcset) {
+      image.sizes = galleryGrid?.dataset.imageSizes || "";
+      image.srcset = photo.srcset;
+    }
     image.src = photo.thumb_url;
     image.alt = t("{title}，摄影师 {photographer}", {
       title: photo.title || t("摄影作品"),
@@ -246,6 +265,7 @@
     story.className = "photo-story-data";
     story.hidden = true;
     story.textContent = photo.story || "";
+    paintPlaceholder(openButton, photo.placeholder, photo.color);
     openButton.append(image);
     if (photo.title) {
       caption.append(title);
@@ -262,19 +282,24 @@
       }
       return;
     }
-    if (!reset && nextOffset === "") {
+    if (!reset && nextCursor === "") {
       return;
     }
     loading = true;
     galleryError.hidden = true;
     const requestedAlbum = activeAlbum;
-    const offset = reset ? 0 : Number(nextOffset);
-    const query = new URLSearchParams({ limit: "24", offset: String(offset) });
+    const query = new URLSearchParams({ limit: "24", layout: "compact" });
+    if (!reset) {
+      query.set("cursor", nextCursor);
+    }
     if (activeAlbum) {
       query.set("album_id", activeAlbum);
     }
     try {
-      const payload = await window.Fabula.api(`/api/public/photos?${query}`);
+      const feedUrl = staticFeed
+        ? `${staticFeed}/${activeAlbum || "all"}/${reset ? "1" : nextCursor}.json`
+        : `/api/public/photos?${query}`;
+      const payload = await window.Fabula.api(feedUrl);
       if (requestedAlbum !== activeAlbum) {
         return;
       }
@@ -282,14 +307,15 @@
         galleryGrid.replaceChildren();
         photoModels = [];
       }
-      payload.items.forEach((photo) => {
+      const items = window.Fabula.feedItems(payload);
+      items.forEach((photo) => {
         photoModels.push(photo);
         galleryGrid.append(makePhotoCard(photo));
       });
       lightboxThumbs.replaceChildren();
-      nextOffset = payload.next_offset === null ? "" : String(payload.next_offset);
-      sentinel.dataset.nextOffset = nextOffset;
-      if (!payload.items.length) {
+      nextCursor = payload.next_cursor || "";
+      sentinel.dataset.nextCursor = nextCursor;
+      if (!items.length) {
         const empty = document.createElement("div");
         const heading = document.createElement("h3");
         const note = document.createElement("p");
@@ -324,7 +350,7 @@
       item.setAttribute("aria-pressed", String(active));
     });
     if (changed) {
-      nextOffset = "0";
+      nextCursor = "";
       loadPhotos(true);
     }
     if (scrollIntoView) {
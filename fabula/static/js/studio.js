@@ -706,6 +706,7 @@
 
     row.className = "manage-photo";
     row.dataset.managedPhoto = String(photo.id);
+    row.dataset.photoStatus = photo.status;
     row.dataset.albumId = photo.album_id === null ? "" : String(photo.album_id);
     row.dataset.albumStatus = photo.album_status || "";
     row.hidden = !rowMatchesAlbum(row, albumFilter);
@@ -725,6 +726,9 @@
       image.alt = "";
     } else {
       image.className = "processing-image";
+      if (photo.processing_error) {
+        image.title = photo.processing_error;
+      }
       image.textContent = {
         processing: t("处理中"),
         failed: t("处理失败"),
@@ -773,14 +777,18 @@
     button.disabled = true;
     button.textContent = t("正在加载");
     try {
-      const offset = Number(button.dataset.offset || 0);
-      const payload = await window.Fabula.api(`/studio/api/photos?limit=24&offset=${offset}`);
+      const query = new URLSearchParams({
+        limit: "24",
+        cursor: button.dataset.cursor || "",
+        layout: "compact",
+      });
+      const payload = await window.Fabula.api(`/studio/api/photos?${query}`);
       const list = document.querySelector("#manage-photo-list");
-      payload.items.forEach((photo) => list.append(makeManagedPhotoRow(photo)));
-      if (payload.next_offset === null) {
+      window.Fabula.feedItems(payload).forEach((photo) => list.append(makeManagedPhotoRow(photo)));
+      if (payload.next_cursor === null) {
         button.remove();
       } else {
-        button.dataset.offset = String(payload.next_offset);
+        button.dataset.cursor = payload.next_cursor;
         button.disabled = false;
         button.textContent = t("加载更多");
       }
@@ -805,7 +813,10 @@
     loadObserver.observe(studioLoadMore);
   }
 
+  let lastRevisionCheck = Date.now();
+
   async function checkPhotoRevision() {
+    lastRevisionCheck = Date.now();
     const photoPanel = document.querySelector('[data-studio-panel="photos"].is-active');
     if (!photoPanel || document.hidden || document.querySelector("dialog[open]")) {
       return;
@@ -813,7 +824,10 @@
     try {
       const payload = await window.Fabula.api("/studio/api/revision");
       if (payload.photo_revision !== app.dataset.photoRevision) {
-        window.Fabula.noticeAfterReload(t("全部照片已在另一个会话中更新"));
+        const processing = document.querySelector('[data-photo-status="processing"]');
+        window.Fabula.noticeAfterReload(
+          processing ? t("照片处理状态已更新") : t("全部照片已在另一个会话中更新"),
+        );
         window.location.assign(photosUrl());
       }
     } catch {
@@ -822,7 +836,12 @@
   }
 
   if (document.querySelector('[data-studio-panel="photos"]') && !document.querySelector(".forced-password-notice")) {
-    window.setInterval(checkPhotoRevision, 30000);
+    window.setInterval(() => {
+      const processing = document.querySelector('[data-photo-status="processing"]');
+      if (processing || Date.now() - lastRevisionCheck >= 30000) {
+        checkPhotoRevision();
+      }
+    }, 4000);
     document.addEventListener("visibilitychange", () => {
       if (!document.hidden) {
         checkPhotoRevision();
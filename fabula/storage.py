@@ -0,0 +1,687 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import http.client
+import os
+import queue
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlsplit
+from xml.etree import ElementTree
+
+from flask import current_app
+
+
+MEDIA_STORAGE_KEY = "fabula.media_storage"
+STREAM_CHUNK_BYTES = 1024 * 1024
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+S3_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class StorageError(OSError):
+    """Raised when the media store cannot complete an operation."""
+
+
+class LocalStorage:
+    """Media kept on the local disk under ``root``.
+
+    Keys are relative paths (``variant/aa/bb/name``). Files written before the
+    sharded layout stay readable from their flat path until migrated.
+    """
+
+    name = "local"
+    internal_prefix = "media"
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+
+    def _legacy_path(self, key: str) -> Path:
+        variant, _separator, rest = key.partition("/")
+        return self.root / variant / Path(rest).name
+
+    def local_path(self, key: str) -> Path:
+        sharded = self.root / key
+        if sharded.is_file():
+            return sharded
+        legacy = self._legacy_path(key)
+        return legacy if legacy.is_file() else sharded
+
+    def put_file(self, key: str, source: Path) -> None:
+        destination = self.root / key
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # A rename when the temp root shares the filesystem, a copy otherwise.
+        shutil.move(source, destination)
+
+    def copy(self, source_key: str, key: str) -> None:
+        source = self.local_path(source_key)
+        destination = self.root / key
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source, destination)
+        except OSError:
+            if not source.is_file():
+                raise
+            shutil.copyfile(source, destination)
+
+    def delete(self, key: str) -> None:
+        # Flat path first: a concurrent migrate-media-layout can only move the
+        # file into the shard before that unlink, never after the shard's.
+        self._legacy_path(key).unlink(missing_ok=True)
+        (self.root / key).unlink(missing_ok=True)
+
+    def variants(self) -> list[str]:
+        return [entry.name for entry in self.root.iterdir() if entry.is_dir()]
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class DiskCache:
+    """Read-through cache of remote objects, bounded by total size.
+
+    Entries are evicted least recently used first. Several workers may share
+    the directory: a file another process added is adopted on first read, and
+    one it evicted is simply fetched again.
+    """
+
+    def __init__(self, root: Path, capacity: int) -> None:
+        self.root = Path(root)
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] | None = None
+        self._size = 0
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _load(self) -> OrderedDict[str, int]:
+        if self._entries is None:
+            found = []
+            for path in self.root.rglob("*"):
+                if path.is_file() and not path.name.startswith("."):
+                    stat = path.stat()
+                    key = path.relative_to(self.root).as_posix()
+                    found.append((stat.st_mtime, key, stat.st_size))
+            self._entries = OrderedDict((key, size) for _mtime, key, size in sorted(found))
+            self._size = sum(self._entries.values())
+        return self._entries
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def get(self, key: str) -> Path | None:
+        path = self.root / key
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            size = None
+        with self._lock:
+            entries = self._load()
+            if size is None:
+                self._size -= entries.pop(key, 0)
+                self._counters["misses"] += 1
+                return None
+            if key not in entries:
+                entries[key] = size
+                self._size += size
+            entries.move_to_end(key)
+            self._counters["hits"] += 1
+        return path
+
+    def staging_file(self) -> Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root / f".fetch-{uuid.uuid4().hex}"
+
+    def add(self, key: str, source: Path) -> Path:
+        """Move ``source`` into the cache as ``key`` and evict to fit."""
+        destination = self.root / key
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(source, destination)
+        size = destination.stat().st_size
+        evicted = []
+        with self._lock:
+            entries = self._load()
+            self._size += size - entries.pop(key, 0)
+            entries[key] = size
+            while self._size > self.capacity and len(entries) > 1:
+                oldest, oldest_size = entries.popitem(last=False)
+                self._size -= oldest_size
+                self._counters["evictions"] += 1
+                evicted.append(oldest)
+        for oldest in evicted:
+            (self.root / oldest).unlink(missing_ok=True)
+        return destination
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if self._entries is not None:
+                self._size -= self._entries.pop(key, 0)
+        (self.root / key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._load()
+            return {
+                "files": len(entries),
+                "bytes": self._size,
+                "capacity": self.capacity,
+                **self._counters,
+            }
+
+
+class S3Storage:
+    """Media kept in an S3-compatible bucket, read through a local disk cache.
+
+    Requests are signed with AWS Signature Version 4 and bodies are streamed
+    from disk, so nodes sharing one bucket never hold a whole image in memory.
+    Files larger than ``part_size`` go up as a multipart upload.
+    """
+
+    name = "s3"
+    internal_prefix = "media-cache"
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        region: str,
+        access_key: str,
+        secret_key: str,
+        cache_root: Path,
+        cache_bytes: int,
+        part_size: int,
+        timeout: float = 30,
+        pool_size: int = 8,
+    ) -> None:
+        parsed = urlsplit(endpoint)
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if parsed.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.host = parsed.hostname or ""
+        self.port = parsed.port
+        self.netloc = parsed.netloc
+        self.base_path = parsed.path.rstrip("/")
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.part_size = part_size
+        self.timeout = timeout
+        self.cache = DiskCache(cache_root, cache_bytes)
+        self.root = self.cache.root
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+
+    def _object_path(self, key: str) -> str:
+        return f"{self.base_path}/{self.bucket}/{key}"
+
+    def _signed_headers(self, method: str, path: str, query: dict, headers: dict) -> dict:
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        signed = {
+            "host": self.netloc,
+            "x-amz-content-sha256": UNSIGNED_PAYLOAD,
+            "x-amz-date": amz_date,
+            **{name.lower(): str(value).strip() for name, value in headers.items()},
+        }
+        names = sorted(signed)
+        canonical_request = "\n".join(
+            [
+                method,
+                quote(path, safe="/-_.~"),
+                _canonical_query(query),
+                "".join(f"{name}:{signed[name]}\n" for name in names),
+                ";".join(names),
+                UNSIGNED_PAYLOAD,
+            ]
+        )
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+            ]
+        )
+        key = f"AWS4{self.secret_key}".encode("utf-8")
+        for part in (amz_date[:8], self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        signed["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={';'.join(names)}, Signature={signature}"
+        )
+        return signed
+
+    def _connection(self, fresh: bool = False) -> tuple[http.client.HTTPConnection, bool]:
+        if not fresh:
+            try:
+                return self._idle.get_nowait(), True
+            except queue.Empty:
+                pass
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection: http.client.HTTPConnection, response) -> None:
+        if response.will_close:
+            connection.close()
+            return
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _request(
+        self,
+        method: str,
+        key: str,
+        query: dict | None = None,
+        headers: dict | None = None,
+        body=None,
+        expect: tuple[int, ...] = (200,),
+        stream_to: Path | None = None,
+    ) -> tuple[int, dict, bytes]:
+        """Send one request; the reply body is read whole or streamed to a file."""
+        query = query or {}
+        path = self._object_path(key)
+        target = quote(path, safe="/-_.~")
+        if query:
+            target = f"{target}?{_canonical_query(query)}"
+        request_headers = self._signed_headers(method, path, query, headers or {})
+        start = body.tell() if hasattr(body, "seekable") and body.seekable() else None
+        # Only idempotent requests whose body can be sent again are retried.
+        replayable = method != "POST" and (
+            body is None or isinstance(body, bytes) or start is not None
+        )
+        fresh = False
+        while True:
+            connection, reused = self._connection(fresh)
+            try:
+                connection.request(method, target, body=body, headers=request_headers)
+                response = connection.getresponse()
+                if stream_to is not None and response.status == 200:
+                    with stream_to.open("wb") as destination:
+                        while chunk := response.read(STREAM_CHUNK_BYTES):
+                            destination.write(chunk)
+                    payload = b""
+                else:
+                    payload = response.read()
+            except STALE_CONNECTION_ERRORS as error:
+                connection.close()
+                # Object stores close idle keep-alive connections after a few
+                # seconds; retry once on a fresh one before giving up.
+                if reused and replayable:
+                    if start is not None:
+                        body.seek(start)
+                    fresh = True
+                    continue
+                raise StorageError(f"{method} {key}: {type(error).__name__}") from error
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                raise StorageError(f"{method} {key}: {type(error).__name__}") from error
+            break
+        self._release(connection, response)
+        if response.status not in expect:
+            raise StorageError(f"{method} {key}: HTTP {response.status}")
+        # S3 may report a failed copy or completion inside a 200 reply.
+        if payload.lstrip().startswith(b"<Error"):
+            raise StorageError(f"{method} {key}: {_xml_text(payload, 'Code')}")
+        return response.status, dict(response.getheaders()), payload
+
+    def put_file(self, key: str, source: Path) -> None:
+        size = source.stat().st_size
+        if size > self.part_size:
+            self._multipart_upload(key, source)
+        else:
+            with source.open("rb") as body:
+                self._request(
+                    "PUT",
+                    key,
+                    headers={"Content-Length": size, "Content-Type": "image/webp"},
+                    body=body,
+                )
+        # The node that rendered the file is the likeliest to serve it next.
+        self.cache.add(key, source)
+
+    def _multipart_upload(self, key: str, source: Path) -> None:
+        _status, _headers, payload = self._request(
+            "POST",
+            key,
+            query={"uploads": ""},
+            headers={"Content-Type": "image/webp"},
+        )
+        upload_id = _xml_text(payload, "UploadId")
+        if not upload_id:
+            raise StorageError(f"POST {key}: no UploadId")
+        parts = []
+        try:
+            with source.open("rb") as stream:
+                while chunk := stream.read(self.part_size):
+                    number = len(parts) + 1
+                    _status, headers, _payload = self._request(
+                        "PUT",
+                        key,
+                        query={"partNumber": str(number), "uploadId": upload_id},
+                        headers={"Content-Length": len(chunk)},
+                        body=chunk,
+                    )
+                    etag = {name.lower(): value for name, value in headers.items()}.get("etag")
+                    parts.append((number, etag))
+            manifest = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in parts
+            )
+            body = f"<CompleteMultipartUpload>{manifest}</CompleteMultipartUpload>".encode("utf-8")
+            self._request(
+                "POST",
+                key,
+                query={"uploadId": upload_id},
+                headers={"Content-Length": len(body), "Content-Type": "application/xml"},
+                body=body,
+            )
+        except Exception:
+            try:
+                self._request("DELETE", key, query={"uploadId": upload_id}, expect=(200, 204, 404))
+            except StorageError:
+                pass
+            raise
+
+    def local_path(self, key: str) -> Path:
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        staging = self.cache.staging_file()
+        try:
+            status, _headers, _payload = self._request(
+                "GET", key, expect=(200, 404), stream_to=staging
+            )
+            if status == 404:
+                return self.cache.path(key)
+            return self.cache.add(key, staging)
+        finally:
+            staging.unlink(missing_ok=True)
+
+    def copy(self, source_key: str, key: str) -> None:
+        self._request(
+            "PUT",
+            key,
+            headers={
+                "Content-Length": 0,
+                "x-amz-copy-source": quote(f"/{self.bucket}/{source_key}", safe="/-_.~"),
+            },
+        )
+
+    def delete(self, key: str) -> None:
+        self._request("DELETE", key, expect=(200, 204, 404))
+        self.cache.discard(key)
+
+    def variants(self) -> list[str]:
+        _status, _headers, payload = self._request(
+            "GET", "", query={"list-type": "2", "delimiter": "/"}
+        )
+        return [prefix.rstrip("/") for prefix in _xml_texts(payload, "Prefix")]
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "cache": self.cache.stats()}
+
+
+def _canonical_query(query: dict) -> str:
+    return "&".join(
+        f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}"
+        for name, value in sorted(query.items())
+    )
+
+
+def _xml_texts(payload: bytes, tag: str) -> list[str]:
+    try:
+        elements = ElementTree.fromstring(payload).iterfind(f".//{{*}}{tag}")
+        return [element.text or "" for element in elements]
+    except ElementTree.ParseError:
+        return []
+
+
+def _xml_text(payload: bytes, tag: str) -> str:
+    texts = _xml_texts(payload, tag)
+    return texts[0] if texts else ""
+
+
+_storage_lock = threading.Lock()
+
+
+def media_storage() -> LocalStorage | S3Storage:
+    config = current_app.config
+    if config["MEDIA_STORAGE"] != "s3":
+        settings = ("local", str(config["MEDIA_ROOT"]))
+    else:
+        settings = (
+            "s3",
+            config["S3_ENDPOINT"],
+            config["S3_BUCKET"],
+            config["S3_REGION"],
+            config["S3_ACCESS_KEY_ID"],
+            config["S3_SECRET_ACCESS_KEY"],
+            str(config["MEDIA_CACHE_ROOT"]),
+            config["MEDIA_CACHE_BYTES"],
+            config["S3_PART_SIZE"],
+        )
+    with _storage_lock:
+        cached = current_app.extensions.get(MEDIA_STORAGE_KEY)
+        if cached is None or cached[0] != settings:
+            if cached is not None and hasattr(cached[1], "close"):
+                cached[1].close()
+            if settings[0] == "s3":
+                storage = S3Storage(*settings[1:6], Path(settings[6]), *settings[7:])
+            else:
+                storage = LocalStorage(Path(settings[1]))
+            cached = (settings, storage)
+            current_app.extensions[MEDIA_STORAGE_KEY] = cached
+        return cached[1]
+
+
+class StandInObjectStoreHandler(BaseHTTPRequestHandler):
+    """Answers the subset of the S3 API that ``S3Storage`` uses."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "FabulaObjectStore/1"
+
+    def setup(self):
+        # Like real object stores, drop keep-alive connections left idle.
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def _target(self) -> tuple[Path, dict]:
+        parsed = urlsplit(self.path)
+        relative = Path(parsed.path.lstrip("/"))
+        if ".." in relative.parts or not relative.parts:
+            raise ValueError(parsed.path)
+        query = {
+            name: values[0]
+            for name, values in parse_qs(parsed.query, keep_blank_values=True).items()
+        }
+        return self.server.root / relative, query
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status: int, code: str):
+        self._reply(status, f"<Error><Code>{code}</Code></Error>".encode("utf-8"))
+
+    def _authorized(self) -> bool:
+        credential = f"Credential={self.server.access_key}/"
+        return credential in self.headers.get("Authorization", "")
+
+    def _receive(self, destination: Path) -> str:
+        remaining = int(self.headers.get("Content-Length", "0"))
+        digest = hashlib.md5(usedforsecurity=False)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        with destination.open("wb") as output:
+            while remaining:
+                chunk = self.rfile.read(min(remaining, STREAM_CHUNK_BYTES))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                output.write(chunk)
+                remaining -= len(chunk)
+        return f'"{digest.hexdigest()}"'
+
+    def _dispatch(self):
+        self.server.count(self.command)
+        try:
+            path, query = self._target()
+        except ValueError:
+            return self._error(400, "InvalidURI")
+        if not self._authorized():
+            self.rfile.read(int(self.headers.get("Content-Length", "0")))
+            return self._error(403, "AccessDenied")
+        return getattr(self, f"_handle_{self.command.lower()}")(path, query)
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _dispatch
+
+    def _handle_get(self, path: Path, query: dict):
+        if path.parent == self.server.root:
+            return self._list_prefixes(path, query)
+        if not path.is_file():
+            return self._error(404, "NoSuchKey")
+        size = path.stat().st_size
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        if self.command == "HEAD":
+            return None
+        with path.open("rb") as source:
+            shutil.copyfileobj(source, self.wfile, STREAM_CHUNK_BYTES)
+        return None
+
+    _handle_head = _handle_get
+
+    def _list_prefixes(self, bucket: Path, query: dict):
+        if query.get("delimiter") != "/":
+            return self._error(501, "NotImplemented")
+        names = sorted(entry.name for entry in bucket.iterdir()) if bucket.is_dir() else []
+        prefixes = "".join(
+            f"<CommonPrefixes><Prefix>{name}/</Prefix></CommonPrefixes>" for name in names
+        )
+        body = (
+            f'<ListBucketResult xmlns="{S3_NAMESPACE}">'
+            f"<IsTruncated>false</IsTruncated>{prefixes}</ListBucketResult>"
+        )
+        return self._reply(200, body.encode("utf-8"))
+
+    def _handle_put(self, path: Path, query: dict):
+        if "uploadId" in query:
+            upload = self.server.uploads_root / query["uploadId"]
+            if not upload.is_dir():
+                return self._error(404, "NoSuchUpload")
+            etag = self._receive(upload / f"{int(query['partNumber']):05d}")
+            return self._reply(200, headers={"ETag": etag})
+        copy_source = self.headers.get("x-amz-copy-source")
+        if copy_source:
+            source = self.server.root / copy_source.lstrip("/")
+            if not source.is_file():
+                return self._error(404, "NoSuchKey")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, path)
+            return self._reply(200, b"<CopyObjectResult></CopyObjectResult>")
+        staging = self.server.uploads_root / f".put-{uuid.uuid4().hex}"
+        etag = self._receive(staging)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staging, path)
+        return self._reply(200, headers={"ETag": etag})
+
+    def _handle_post(self, path: Path, query: dict):
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            (self.server.uploads_root / upload_id).mkdir(parents=True)
+            body = (
+                f'<InitiateMultipartUploadResult xmlns="{S3_NAMESPACE}">'
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+            return self._reply(200, body.encode("utf-8"))
+        upload = self.server.uploads_root / query.get("uploadId", "")
+        manifest = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        if not query.get("uploadId") or not upload.is_dir():
+            return self._error(404, "NoSuchUpload")
+        numbers = [
+            int(element.text)
+            for element in ElementTree.fromstring(manifest).iter("PartNumber")
+        ]
+        staging = self.server.uploads_root / f".complete-{upload.name}"
+        with staging.open("wb") as output:
+            for number in numbers:
+                with (upload / f"{number:05d}").open("rb") as part:
+                    shutil.copyfileobj(part, output, STREAM_CHUNK_BYTES)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staging, path)
+        shutil.rmtree(upload, ignore_errors=True)
+        self.server.count("multipart")
+        return self._reply(200, b"<CompleteMultipartUploadResult></CompleteMultipartUploadResult>")
+
+    def _handle_delete(self, path: Path, query: dict):
+        if "uploadId" in query:
+            shutil.rmtree(self.server.uploads_root / query["uploadId"], ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        return self._reply(204)
+
+    def log_message(self, format, *args):
+        return
+
+
+class StandInObjectStoreServer(ThreadingHTTPServer):
+    """Local S3-compatible store for development, tests and multi-node trials.
+
+    Objects are plain files under ``root/<bucket>/<key>``. Signatures are not
+    verified, only that requests name the configured access key.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        root: Path,
+        access_key: str,
+        idle_timeout: float | None = None,
+    ) -> None:
+        super().__init__(address, StandInObjectStoreHandler)
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self.root = Path(root)
+        self.uploads_root = self.root / ".uploads"
+        self.uploads_root.mkdir(parents=True, exist_ok=True)
+        self.access_key = access_key
+        self.requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+    def count(self, kind: str) -> None:
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
@@ -6,6 +6,7 @@ from pathlib import Path
 from flask import (
     Blueprint,
     abort,
+    current_app,
     g,
     jsonify,
     redirect,
@@ -16,15 +17,21 @@ from flask import (
 )
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from .db import get_db
+from .db import decode_cursor, encode_cursor, get_db
 from .i18n import SUPPORTED_LOCALES, translate
 from .media import (
     InvalidImage,
     delete_media,
     drain_media_deletions,
-    process_image,
+    enqueue_photo_processing,
+    inspect_image,
+    link_media,
+    new_storage_name,
     queue_media_deletion,
+    spool_upload,
 )
+from .passwords import PasswordHashBusy, run_password_work
+from .public import MediaUrls
 from .security import (
     api_error,
     audit,
@@ -34,11 +41,21 @@ from .security import (
     safe_next_url,
     valid_password,
 )
+from .serialization import STUDIO_FEED_FIELDS, feed_response
 from .settings import get_site_copy
+from .similarity import near_duplicate_groups
 
 
 bp = Blueprint("studio", __name__, url_prefix="/studio")
 MAX_BULK_DELETE_IDS = 500
+NEAR_DUPLICATE_DISTANCE = 6
+MAX_NEAR_DUPLICATE_DISTANCE = 16
+STUDIO_PHOTO_COLUMNS = """
+    p.id, p.title, p.story, p.original_name, p.album_id, p.album_position,
+    p.status, p.processing_error, p.width, p.height, p.size_bytes,
+    p.created_at, p.storage_name,
+    a.name AS album_name, a.status AS album_status
+"""
 
 
 def album_rows(user_id: int) -> list[dict]:
@@ -62,31 +79,35 @@ def album_rows(user_id: int) -> list[dict]:
     return [dict(row) for row in rows]
 
 
-def serialize_photo(row) -> dict:
-    return {
-        "id": row["id"],
-        "title": row["title"],
-        "story": row["story"],
-        "original_name": row["original_name"],
-        "album_id": row["album_id"],
-        "album_position": row["album_position"],
-        "album_name": row["album_name"] or translate("未分类"),
-        "album_status": row["album_status"],
-        "status": row["status"],
-        "width": row["width"],
-        "height": row["height"],
-        "size_bytes": row["size_bytes"],
-        "created_at": row["created_at"],
-        "thumb_url": (
-            url_for(
-                "public.media_file",
-                variant="thumbs",
-                storage_name=row["storage_name"],
-            )
-            if row["status"] == "ready"
-            else None
-        ),
-    }
+def photo_serializer():
+    """Return a studio row serializer with the per-request lookups done once."""
+    urls = MediaUrls(signed=False)
+    uncategorized = translate("未分类")
+
+    def serialize(row) -> dict:
+        return {
+            "id": row["id"],
+            "title": row["title"],
+            "story": row["story"],
+            "original_name": row["original_name"],
+            "album_id": row["album_id"],
+            "album_position": row["album_position"],
+            "album_name": row["album_name"] or uncategorized,
+            "album_status": row["album_status"],
+            "status": row["status"],
+            "processing_error": (
+                translate(row["processing_error"]) if row["processing_error"] else ""
+            ),
+            "width": row["width"],
+            "height": row["height"],
+            "size_bytes": row["size_bytes"],
+            "created_at": row["created_at"],
+            "thumb_url": (
+                urls("thumbs", row["storage_name"]) if row["status"] == "ready" else None
+            ),
+        }
+
+    return serialize
 
 
 def next_album_position(album_id: int, user_id: int) -> int:
@@ -120,8 +141,8 @@ def next_album_position(album_id: int, user_id: int) -> int:
 
 def ordered_album_photos(album_id: int, user_id: int) -> list[dict]:
     rows = get_db().execute(
-        """
-        SELECT p.*, a.name AS album_name, a.status AS album_status
+        f"""
+        SELECT {STUDIO_PHOTO_COLUMNS}
         FROM photos p
         JOIN albums a ON a.id = p.album_id AND a.user_id = p.user_id
         WHERE p.album_id = ? AND p.user_id = ?
@@ -130,22 +151,38 @@ def ordered_album_photos(album_id: int, user_id: int) -> list[dict]:
         """,
         (album_id, user_id),
     ).fetchall()
-    return [serialize_photo(row) for row in rows]
-
-
-def studio_photos(user_id: int, limit: int = 24, offset: int = 0) -> list[dict]:
+    serialize = photo_serializer()
+    return [serialize(row) for row in rows]
+
+
+def studio_photos(
+    user_id: int,
+    limit: int = 24,
+    cursor: tuple | None = None,
+) -> tuple[list[dict], str | None]:
+    parameters: list[object] = [user_id]
+    keyset = ""
+    if cursor is not None:
+        created_at, photo_id = cursor
+        keyset = "AND p.created_at <= ? AND (p.created_at < ? OR p.id < ?)"
+        parameters.extend([created_at, created_at, photo_id])
+    parameters.append(limit + 1)
     rows = get_db().execute(
-        """
-        SELECT p.*, a.name AS album_name, a.status AS album_status
+        f"""
+        SELECT {STUDIO_PHOTO_COLUMNS}
         FROM photos p
         LEFT JOIN albums a ON a.id = p.album_id
-        WHERE p.user_id = ?
+        WHERE p.user_id = ? {keyset}
         ORDER BY p.created_at DESC, p.id DESC
-        LIMIT ? OFFSET ?
+        LIMIT ?
         """,
-        (user_id, limit, offset),
+        parameters,
     ).fetchall()
-    return [serialize_photo(row) for row in rows]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor((rows[limit - 1]["created_at"], rows[limit - 1]["id"]))
+    serialize = photo_serializer()
+    return [serialize(row) for row in rows[:limit]], next_cursor
 
 
 def about_data(user_id: int) -> dict:
@@ -190,12 +227,13 @@ def workspace():
     if active_tab not in allowed_tabs:
         active_tab = "photos"
     connection = get_db()
-    photos = studio_photos(g.user["id"])
+    photos, next_cursor = studio_photos(g.user["id"])
     return render_template(
         "studio.html",
         active_tab=active_tab,
         albums=album_rows(g.user["id"]),
         photos=photos,
+        next_cursor=next_cursor,
         photo_total=connection.execute(
             "SELECT COUNT(*) FROM photos WHERE user_id = ?",
             (g.user["id"],),
@@ -237,18 +275,47 @@ def update_locale():
 @password_ready
 def photo_list():
     limit = min(max(request.args.get("limit", 24, type=int), 1), 24)
-    offset = max(request.args.get("offset", 0, type=int), 0)
-    items = studio_photos(g.user["id"], limit=limit, offset=offset)
+    try:
+        cursor = decode_cursor(request.args.get("cursor"), 2)
+    except ValueError:
+        return api_error(translate("请求无效"))
+    items, next_cursor = studio_photos(g.user["id"], limit=limit, cursor=cursor)
     total = get_db().execute(
         "SELECT COUNT(*) FROM photos WHERE user_id = ?",
         (g.user["id"],),
     ).fetchone()[0]
-    next_offset = offset + len(items)
+    return feed_response(STUDIO_FEED_FIELDS, items, total, next_cursor)
+
+
+@bp.get("/api/photos/near-duplicates")
+@password_ready
+def photo_near_duplicates():
+    distance = min(
+        max(request.args.get("distance", NEAR_DUPLICATE_DISTANCE, type=int), 0),
+        MAX_NEAR_DUPLICATE_DISTANCE,
+    )
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 100)
+    groups = near_duplicate_groups(g.user["id"], distance)
+    shown = groups[:limit]
+    rows = get_db().execute(
+        f"""
+        SELECT {STUDIO_PHOTO_COLUMNS}
+        FROM photos p
+        LEFT JOIN albums a ON a.id = p.album_id
+        WHERE p.user_id = ? AND p.id IN (SELECT value FROM json_each(?))
+        """,
+        (g.user["id"], json.dumps([photo_id for group in shown for photo_id in group])),
+    ).fetchall()
+    serialize = photo_serializer()
+    photos = {row["id"]: serialize(row) for row in rows}
     return jsonify(
         {
-            "items": items,
-            "total": total,
-            "next_offset": next_offset if next_offset < total else None,
+            "distance": distance,
+            "total": len(groups),
+            "groups": [
+                [photos[photo_id] for photo_id in group if photo_id in photos]
+                for group in shown
+            ],
         }
     )
 
@@ -586,23 +653,70 @@ def upload_photo():
         if album["status"] == "published":
             return api_error(translate("请先撤回发布，再向摄影集上传照片"), 409)
     try:
-        processed = process_image(uploaded.stream)
+        inspect_image(uploaded.stream)
     except InvalidImage as error:
         return api_error(str(error))
     original_name = Path(uploaded.filename).name[:180]
     title = Path(original_name).stem[:80]
+    storage_name = new_storage_name()
+    source_path, content_hash = spool_upload(uploaded.stream, storage_name)
     connection = get_db()
+    # Re-uploading an export the same photographer already has (typically a
+    # retried batch) reuses the rendered files instead of decoding again.
+    # Only the uploader's own photos are considered.
+    duplicate = connection.execute(
+        """
+        SELECT
+            storage_name, width, height, size_bytes, derivatives,
+            placeholder, dominant_color, perceptual_hash
+        FROM photos
+        WHERE user_id = ? AND content_hash = ? AND status = 'ready'
+        ORDER BY id DESC
+        LIMIT 1
+        """,
+        (g.user["id"], content_hash),
+    ).fetchone()
+    if duplicate is not None:
+        try:
+            link_media(duplicate["storage_name"], storage_name, duplicate["derivatives"])
+        except OSError:
+            current_app.logger.warning(
+                "Could not reuse media %s for a duplicate upload",
+                duplicate["storage_name"],
+            )
+            duplicate = None
+        else:
+            source_path.unlink(missing_ok=True)
+
+    def discard_upload() -> None:
+        source_path.unlink(missing_ok=True)
+        if duplicate is not None:
+            delete_media(storage_name)
+
+    if duplicate is None:
+        rendered = ("processing", 0, 0, 0, "", "", "", None)
+    else:
+        rendered = (
+            "ready",
+            duplicate["width"],
+            duplicate["height"],
+            duplicate["size_bytes"],
+            duplicate["derivatives"],
+            duplicate["placeholder"],
+            duplicate["dominant_color"],
+            duplicate["perceptual_hash"],
+        )
     try:
         connection.execute("BEGIN IMMEDIATE")
         if album_id is not None:
             album = owned_album(album_id)
             if album is None:
                 connection.rollback()
-                delete_media(processed["storage_name"])
+                discard_upload()
                 return api_error(translate("不能向其他用户的摄影集上传照片"), 403)
             if album["status"] == "published":
                 connection.rollback()
-                delete_media(processed["storage_name"])
+                discard_upload()
                 return api_error(
                     translate("请先撤回发布，再向摄影集上传照片"),
                     409,
@@ -616,36 +730,41 @@ def upload_photo():
             """
             INSERT INTO photos (
                 user_id, album_id, album_position, storage_name, original_name, title,
-                status, mime_type, width, height, size_bytes
-            ) VALUES (?, ?, ?, ?, ?, ?, 'ready', 'image/webp', ?, ?, ?)
+                content_hash, status, width, height, size_bytes, derivatives,
+                placeholder, dominant_color, perceptual_hash, mime_type
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'image/webp')
             """,
             (
                 g.user["id"],
                 album_id,
                 album_position,
-                processed["storage_name"],
+                storage_name,
                 original_name,
                 title,
-                processed["width"],
-                processed["height"],
-                processed["size_bytes"],
+                content_hash,
+                *rendered,
             ),
         )
         connection.commit()
     except Exception:
         connection.rollback()
-        delete_media(processed["storage_name"])
+        discard_upload()
         raise
+    if duplicate is None:
+        enqueue_photo_processing(cursor.lastrowid, storage_name)
     photo = connection.execute(
-        """
-        SELECT p.*, a.name AS album_name, a.status AS album_status
+        f"""
+        SELECT {STUDIO_PHOTO_COLUMNS}
         FROM photos p
         LEFT JOIN albums a ON a.id = p.album_id
         WHERE p.id = ?
         """,
         (cursor.lastrowid,),
     ).fetchone()
-    return jsonify({"success": True, "photo": serialize_photo(photo)})
+    return (
+        jsonify({"success": True, "photo": photo_serializer()(photo)}),
+        202 if duplicate is None else 201,
+    )
 
 
 @bp.patch("/api/photos/<int:photo_id>")
@@ -856,14 +975,30 @@ def change_password():
     current_password = str(values.get("current_password", ""))
     new_password = str(values.get("new_password", ""))
     confirmation = str(values.get("confirmation", ""))
-    if not check_password_hash(g.user["password_hash"], current_password):
-        return api_error(translate("当前密码不正确"))
-    if not valid_password(new_password):
-        return api_error(translate("新密码至少 12 个字符，并同时包含字母和数字"))
-    if new_password == current_password:
-        return api_error(translate("新密码不能与当前密码相同"))
-    if new_password != confirmation:
-        return api_error(translate("两次输入的新密码不一致"))
+    try:
+        if not run_password_work(
+            check_password_hash,
+            g.user["password_hash"],
+            current_password,
+        ):
+            return api_error(translate("当前密码不正确"))
+        if not valid_password(new_password):
+            return api_error(translate("新密码至少 12 个字符，并同时包含字母和数字"))
+        if new_password == current_password:
+            return api_error(translate("新密码不能与当前密码相同"))
+        if new_password != confirmation:
+            return api_error(translate("两次输入的新密码不一致"))
+        new_hash = run_password_work(
+            generate_password_hash,
+            new_password,
+            current_app.config["PASSWORD_HASH_METHOD"],
+        )
+    except PasswordHashBusy:
+        response, status = api_error(translate("服务器繁忙，请稍后再试。"), 503)
+        response.headers["Retry-After"] = str(
+            current_app.config["PASSWORD_QUEUE_TIMEOUT_SECONDS"]
+        )
+        return response, status
     connection = get_db()
     connection.execute(
         """
@@ -874,7 +1009,7 @@ def change_password():
             updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
         WHERE id = ?
         """,
-        (generate_password_hash(new_password), g.user["id"]),
+        (new_hash, g.user["id"]),
     )
     audit("password.changed", target_user_id=g.user["id"])
     connection.commit()
@@ -1,18 +1,202 @@
 from __future__ import annotations
 
+import http.client
 import json
 import logging
-from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
+import queue
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
 
 from flask import current_app
 
 
 SITEVERIFY_URL = "https://challenges.cloudflare.com/turnstile/v0/siteverify"
+SITEVERIFY_CLIENT_KEY = "fabula.siteverify"
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000)
 LOGGER = logging.getLogger(__name__)
 
 
+class SiteverifyUnavailable(Exception):
+    """Raised when Siteverify cannot be reached or returns an unusable reply."""
+
+
+class SiteverifyClient:
+    """Keep-alive Siteverify client with a circuit breaker.
+
+    Up to ``pool_size`` idle HTTPS connections are reused between logins. After
+    ``failure_threshold`` consecutive transport failures the breaker opens and
+    logins fail fast for ``reset_seconds``; then a single probe request decides
+    whether it closes again.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float,
+        pool_size: int,
+        failure_threshold: int,
+        reset_seconds: int,
+    ) -> None:
+        parsed = urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if parsed.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.host = parsed.hostname or ""
+        self.port = parsed.port
+        self.path = parsed.path or "/"
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self._latency_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._latency_sum_ms = 0.0
+        self._outcomes = {
+            "ok": 0,
+            "failed": 0,
+            "short_circuited": 0,
+            "connections_opened": 0,
+        }
+
+    def _admit(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_seconds and not self._probing:
+                self._probing = True
+                return True
+            self._outcomes["short_circuited"] += 1
+            return False
+
+    def _record(self, elapsed_ms: float, success: bool) -> None:
+        with self._lock:
+            self._latency_counts[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            self._latency_sum_ms += elapsed_ms
+            self._probing = False
+            if success:
+                self._outcomes["ok"] += 1
+                self._consecutive_failures = 0
+                self._opened_at = None
+                return
+            self._outcomes["failed"] += 1
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def _connection(self) -> tuple[http.client.HTTPConnection, bool]:
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            with self._lock:
+                self._outcomes["connections_opened"] += 1
+            return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection: http.client.HTTPConnection) -> None:
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _post(self, body: bytes) -> dict:
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+        while True:
+            connection, reused = self._connection()
+            try:
+                connection.request("POST", self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                # An idle keep-alive connection may have been closed by the
+                # server; retry once on a fresh one before counting a failure.
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            if response.status != 200:
+                raise SiteverifyUnavailable(f"HTTP {response.status}")
+            return json.loads(payload.decode("utf-8"))
+
+    def verify(self, fields: dict) -> dict:
+        if not self._admit():
+            raise SiteverifyUnavailable("circuit open")
+        started = time.perf_counter()
+        try:
+            result = self._post(urlencode(fields).encode("utf-8"))
+        except (OSError, http.client.HTTPException, ValueError, SiteverifyUnavailable) as error:
+            self._record((time.perf_counter() - started) * 1000, False)
+            raise SiteverifyUnavailable(type(error).__name__) from error
+        self._record((time.perf_counter() - started) * 1000, True)
+        return result
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._opened_at is None:
+                circuit = "closed"
+            elif time.monotonic() - self._opened_at >= self.reset_seconds:
+                circuit = "half-open"
+            else:
+                circuit = "open"
+            bounds = [*(str(bound) for bound in LATENCY_BUCKETS_MS), "+Inf"]
+            return {
+                "circuit": circuit,
+                "consecutive_failures": self._consecutive_failures,
+                "idle_connections": self._idle.qsize(),
+                "outcomes": dict(self._outcomes),
+                "latency_ms": {
+                    "buckets": dict(zip(bounds, self._latency_counts)),
+                    "count": sum(self._latency_counts),
+                    "sum": round(self._latency_sum_ms, 2),
+                },
+            }
+
+
+_client_lock = threading.Lock()
+
+
+def siteverify_client() -> SiteverifyClient:
+    config = current_app.config
+    settings = (
+        config["TURNSTILE_SITEVERIFY_URL"],
+        config["TURNSTILE_TIMEOUT_SECONDS"],
+        config["TURNSTILE_POOL_SIZE"],
+        config["TURNSTILE_BREAKER_THRESHOLD"],
+        config["TURNSTILE_BREAKER_RESET_SECONDS"],
+    )
+    with _client_lock:
+        cached = current_app.extensions.get(SITEVERIFY_CLIENT_KEY)
+        if cached is None or cached[0] != settings:
+            if cached is not None:
+                cached[1].close()
+            cached = (settings, SiteverifyClient(*settings))
+            current_app.extensions[SITEVERIFY_CLIENT_KEY] = cached
+        return cached[1]
+
+
 def is_enabled() -> bool:
     return bool(
         current_app.config.get("TURNSTILE_SITE_KEY")
@@ -30,37 +214,16 @@ def verify_token(token: str, remote_ip: str) -> tuple[bool, str]:
     if callable(verifier):
         result = verifier(token, remote_ip)
     else:
-        body = urlencode(
-            {
-                "secret": current_app.config["TURNSTILE_SECRET_KEY"],
-                "response": token,
-                "remoteip": remote_ip,
-            }
-        ).encode("utf-8")
-        verification_request = Request(
-            SITEVERIFY_URL,
-            data=body,
-            headers={
-                "Accept": "application/json",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            method="POST",
-        )
         try:
-            with urlopen(
-                verification_request,
-                timeout=current_app.config["TURNSTILE_TIMEOUT_SECONDS"],
-            ) as response:
-                result = json.loads(response.read().decode("utf-8"))
-        except (
-            HTTPError,
-            URLError,
-            TimeoutError,
-            OSError,
-            UnicodeDecodeError,
-            json.JSONDecodeError,
-        ) as error:
-            LOGGER.warning("Turnstile Siteverify request failed: %s", type(error).__name__)
+            result = siteverify_client().verify(
+                {
+                    "secret": current_app.config["TURNSTILE_SECRET_KEY"],
+                    "response": token,
+                    "remoteip": remote_ip,
+                }
+            )
+        except SiteverifyUnavailable as error:
+            LOGGER.warning("Turnstile Siteverify request failed: %s", error)
             return False, "siteverify-unavailable"
 
     if not isinstance(result, dict) or not result.get("success"):
@@ -73,3 +236,56 @@ def verify_token(token: str, remote_ip: str) -> tuple[bool, str]:
     if expected_hostnames and response_hostname not in expected_hostnames:
         return False, "hostname-mismatch"
     return True, "verified"
+
+
+class StandInSiteverifyHandler(BaseHTTPRequestHandler):
+    """Answers like Siteverify: tokens starting with "fail" are rejected."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "FabulaSiteverify/1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        fields = parse_qs(self.rfile.read(length).decode("utf-8"))
+        token = fields.get("response", [""])[0]
+        if self.server.delay_seconds:
+            time.sleep(self.server.delay_seconds)
+        success = bool(token) and not token.startswith("fail")
+        payload = {
+            "success": success,
+            "action": self.server.action,
+            "hostname": self.server.reply_hostname,
+            "error-codes": [] if success else ["invalid-input-response"],
+        }
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class StandInSiteverifyServer(ThreadingHTTPServer):
+    """Local Siteverify replacement for offline development and load tests."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        reply_hostname: str = "localhost",
+        action: str = "login",
+        delay_ms: int = 0,
+    ) -> None:
+        super().__init__(address, StandInSiteverifyHandler)
+        self.reply_hostname = reply_hostname
+        self.action = action
+        self.delay_seconds = delay_ms / 1000
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
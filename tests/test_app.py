@@ -1,8 +1,15 @@
 from __future__ import annotations
 
+import base64
+import gzip
+import json
+import os
 import re
+import shutil
+import socket
 import sqlite3
 import tempfile
+import threading
 import time
 import unittest
 from concurrent.futures import ThreadPoolExecutor
@@ -10,15 +17,36 @@ from io import BytesIO
 from pathlib import Path
 from unittest.mock import patch
 
+from flask import url_for
 from PIL import Image
 from pillow_heif import options as heif_options
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from fabula import create_app
 from fabula.cli import bootstrap_admin
-from fabula.db import get_db
-from fabula.media import drain_media_deletions, process_image
-from fabula.security import reserve_login_attempt
+from fabula.db import get_db, rebuild_publication_counters
+from fabula.maintenance import MaintenanceScheduler, maintenance_scheduler
+from fabula.media import (
+    ImageProcessingBusy,
+    MemoryBudget,
+    delete_media,
+    drain_media_deletions,
+    image_memory_budget,
+    image_worker_count,
+    media_shard,
+    _complete_photo_processing,
+    migrate_media_batch,
+    process_image,
+    resume_photo_processing,
+    upload_source_path,
+)
+from fabula.passwords import PasswordHashBusy, run_password_work
+from fabula.public import MediaUrls, public_albums, public_photos
+from fabula.security import login_limiter, reserve_login_attempt
+from fabula.settings import get_site_copy, get_site_images, save_site_copy
+from fabula.similarity import MultiIndexHash, block_count, hamming_distance
+from fabula.storage import StandInObjectStoreServer, media_storage
+from fabula.turnstile import StandInSiteverifyServer, siteverify_client, verify_token
 
 
 CSRF_PATTERN = re.compile(rb'<meta name="csrf-token" content="([^"]+)">')
@@ -130,6 +158,22 @@ class FabulaTestCase(unittest.TestCase):
         stream.seek(0)
         return stream
 
+    def stored_media(self, variant, storage_name):
+        return self.data_root / "media" / variant / media_shard(storage_name) / storage_name
+
+    def wait_for_photo(self, photo_id, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.app.app_context():
+                status = get_db().execute(
+                    "SELECT status FROM photos WHERE id = ?",
+                    (photo_id,),
+                ).fetchone()["status"]
+            if status != "processing":
+                return status
+            time.sleep(0.05)
+        self.fail(f"photo {photo_id} is still processing")
+
     def csrf_from(self, response):
         match = CSRF_PATTERN.search(response.data)
         self.assertIsNotNone(match)
@@ -191,6 +235,38 @@ class FabulaTestCase(unittest.TestCase):
         self.assertIn("white-space: pre-wrap;", public_css)
         self.assertNotIn(".public-site {\n  -webkit-user-select: none", public_css)
 
+    def test_built_assets_are_fingerprinted_precompressed_and_immutable(self):
+        self.app.config["ASSET_BUILD_ROOT"] = self.data_root / "assets"
+        result = self.app.test_cli_runner().invoke(args=["build-assets"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        html = self.client.get("/").get_data(as_text=True)
+        stylesheet = re.search(r'href="(/static/build/css/app\.[0-9a-f]{12}\.css)"', html)
+        self.assertIsNotNone(stylesheet)
+        self.assertRegex(html, r'src="/static/build/js/public\.[0-9a-f]{12}\.js"')
+        original = Path(self.app.static_folder, "css", "app.css").read_bytes()
+
+        compressed = self.client.get(
+            stylesheet.group(1),
+            headers={"Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertEqual(compressed.mimetype, "text/css")
+        self.assertIn("immutable", compressed.headers["Cache-Control"])
+        self.assertIn("max-age=31536000", compressed.headers["Cache-Control"])
+        self.assertIn("Accept-Encoding", compressed.headers["Vary"])
+        self.assertEqual(gzip.decompress(compressed.get_data()), original)
+        compressed.close()
+
+        plain = self.client.get(stylesheet.group(1))
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.get_data(), original)
+        plain.close()
+
+        unhashed = self.client.get("/static/css/app.css")
+        self.assertNotIn("immutable", unhashed.headers.get("Cache-Control", ""))
+        unhashed.close()
+
     def test_empty_public_album_uses_upload_copy(self):
         response = self.client.get("/")
         html = response.get_data(as_text=True)
@@ -297,6 +373,696 @@ class FabulaTestCase(unittest.TestCase):
             404,
         )
 
+    def test_signed_media_urls_are_served_without_database_lookups(self):
+        storage_name = "a" * 32 + ".webp"
+        (self.data_root / "media" / "original" / storage_name).write_bytes(b"signed")
+        self.app.config.update(SIGNED_MEDIA_URLS=True, MEDIA_EPOCH_TTL_SECONDS=300)
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+
+        image_url = self.client.get("/api/public/photos").get_json()["items"][0]["image_url"]
+        self.assertRegex(image_url, rf"^/media/\d+/[0-9a-f]{{32}}/original/{storage_name}$")
+        with patch("fabula.public.get_db") as database, patch(
+            "fabula.public.media_epoch"
+        ) as epoch:
+            response = self.client.get(image_url)
+            database.assert_not_called()
+            epoch.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.headers["Cache-Control"],
+            "public, max-age=31536000, immutable",
+        )
+        response.close()
+        tampered = image_url.replace("/original/", "/thumbs/")
+        self.assertEqual(self.client.get(tampered).status_code, 404)
+
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'draft' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+        self.app.config["MEDIA_EPOCH_TTL_SECONDS"] = 0
+        self.assertEqual(self.client.get(image_url).status_code, 404)
+
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+        renewed_url = self.client.get("/api/public/photos").get_json()["items"][0]["image_url"]
+        self.assertNotEqual(renewed_url, image_url)
+        renewed = self.client.get(renewed_url)
+        self.assertEqual(renewed.status_code, 200)
+        renewed.close()
+
+    def test_media_can_be_offloaded_to_the_reverse_proxy(self):
+        storage_name = "a" * 32 + ".webp"
+        original = self.data_root / "media" / "original" / storage_name
+        original.write_bytes(b"offloaded")
+        self.app.config["MEDIA_OFFLOAD"] = "nginx"
+        self.assertEqual(self.client.get(f"/media/original/{storage_name}").status_code, 404)
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+
+        response = self.client.get(f"/media/original/{storage_name}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), b"")
+        self.assertEqual(response.mimetype, "image/webp")
+        self.assertEqual(
+            response.headers["X-Accel-Redirect"],
+            f"/_fabula_protected/media/original/{storage_name}",
+        )
+        self.assertEqual(
+            response.headers["Cache-Control"],
+            "public, max-age=0, must-revalidate",
+        )
+        missing = self.client.get(f"/media/thumbs/{storage_name}")
+        self.assertEqual(missing.status_code, 404)
+
+        self.app.config.update(MEDIA_OFFLOAD="sendfile", USE_X_SENDFILE=True)
+        response = self.client.get(f"/media/original/{storage_name}")
+        self.assertEqual(response.headers["X-Sendfile"], str(original))
+        self.assertNotIn("X-Accel-Redirect", response.headers)
+        response.close()
+
+    def test_flat_media_is_served_until_migrated_into_shards(self):
+        storage_name = "a" * 32 + ".webp"
+        for variant in ("original", "thumbs", "w480"):
+            directory = self.data_root / "media" / variant
+            directory.mkdir(exist_ok=True)
+            (directory / storage_name).write_bytes(variant.encode())
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().execute(
+                "UPDATE photos SET derivatives = '480' WHERE id = ?",
+                (self.photo_one_id,),
+            )
+            get_db().commit()
+        self.app.config["MEDIA_OFFLOAD"] = "nginx"
+        response = self.client.get(f"/media/thumbs/{storage_name}")
+        self.assertEqual(
+            response.headers["X-Accel-Redirect"],
+            f"/_fabula_protected/media/thumbs/{storage_name}",
+        )
+
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=["migrate-media-layout", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("已迁移 2 个文件", result.output)
+        self.assertIn("本次迁移 3 个文件", result.output)
+        for variant in ("original", "thumbs", "w480"):
+            self.assertFalse((self.data_root / "media" / variant / storage_name).exists())
+            self.assertEqual(
+                self.stored_media(variant, storage_name).read_bytes(),
+                variant.encode(),
+            )
+        response = self.client.get(f"/media/thumbs/{storage_name}")
+        self.assertEqual(
+            response.headers["X-Accel-Redirect"],
+            f"/_fabula_protected/media/thumbs/{media_shard(storage_name)}/{storage_name}",
+        )
+        self.app.config["MEDIA_OFFLOAD"] = ""
+        response = self.client.get(f"/media/w480/{storage_name}")
+        self.assertEqual(response.get_data(), b"w480")
+        response.close()
+        result = runner.invoke(args=["migrate-media-layout"])
+        self.assertIn("本次迁移 0 个文件", result.output)
+
+        with self.app.app_context():
+            delete_media(storage_name)
+        self.assertFalse(self.stored_media("original", storage_name).exists())
+
+        # A photo deleted between listing and moving is skipped, not fatal.
+        (self.data_root / "media" / "thumbs" / storage_name).write_bytes(b"thumbs")
+        replace = os.replace
+
+        def deleted_first(source, destination):
+            os.unlink(source)
+            return replace(source, destination)
+
+        with self.app.app_context(), patch("fabula.media.os.replace", deleted_first):
+            self.assertEqual(migrate_media_batch(10), 0)
+        self.assertFalse(self.stored_media("thumbs", storage_name).exists())
+
+    def test_object_storage_streams_uploads_and_serves_through_disk_cache(self):
+        store_root = self.data_root / "object-store"
+        server = StandInObjectStoreServer(("127.0.0.1", 0), store_root, "test-access")
+        serving = threading.Thread(target=server.serve_forever, daemon=True)
+        serving.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        cache_root = self.data_root / "media-cache"
+        self.app.config.update(
+            IMAGE_WORKERS=0,
+            MEDIA_STORAGE="s3",
+            S3_ENDPOINT=f"http://127.0.0.1:{server.server_port}",
+            S3_BUCKET="fabula",
+            S3_ACCESS_KEY_ID="test-access",
+            S3_SECRET_ACCESS_KEY="test-secret",
+            MEDIA_CACHE_ROOT=cache_root,
+            S3_PART_SIZE=64 * 1024,
+        )
+        storage_name = "a" * 32 + ".webp"
+        noise = Image.frombytes("RGB", (600, 400), os.urandom(600 * 400 * 3))
+        source = BytesIO()
+        noise.save(source, "PNG")
+        source.seek(0)
+        with self.app.app_context():
+            processed = process_image(source, storage_name)
+            get_db().execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+        key = f"original/{media_shard(storage_name)}/{storage_name}"
+        stored = store_root / "fabula" / key
+        self.assertEqual(stored.stat().st_size, processed["size_bytes"])
+        self.assertGreater(processed["size_bytes"], 64 * 1024)
+        self.assertGreaterEqual(server.requests["multipart"], 1)
+        self.assertEqual(stored.read_bytes(), (cache_root / key).read_bytes())
+        self.assertFalse((self.data_root / "media" / key).exists())
+        self.assertEqual(list((self.data_root / "tmp").iterdir()), [])
+
+        # Another node's cache starts cold and fills from the store on first read.
+        shutil.rmtree(cache_root)
+        self.app.config["MEDIA_OFFLOAD"] = "nginx"
+        response = self.client.get(f"/media/thumbs/{storage_name}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.headers["X-Accel-Redirect"],
+            f"/_fabula_protected/media-cache/thumbs/{media_shard(storage_name)}/{storage_name}",
+        )
+        self.client.get(f"/media/thumbs/{storage_name}")
+        self.assertEqual(server.requests["GET"], 1)
+        thumb = cache_root / "thumbs" / media_shard(storage_name) / storage_name
+        self.assertTrue(thumb.is_file())
+
+        self.app.config["MEDIA_CACHE_BYTES"] = thumb.stat().st_size
+        self.app.config["MEDIA_OFFLOAD"] = ""
+        response = self.client.get(f"/media/original/{storage_name}")
+        self.assertEqual(response.get_data(), stored.read_bytes())
+        response.close()
+        self.assertFalse(thumb.exists())
+        with self.app.app_context():
+            self.assertEqual(media_storage().stats()["cache"]["evictions"], 1)
+            self.assertEqual(processed["derivatives"], "480")
+            # Renditions of rungs dropped from the ladder are still deleted.
+            self.app.config["IMAGE_LADDER"] = (640,)
+            delete_media(storage_name)
+        remaining = [path for path in (store_root / "fabula").rglob("*") if path.is_file()]
+        self.assertEqual(remaining, [])
+        self.assertFalse((cache_root / key).exists())
+
+    def test_object_storage_retries_connections_the_store_closed_while_idle(self):
+        server = StandInObjectStoreServer(
+            ("127.0.0.1", 0), self.data_root / "object-store", "test-access", idle_timeout=0.2
+        )
+        serving = threading.Thread(target=server.serve_forever, daemon=True)
+        serving.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.app.config.update(
+            MEDIA_STORAGE="s3",
+            S3_ENDPOINT=f"http://127.0.0.1:{server.server_port}",
+            S3_BUCKET="fabula",
+            S3_ACCESS_KEY_ID="test-access",
+            S3_SECRET_ACCESS_KEY="test-secret",
+            MEDIA_CACHE_ROOT=self.data_root / "media-cache",
+        )
+        source = self.data_root / "tmp" / "rendered.webp"
+        with self.app.app_context():
+            storage = media_storage()
+            source.write_bytes(b"first")
+            storage.put_file("original/aa/bb/one.webp", source)
+            for step in ("put", "copy", "get", "delete"):
+                time.sleep(0.4)
+                if step == "put":
+                    source.write_bytes(b"second")
+                    storage.put_file("original/aa/bb/two.webp", source)
+                elif step == "copy":
+                    storage.copy("original/aa/bb/two.webp", "thumbs/aa/bb/two.webp")
+                elif step == "get":
+                    storage.cache.discard("thumbs/aa/bb/two.webp")
+                    self.assertEqual(
+                        storage.local_path("thumbs/aa/bb/two.webp").read_bytes(), b"second"
+                    )
+                else:
+                    storage.delete("original/aa/bb/one.webp")
+        bucket = self.data_root / "object-store" / "fabula"
+        self.assertFalse((bucket / "original/aa/bb/one.webp").exists())
+        self.assertEqual(server.connections, 5)
+
+    def test_static_export_is_incremental_and_drops_withdrawn_media(self):
+        storage_name = "a" * 32 + ".webp"
+        original = self.data_root / "media" / "original" / storage_name
+        original.write_bytes(b"exported")
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+        output = self.data_root / "export"
+        runner = self.app.test_cli_runner()
+        arguments = ["export-static", str(output), "--base-url", "https://photos.example"]
+
+        result = runner.invoke(args=arguments)
+        self.assertEqual(result.exit_code, 0, result.output)
+        index_html = (output / "index.html").read_text(encoding="utf-8")
+        self.assertIn('data-static-feed="/feed"', index_html)
+        self.assertIn(f"/media/thumbs/{storage_name}", index_html)
+        feed = json.loads((output / "feed" / "all" / "1.json").read_text(encoding="utf-8"))
+        self.assertEqual(feed["total"], 1)
+        self.assertIsNone(feed["next_cursor"])
+        self.assertTrue((output / "feed" / str(self.album_one_id) / "1.json").is_file())
+        self.assertIn(
+            "https://photos.example/",
+            (output / "sitemap.xml").read_text(encoding="utf-8"),
+        )
+        self.assertTrue((output / "robots.txt").is_file())
+        self.assertTrue((output / "static" / "css" / "app.css").is_file())
+        exported_media = output / "media" / "original" / storage_name
+        self.assertEqual(exported_media.stat().st_ino, original.stat().st_ino)
+
+        result = runner.invoke(args=arguments)
+        self.assertIn("已是最新", result.output)
+
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'draft' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+        result = runner.invoke(args=arguments)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("删除 2 个文件", result.output)
+        self.assertFalse(exported_media.exists())
+        self.assertFalse((output / "feed" / str(self.album_one_id) / "1.json").exists())
+        feed = json.loads((output / "feed" / "all" / "1.json").read_text(encoding="utf-8"))
+        self.assertEqual(feed["total"], 0)
+
+    def test_photo_feeds_page_with_opaque_keyset_cursors(self):
+        with self.app.app_context():
+            connection = get_db()
+            for index in range(30):
+                photo_id = self._insert_photo(
+                    connection,
+                    self.user_one_id,
+                    self.album_one_id,
+                    f"{index:032x}.webp",
+                    f"批量 {index}",
+                )
+                connection.execute(
+                    """
+                    UPDATE photos
+                    SET created_at = '2026-01-01T00:00:00.000Z', album_position = ?
+                    WHERE id = ?
+                    """,
+                    (index // 2 if index < 26 else None, photo_id),
+                )
+            connection.execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            connection.commit()
+
+        def walk(path):
+            identifiers = []
+            cursor = None
+            while True:
+                url = f"{path}&cursor={cursor}" if cursor else path
+                payload = self.client.get(url).get_json()
+                identifiers.extend(item["id"] for item in payload["items"])
+                cursor = payload["next_cursor"]
+                if cursor is None:
+                    return identifiers, payload["total"]
+
+        for album_filter in ("", f"&album_id={self.album_one_id}"):
+            paged, total = walk(f"/api/public/photos?limit=7{album_filter}")
+            self.assertEqual(len(paged), total)
+            self.assertEqual(len(set(paged)), total)
+            with self.app.test_request_context():
+                expected, _next = public_photos(
+                    self.album_one_id if album_filter else None,
+                    limit=100,
+                )
+            self.assertEqual(paged, [item["id"] for item in expected])
+
+        with self.app.test_request_context():
+            connection = get_db()
+            statements = []
+            connection.set_trace_callback(statements.append)
+            try:
+                for album_id, cursor in (
+                    (None, None),
+                    (None, ("2026-01-01T00:00:00.000Z", 9)),
+                    (self.album_one_id, None),
+                    (self.album_one_id, (12, "2026-01-01T00:00:00.000Z", 9)),
+                    (self.album_one_id, (None, "2026-01-01T00:00:00.000Z", 9)),
+                ):
+                    public_photos(album_id, limit=7, cursor=cursor)
+            finally:
+                connection.set_trace_callback(None)
+            feed_queries = [sql for sql in statements if "FROM photos p" in sql]
+            self.assertEqual(len(feed_queries), 6)
+            for sql in feed_queries:
+                plan = " ".join(
+                    row["detail"]
+                    for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}")
+                )
+                self.assertNotIn("TEMP B-TREE", plan)
+
+        response = self.client.get("/api/public/photos?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+        self.login("user.one", "user-password-2026")
+        paged, total = walk("/studio/api/photos?limit=9")
+        self.assertEqual(total, 31)
+        self.assertEqual(len(set(paged)), 31)
+
+    def test_compact_feed_layout_resolves_media_urls_once_per_page(self):
+        with self.app.app_context():
+            connection = get_db()
+            for index in range(12):
+                self._insert_photo(
+                    connection,
+                    self.user_one_id,
+                    self.album_one_id,
+                    f"{index + 1:032x}.webp",
+                    f"紧凑 {index}",
+                )
+            connection.execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            connection.commit()
+
+        def expand(payload):
+            return [dict(zip(payload["fields"], row)) for row in payload["rows"]]
+
+        with patch("fabula.public.url_for", wraps=url_for) as resolve:
+            compact = self.client.get("/api/public/photos?layout=compact").get_json()
+        self.assertEqual(resolve.call_count, 1)
+        items = self.client.get("/api/public/photos").get_json()
+        self.assertNotIn("items", compact)
+        self.assertEqual(expand(compact), items["items"])
+        self.assertEqual(compact["total"], items["total"])
+        self.assertEqual(
+            items["items"][0]["thumb_url"],
+            f"/media/thumbs/{12:032x}.webp",
+        )
+
+        self.app.config["SIGNED_MEDIA_URLS"] = True
+        with self.app.test_request_context(base_url="https://photos.example/gallery"):
+            signed = MediaUrls(signed=True)("original", "b" * 32 + ".webp")
+            self.assertEqual(
+                signed,
+                url_for(
+                    "public.signed_media_file",
+                    epoch=signed.split("/")[3],
+                    signature=signed.split("/")[4],
+                    variant="original",
+                    storage_name="b" * 32 + ".webp",
+                ),
+            )
+        self.assertTrue(signed.startswith("/gallery/media/"))
+
+        self.login("user.one", "user-password-2026")
+        compact = self.client.get("/studio/api/photos?layout=compact").get_json()
+        items = self.client.get("/studio/api/photos").get_json()
+        self.assertEqual(expand(compact), items["items"])
+
+    def test_publication_counters_follow_photo_and_album_changes(self):
+        def snapshot(connection):
+            return {
+                (row["scope"], row["scope_id"]): row["photo_count"]
+                for row in connection.execute(
+                    "SELECT * FROM publication_counters WHERE photo_count <> 0"
+                )
+            }
+
+        def assert_consistent(connection):
+            maintained = snapshot(connection)
+            rebuild_publication_counters(connection)
+            self.assertEqual(maintained, snapshot(connection))
+            return maintained
+
+        with self.app.app_context():
+            connection = get_db()
+            self.assertEqual(assert_consistent(connection), {})
+            connection.execute("UPDATE albums SET status = 'published'")
+            extra_id = self._insert_photo(
+                connection,
+                self.user_one_id,
+                self.album_one_id,
+                "c" * 32 + ".webp",
+                "第三张",
+            )
+            self.assertEqual(
+                assert_consistent(connection),
+                {
+                    ("site", 0): 3,
+                    ("album", self.album_one_id): 2,
+                    ("album", self.album_two_id): 1,
+                    ("user", self.user_one_id): 2,
+                    ("user", self.user_two_id): 1,
+                },
+            )
+            connection.execute(
+                "UPDATE photos SET status = 'processing' WHERE id = ?",
+                (self.photo_two_id,),
+            )
+            connection.execute(
+                "UPDATE photos SET album_id = NULL WHERE id = ?", (extra_id,)
+            )
+            connection.execute(
+                "UPDATE albums SET status = 'draft' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            self.assertEqual(assert_consistent(connection), {})
+            connection.execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            connection.execute("DELETE FROM photos WHERE id = ?", (self.photo_one_id,))
+            self.assertEqual(assert_consistent(connection), {})
+            connection.execute(
+                "UPDATE photos SET status = 'ready' WHERE id = ?",
+                (self.photo_two_id,),
+            )
+            connection.commit()
+
+        payload = self.client.get("/api/public/photos").get_json()
+        self.assertEqual(payload["total"], 1)
+        payload = self.client.get(
+            f"/api/public/photos?album_id={self.album_one_id}"
+        ).get_json()
+        self.assertEqual(payload["total"], 0)
+
+    def test_anonymous_homepage_is_cached_by_publication_revision(self):
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            get_db().commit()
+
+        with patch("fabula.public.public_albums", wraps=public_albums) as albums:
+            first = self.client.get("/")
+            second = self.client.get("/")
+            self.assertEqual(albums.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertIsNotNone(first.headers.get("ETag"))
+        self.assertFalse(first.headers["ETag"].startswith("W/"))
+        self.assertIn('<meta name="csrf-token" content="">', first.get_data(as_text=True))
+        not_modified = self.client.get(
+            "/", headers={"If-None-Match": first.headers["ETag"]}
+        )
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.get_data(), b"")
+
+        with self.app.app_context():
+            get_db().execute(
+                "UPDATE photos SET title = '新标题' WHERE id = ?",
+                (self.photo_one_id,),
+            )
+            get_db().commit()
+        changed = self.client.get("/", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], first.headers["ETag"])
+
+        self.login("user.one", "user-password-2026")
+        personal = self.client.get("/")
+        self.assertIsNone(personal.headers.get("ETag"))
+        self.csrf_from(personal)
+
+    def test_database_connections_are_pooled_per_thread(self):
+        with self.app.app_context():
+            first = get_db()
+            first.execute("UPDATE photos SET title = '未提交' WHERE id = ?", (self.photo_one_id,))
+            with self.app.app_context():
+                nested = get_db()
+                self.assertIsNot(nested, first)
+                title = nested.execute(
+                    "SELECT title FROM photos WHERE id = ?", (self.photo_one_id,)
+                ).fetchone()["title"]
+                self.assertEqual(title, "所有者的照片")
+            self.assertTrue(first.in_transaction)
+        with self.app.app_context():
+            second = get_db()
+            self.assertIs(second, first)
+            self.assertFalse(second.in_transaction)
+            title = second.execute(
+                "SELECT title FROM photos WHERE id = ?", (self.photo_one_id,)
+            ).fetchone()["title"]
+            self.assertEqual(title, "所有者的照片")
+
+        def other_thread_connection():
+            with self.app.app_context():
+                return get_db()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertIsNot(executor.submit(other_thread_connection).result(), first)
+
+        self.login("admin.user", "admin-password-2026")
+        pools = self.client.get("/api/admin/database-pool").get_json()["database_pool"]
+        self.assertEqual(pools["reader"]["in_use"], 1)
+        stats = pools["writer"]
+        self.assertEqual(stats["in_use"], 0)
+        self.assertGreaterEqual(stats["reused"], 1)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertGreaterEqual(stats["rolled_back"], 1)
+        self.assertGreaterEqual(stats["open"], 1)
+
+    def test_safe_requests_read_through_a_query_only_connection(self):
+        with self.app.test_request_context(method="HEAD"):
+            reader = get_db()
+            self.assertEqual(reader.execute("PRAGMA query_only").fetchone()[0], 1)
+            self.assertGreater(reader.execute("PRAGMA mmap_size").fetchone()[0], 0)
+            self.assertEqual(reader.execute("PRAGMA cache_size").fetchone()[0], -16384)
+            with self.assertRaises(sqlite3.OperationalError):
+                reader.execute("UPDATE photos SET title = '不可写'")
+        with self.app.test_request_context(method="POST"):
+            writer = get_db()
+            self.assertIsNot(writer, reader)
+            self.assertEqual(writer.execute("PRAGMA query_only").fetchone()[0], 0)
+            self.assertEqual(writer.execute("PRAGMA synchronous").fetchone()[0], 1)
+            self.assertEqual(writer.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_maintenance_scheduler_runs_due_jobs_on_one_leader(self):
+        temp_root = Path(self.app.config["TEMP_ROOT"])
+        stale = temp_root / "fabula-stale.webp"
+        fresh = temp_root / "fabula-fresh.webp"
+        pending = temp_root / "fabula-upload-pending.upload"
+        for path in (stale, fresh, pending):
+            path.write_bytes(b"scratch")
+        old = time.time() - 7200
+        for path in (stale, pending):
+            os.utime(path, (old, old))
+        with self.app.app_context():
+            connection = get_db()
+            connection.execute(
+                "INSERT INTO login_attempts (fingerprint, attempted_at) VALUES (?, ?)",
+                ("expired", int(old)),
+            )
+            connection.execute(
+                "INSERT INTO media_cleanup_queue (storage_name, media_kind) VALUES (?, 'photo')",
+                ("f" * 32 + ".webp",),
+            )
+            connection.commit()
+
+        scheduler = MaintenanceScheduler(self.app)
+        follower = MaintenanceScheduler(self.app)
+        try:
+            self.assertEqual(
+                scheduler.run_pending(now=0),
+                [
+                    "media_cleanup",
+                    "photo_processing",
+                    "login_attempts",
+                    "wal_checkpoint",
+                    "temp_sweep",
+                    "optimize",
+                ],
+            )
+            self.assertEqual(scheduler.run_pending(now=30), [])
+            self.assertEqual(
+                scheduler.run_pending(now=61),
+                ["media_cleanup", "photo_processing"],
+            )
+            self.assertEqual(follower.run_pending(now=0), [])
+            self.assertFalse(follower.stats()["leader"])
+
+            stats = scheduler.stats()
+            self.assertTrue(stats["leader"])
+            self.assertEqual(stats["jobs"]["media_cleanup"]["runs"], 2)
+            self.assertEqual(stats["jobs"]["temp_sweep"]["last_result"], 1)
+            self.assertEqual(stats["jobs"]["login_attempts"]["last_result"], 1)
+            self.assertEqual(stats["jobs"]["optimize"]["failures"], 0)
+            self.assertIsNotNone(stats["jobs"]["wal_checkpoint"]["last_duration_ms"])
+            self.assertFalse(stale.exists())
+            self.assertTrue(fresh.exists())
+            self.assertTrue(pending.exists())
+            with self.app.app_context():
+                self.assertEqual(
+                    get_db().execute("SELECT COUNT(*) FROM media_cleanup_queue").fetchone()[0],
+                    0,
+                )
+
+            scheduler.stop()
+            self.assertEqual(len(follower.run_pending(now=0)), 6)
+        finally:
+            scheduler.stop()
+            follower.stop()
+
+        token = self.login("admin.user", "admin-password-2026")
+        response = self.api("GET", "/api/admin/maintenance", token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("optimize", response.get_json()["maintenance"]["jobs"])
+
+    def test_signed_in_user_row_is_cached_until_a_user_changes(self):
+        token = self.login("user.one", "user-password-2026")
+        with self.app.test_request_context(method="GET"):
+            reader = get_db()
+        statements = []
+        reader.set_trace_callback(statements.append)
+        try:
+            self.assertEqual(self.client.get("/studio/api/revision").status_code, 200)
+            self.assertEqual(self.client.get("/studio/api/revision").status_code, 200)
+            user_queries = [sql for sql in statements if "FROM users" in sql]
+            self.assertEqual(user_queries, [])
+
+            statements.clear()
+            self.assertEqual(self.client.get("/healthz").status_code, 200)
+            self.assertFalse(any("user_revision" in sql for sql in statements))
+        finally:
+            reader.set_trace_callback(None)
+
+        with self.app.app_context():
+            connection = get_db()
+            connection.execute(
+                "UPDATE users SET status = 'inactive' WHERE id = ?",
+                (self.user_one_id,),
+            )
+            connection.commit()
+        response = self.api("GET", "/studio/api/revision", token)
+        self.assertEqual(response.status_code, 401)
+
     def test_new_album_is_draft_and_empty_album_cannot_be_published(self):
         token = self.login("user.one", "user-password-2026")
         created = self.api(
@@ -467,8 +1233,9 @@ class FabulaTestCase(unittest.TestCase):
             },
             content_type="multipart/form-data",
         )
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
         uploaded_id = response.get_json()["photo"]["id"]
+        self.assertEqual(self.wait_for_photo(uploaded_id), "ready")
         with self.app.app_context():
             rows = get_db().execute(
                 """
@@ -493,8 +1260,9 @@ class FabulaTestCase(unittest.TestCase):
             data={"photo": (self.heif_stream(96, 144), "IMG_0317.HEIC")},
             content_type="multipart/form-data",
         )
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
         uploaded_id = response.get_json()["photo"]["id"]
+        self.assertEqual(self.wait_for_photo(uploaded_id), "ready")
 
         with self.app.app_context():
             row = get_db().execute(
@@ -508,12 +1276,132 @@ class FabulaTestCase(unittest.TestCase):
             self.assertEqual(row["original_name"], "IMG_0317.HEIC")
             self.assertEqual(row["mime_type"], "image/webp")
             self.assertEqual((row["width"], row["height"]), (96, 144))
-            original_path = self.data_root / "media" / "original" / row["storage_name"]
-            thumb_path = self.data_root / "media" / "thumbs" / row["storage_name"]
+            original_path = self.stored_media("original", row["storage_name"])
+            thumb_path = self.stored_media("thumbs", row["storage_name"])
             for stored_path in (original_path, thumb_path):
                 with Image.open(stored_path) as stored:
                     self.assertEqual(stored.format, "WEBP")
 
+    def test_upload_is_accepted_before_processing_and_failures_are_recorded(self):
+        token = self.login("user.one", "user-password-2026")
+        truncated = self.image_stream(400, 300).getvalue()[:900]
+        response = self.api(
+            "POST",
+            "/studio/api/photos",
+            token,
+            data={"photo": (BytesIO(truncated), "broken.jpg")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 202)
+        photo = response.get_json()["photo"]
+        self.assertEqual(photo["status"], "processing")
+        self.assertIsNone(photo["thumb_url"])
+        self.assertEqual(self.wait_for_photo(photo["id"]), "failed")
+        with self.app.app_context():
+            row = get_db().execute(
+                "SELECT processing_error, storage_name FROM photos WHERE id = ?",
+                (photo["id"],),
+            ).fetchone()
+            revision = get_db().execute(
+                "SELECT revision FROM photo_revisions WHERE user_id = ?",
+                (self.user_one_id,),
+            ).fetchone()["revision"]
+        self.assertEqual(row["processing_error"], "图片文件无效或无法安全处理")
+        self.assertGreaterEqual(revision, 3)
+        self.assertEqual(list((self.data_root / "tmp").glob("fabula-upload-*")), [])
+        self.assertFalse(
+            self.stored_media("original", row["storage_name"]).exists()
+        )
+
+    def test_identical_reupload_reuses_outputs_for_the_same_owner_only(self):
+        source = self.image_stream(900, 600).getvalue()
+
+        def upload(token):
+            return self.api(
+                "POST",
+                "/studio/api/photos",
+                token,
+                data={"photo": (BytesIO(source), "retry.jpg")},
+                content_type="multipart/form-data",
+            )
+
+        token = self.login("user.one", "user-password-2026")
+        first = upload(token)
+        self.assertEqual(first.status_code, 202)
+        first_id = first.get_json()["photo"]["id"]
+        self.assertEqual(self.wait_for_photo(first_id), "ready")
+
+        with patch("fabula.media._run_image_job") as render:
+            second = upload(token)
+            render.assert_not_called()
+        self.assertEqual(second.status_code, 201)
+        photo = second.get_json()["photo"]
+        self.assertEqual(photo["status"], "ready")
+        self.assertIsNotNone(photo["thumb_url"])
+        self.assertEqual(list((self.data_root / "tmp").glob("fabula-upload-*")), [])
+        with self.app.app_context():
+            rows = get_db().execute(
+                """
+                SELECT id, storage_name, width, derivatives, placeholder, content_hash
+                FROM photos WHERE id IN (?, ?) ORDER BY id
+                """,
+                (first_id, photo["id"]),
+            ).fetchall()
+        original, reused = rows
+        self.assertNotEqual(original["storage_name"], reused["storage_name"])
+        for column in ("width", "derivatives", "placeholder", "content_hash"):
+            self.assertEqual(original[column], reused[column])
+        first_file = self.stored_media("original", original["storage_name"])
+        reused_file = self.stored_media("original", reused["storage_name"])
+        self.assertTrue(os.path.samefile(first_file, reused_file))
+
+        response = self.api("DELETE", f"/studio/api/photos/{first_id}", token)
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            drain_media_deletions()
+        self.assertFalse(first_file.exists())
+        self.assertTrue(reused_file.exists())
+
+        self.client.post("/logout", data={"csrf_token": token})
+        other = upload(self.login("user.two", "user-password-2026"))
+        self.assertEqual(other.status_code, 202)
+        self.assertEqual(self.wait_for_photo(other.get_json()["photo"]["id"]), "ready")
+
+    def test_duplicate_processing_jobs_keep_the_published_media(self):
+        storage_name = "d" * 32 + ".webp"
+        with self.app.app_context():
+            connection = get_db()
+            photo_id = self._insert_photo(
+                connection, self.user_one_id, None, storage_name, "重复转码"
+            )
+            connection.execute(
+                "UPDATE photos SET status = 'processing' WHERE id = ?", (photo_id,)
+            )
+            connection.commit()
+            source_path = upload_source_path(storage_name)
+            source_path.write_bytes(self.image_stream().getvalue())
+            # A fresh upload is left to the worker that queued it.
+            self.assertEqual(resume_photo_processing(), 0)
+        rendered = []
+
+        def render_after_a_second_worker_starts(source, name):
+            _complete_photo_processing(self.app, photo_id, storage_name)
+            rendered.append(name)
+            return process_image(source, name)
+
+        with patch(
+            "fabula.media.process_image",
+            side_effect=render_after_a_second_worker_starts,
+        ):
+            _complete_photo_processing(self.app, photo_id, storage_name)
+        _complete_photo_processing(self.app, photo_id, storage_name)
+
+        self.assertEqual(rendered, [storage_name])
+        self.assertEqual(self.wait_for_photo(photo_id), "ready")
+        self.assertTrue(self.stored_media("original", storage_name).exists())
+        self.assertTrue(self.stored_media("thumbs", storage_name).exists())
+        self.assertFalse(source_path.exists())
+
     def test_heif_decoder_uses_restricted_options(self):
         self.assertEqual(heif_options.DECODE_THREADS, 1)
         self.assertFalse(heif_options.THUMBNAILS)
@@ -767,7 +1655,11 @@ class FabulaTestCase(unittest.TestCase):
         self.assertIn(">Account security<", english_html)
         self.assertIn(">中文</button>", english_html)
         self.assertIn('class="photo-order-heading">Order</span>', english_html)
-        self.assertIn("Changes are saved automatically", english_html)
+        catalog_url = re.search(r'<script src="(/i18n/[^"]+)"', english_html).group(1)
+        self.assertIn(
+            "Changes are saved automatically",
+            self.client.get(catalog_url).get_data(as_text=True),
+        )
         self.assertIn("看见日常", english_html)
         self.assertIn("只属于摄影师一的介绍", english_html)
 
@@ -799,6 +1691,29 @@ class FabulaTestCase(unittest.TestCase):
         self.assertIn(">Username<", logged_out_page)
         self.assertIn("进入只属于你的工作台", logged_out_page)
 
+    def test_client_catalog_is_a_versioned_script(self):
+        chinese_html = self.client.get("/login").get_data(as_text=True)
+        self.assertNotIn("/i18n/", chinese_html)
+        with self.client.session_transaction() as browser_session:
+            browser_session["locale"] = "en"
+        english_html = self.client.get("/login").get_data(as_text=True)
+        self.assertNotIn("fabula-i18n", english_html)
+        self.assertNotIn("Switch to Chinese", english_html)
+        catalog_url = re.search(r'<script src="(/i18n/[0-9a-f]{12}/en\.js)" defer>', english_html)
+        self.assertIsNotNone(catalog_url)
+        self.assertLess(english_html.index(catalog_url.group(1)), english_html.index("js/app."))
+
+        response = self.client.get(catalog_url.group(1))
+        self.assertEqual(response.mimetype, "text/javascript")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        body = response.get_data(as_text=True)
+        self.assertTrue(body.startswith("window.FabulaCatalog = {"))
+        self.assertIn('"切换为中文":"Switch to Chinese"', body)
+        stale = self.client.get("/i18n/000000000000/en.js")
+        self.assertEqual(stale.headers["Cache-Control"], "no-cache")
+        self.assertEqual(stale.get_data(as_text=True), body)
+        self.assertEqual(self.client.get("/i18n/000000000000/zh-CN.js").status_code, 404)
+
     def test_invalid_language_is_rejected_without_changing_preference(self):
         token = self.login("user.one", "user-password-2026")
         response = self.client.post(
@@ -926,6 +1841,54 @@ class FabulaTestCase(unittest.TestCase):
                     response.get_data(as_text=True),
                 )
 
+    def test_siteverify_client_reuses_connections_and_breaks_circuit(self):
+        server = StandInSiteverifyServer(("127.0.0.1", 0), "test.local")
+        serving = threading.Thread(target=server.serve_forever, daemon=True)
+        serving.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.app.config.update(
+            TURNSTILE_SITE_KEY="test-site-key",
+            TURNSTILE_SECRET_KEY="test-secret-key",
+            TURNSTILE_EXPECTED_HOSTNAMES=frozenset({"test.local"}),
+            TURNSTILE_SITEVERIFY_URL=(
+                f"http://127.0.0.1:{server.server_port}/turnstile/v0/siteverify"
+            ),
+            TURNSTILE_BREAKER_THRESHOLD=2,
+        )
+        with self.app.test_request_context(method="POST"):
+            self.assertEqual(verify_token("token-1", "127.0.0.1"), (True, "verified"))
+            self.assertEqual(verify_token("token-2", "127.0.0.1"), (True, "verified"))
+            self.assertEqual(
+                verify_token("fail-token", "127.0.0.1"),
+                (False, "verification-failed"),
+            )
+            self.assertEqual(server.connections, 1)
+            stats = siteverify_client().stats()
+            self.assertEqual(stats["outcomes"]["ok"], 3)
+            self.assertEqual(stats["latency_ms"]["count"], 3)
+
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                closed_port = probe.getsockname()[1]
+            self.app.config["TURNSTILE_SITEVERIFY_URL"] = (
+                f"http://127.0.0.1:{closed_port}/turnstile/v0/siteverify"
+            )
+            for _attempt in range(3):
+                self.assertEqual(
+                    verify_token("token-3", "127.0.0.1"),
+                    (False, "siteverify-unavailable"),
+                )
+            stats = siteverify_client().stats()
+            self.assertEqual(stats["circuit"], "open")
+            self.assertEqual(stats["outcomes"]["failed"], 2)
+            self.assertEqual(stats["outcomes"]["short_circuited"], 1)
+
+        self.app.config["TURNSTILE_SITE_KEY"] = ""
+        token = self.login("admin.user", "admin-password-2026")
+        response = self.api("GET", "/api/admin/turnstile", token)
+        self.assertEqual(response.get_json()["siteverify"]["circuit"], "open")
+
     def test_regular_user_cannot_access_admin_api(self):
         token = self.login("user.one", "user-password-2026")
         response = self.api("GET", "/api/admin/users", token)
@@ -1116,8 +2079,70 @@ class FabulaTestCase(unittest.TestCase):
             self.app.config["DUMMY_PASSWORD_HASH"],
         )
 
+    def test_password_hashing_is_bounded_and_upgrades_on_login(self):
+        self.assertIsNone(self.app.config["DUMMY_PASSWORD_HASH"])
+        self.app.config.update(
+            PASSWORD_WORKERS=1,
+            PASSWORD_QUEUE_LIMIT=0,
+            PASSWORD_QUEUE_TIMEOUT_SECONDS=1,
+        )
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait(5)
+            return True
+
+        def occupy_slot():
+            with self.app.app_context():
+                return run_password_work(slow_hash)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            holder = pool.submit(occupy_slot)
+            self.assertTrue(started.wait(5))
+            login_page = self.client.get("/login")
+            busy = self.client.post(
+                "/login",
+                data={
+                    "username": "user.one",
+                    "password": "user-password-2026",
+                    "csrf_token": self.csrf_from(login_page),
+                },
+            )
+            release.set()
+            self.assertTrue(holder.result())
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual(busy.headers["Retry-After"], "1")
+        self.assertIn("登录请求较多，请稍后再试。", busy.get_data(as_text=True))
+
+        self.app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:600000"
+        token = self.login("user.one", "user-password-2026")
+        with self.app.app_context():
+            stored = get_db().execute(
+                "SELECT password_hash FROM users WHERE id = ?",
+                (self.user_one_id,),
+            ).fetchone()["password_hash"]
+        self.assertTrue(stored.startswith("pbkdf2:sha256:600000$"))
+        self.assertTrue(check_password_hash(stored, "user-password-2026"))
+
+        with patch("fabula.studio.run_password_work", side_effect=PasswordHashBusy):
+            busy = self.api(
+                "POST",
+                "/studio/api/account/password",
+                token,
+                json={
+                    "current_password": "user-password-2026",
+                    "new_password": "changed-password-2026",
+                    "confirmation": "changed-password-2026",
+                },
+            )
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual(busy.get_json()["message"], "服务器繁忙，请稍后再试。")
+
     def test_login_attempt_reservation_is_atomic(self):
         fingerprint = "f" * 64
+        self.app.config["LOGIN_LIMITER"] = "sqlite"
         self.app.config["LOGIN_MAX_ATTEMPTS"] = 5
         with self.app.app_context():
             get_db().executemany(
@@ -1140,6 +2165,49 @@ class FabulaTestCase(unittest.TestCase):
             ).fetchone()[0]
         self.assertEqual(count, 5)
 
+    def test_memory_login_limiter_persists_in_batches(self):
+        self.app.config.update(LOGIN_MAX_ATTEMPTS=3, LOGIN_LIMITER_PERSIST_SECONDS=60)
+        fingerprint = "e" * 64
+        with self.app.test_request_context(method="POST"):
+            connection = get_db()
+            statements = []
+            connection.set_trace_callback(statements.append)
+            try:
+                results = [reserve_login_attempt(fingerprint) for _index in range(4)]
+            finally:
+                connection.set_trace_callback(None)
+            self.assertEqual(results, [True, True, True, False])
+            self.assertFalse(any("login_attempts" in sql and "INSERT" in sql for sql in statements))
+            limiter = login_limiter()
+            self.assertEqual(
+                limiter.stats(),
+                {
+                    "backend": "memory",
+                    "fingerprints": 1,
+                    "attempts": 3,
+                    "blocked": 1,
+                    "pending_writes": 3,
+                },
+            )
+            self.assertEqual(limiter.flush(force=True), 3)
+            self.assertEqual(
+                connection.execute(
+                    "SELECT COUNT(*) FROM login_attempts WHERE fingerprint = ?",
+                    (fingerprint,),
+                ).fetchone()[0],
+                3,
+            )
+
+        restarted = create_app(self.app.config)
+        with restarted.test_request_context(method="POST"):
+            self.assertFalse(reserve_login_attempt(fingerprint))
+            login_limiter().clear(fingerprint)
+            self.assertTrue(reserve_login_attempt(fingerprint))
+
+        token = self.login("admin.user", "admin-password-2026")
+        response = self.api("GET", "/api/admin/login-limiter", token)
+        self.assertEqual(response.get_json()["login_limiter"]["backend"], "memory")
+
     def test_image_pixel_budget_rejects_before_processing(self):
         token = self.login("user.one", "user-password-2026")
         self.app.config["MAX_IMAGE_PIXELS"] = 10_000
@@ -1162,15 +2230,16 @@ class FabulaTestCase(unittest.TestCase):
             data={"photo": (self.image_stream(5712, 4284), "IMG_0797.jpeg")},
             content_type="multipart/form-data",
         )
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
         uploaded_id = response.get_json()["photo"]["id"]
+        self.assertEqual(self.wait_for_photo(uploaded_id), "ready")
 
         with self.app.app_context():
             row = get_db().execute(
                 "SELECT storage_name, width, height FROM photos WHERE id = ?",
                 (uploaded_id,),
             ).fetchone()
-            stored_path = self.data_root / "media" / "original" / row["storage_name"]
+            stored_path = self.stored_media("original", row["storage_name"])
             with Image.open(stored_path) as stored:
                 self.assertLessEqual(max(stored.size), 2400)
                 self.assertEqual(stored.size, (row["width"], row["height"]))
@@ -1190,16 +2259,298 @@ class FabulaTestCase(unittest.TestCase):
 
     def test_image_variants_are_bounded_before_encoding(self):
         self.app.config["MAX_IMAGE_PIXELS"] = 4_000_000
+        self.app.config["IMAGE_WORKERS"] = 0
         encoded_sizes = []
 
-        def fake_save(image, destination, quality):
+        def fake_save(image, destination, quality, _temp_root):
             encoded_sizes.append((image.size, quality))
             destination.parent.mkdir(parents=True, exist_ok=True)
             destination.write_bytes(b"test")
 
         with self.app.app_context(), patch("fabula.media._save_webp", side_effect=fake_save):
             process_image(self.image_stream(3000, 1000))
-        self.assertEqual(encoded_sizes, [((2400, 800), 84), ((1000, 333), 78)])
+        self.assertEqual(
+            encoded_sizes,
+            [
+                ((2400, 800), 84),
+                ((1600, 533), 80),
+                ((1200, 400), 80),
+                ((1000, 333), 78),
+                ((800, 267), 80),
+                ((480, 160), 80),
+            ],
+        )
+
+    def test_derivative_ladder_feeds_public_srcset(self):
+        self.app.config["IMAGE_WORKERS"] = 0
+        with self.app.app_context():
+            processed = process_image(self.image_stream(1400, 700))
+            connection = get_db()
+            connection.execute(
+                """
+                UPDATE photos
+                SET storage_name = ?, width = ?, height = ?, derivatives = ?
+                WHERE id = ?
+                """,
+                (
+                    processed["storage_name"],
+                    processed["width"],
+                    processed["height"],
+                    processed["derivatives"],
+                    self.photo_one_id,
+                ),
+            )
+            connection.execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            connection.commit()
+        self.assertEqual(processed["derivatives"], "480,800,1200")
+        storage_name = processed["storage_name"]
+        for variant in ("w480", "w800", "w1200"):
+            self.assertTrue(self.stored_media(variant, storage_name).exists())
+        self.assertFalse(self.stored_media("w1600", storage_name).exists())
+
+        item = self.client.get(
+            f"/api/public/photos?album_id={self.album_one_id}"
+        ).get_json()["items"][0]
+        self.assertEqual(
+            [entry.rsplit(" ", 1)[1] for entry in item["srcset"].split(", ")],
+            ["480w", "800w", "1000w", "1200w", "1400w"],
+        )
+        response = self.client.get(f"/media/w480/{storage_name}")
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        self.assertEqual(self.client.get(f"/media/w999/{storage_name}").status_code, 404)
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn(f'/media/w800/{storage_name} 800w', html)
+        self.assertIn('sizes="(max-width: 560px) 100vw', html)
+
+        with self.app.app_context():
+            delete_media(storage_name)
+        self.assertFalse(self.stored_media("w480", storage_name).exists())
+
+    def test_stored_derivatives_stay_servable_after_the_ladder_changes(self):
+        self.app.config["IMAGE_WORKERS"] = 0
+        with self.app.app_context():
+            processed = process_image(self.image_stream(1400, 700))
+            connection = get_db()
+            connection.execute(
+                """
+                UPDATE photos
+                SET storage_name = ?, width = ?, height = ?, derivatives = ?
+                WHERE id = ?
+                """,
+                (
+                    processed["storage_name"],
+                    processed["width"],
+                    processed["height"],
+                    processed["derivatives"],
+                    self.photo_one_id,
+                ),
+            )
+            connection.execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            connection.commit()
+        storage_name = processed["storage_name"]
+        self.app.config.update(IMAGE_LADDER=(640,), SIGNED_MEDIA_URLS=True)
+
+        item = self.client.get(
+            f"/api/public/photos?album_id={self.album_one_id}"
+        ).get_json()["items"][0]
+        urls = dict(
+            reversed(entry.rsplit(" ", 1)) for entry in item["srcset"].split(", ")
+        )
+        self.assertIn("/w800/", urls["800w"])
+        response = self.client.get(urls["800w"])
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        response = self.client.get(f"/media/w800/{storage_name}")
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        self.assertEqual(self.client.get(f"/media/w640/{storage_name}").status_code, 404)
+
+        with self.app.app_context():
+            delete_media(storage_name)
+        self.assertFalse(self.stored_media("w800", storage_name).exists())
+
+    def test_placeholders_are_computed_at_upload_and_backfilled(self):
+        self.app.config["IMAGE_WORKERS"] = 0
+        source = Image.new("RGB", (600, 400), "#c0392b")
+        source.paste(Image.new("RGB", (120, 400), "#2c3e50"), (0, 0))
+        stream = BytesIO()
+        source.save(stream, "JPEG", quality=95)
+        stream.seek(0)
+        with self.app.app_context():
+            processed = process_image(stream)
+            connection = get_db()
+            connection.execute(
+                """
+                UPDATE photos
+                SET storage_name = ?, width = ?, height = ?
+                WHERE id = ?
+                """,
+                (
+                    processed["storage_name"],
+                    processed["width"],
+                    processed["height"],
+                    self.photo_one_id,
+                ),
+            )
+            connection.execute(
+                "UPDATE albums SET status = 'published' WHERE id = ?",
+                (self.album_one_id,),
+            )
+            connection.commit()
+        prefix = "data:image/webp;base64,"
+        self.assertTrue(processed["placeholder"].startswith(prefix))
+        with Image.open(
+            BytesIO(base64.b64decode(processed["placeholder"].removeprefix(prefix)))
+        ) as preview:
+            self.assertEqual(preview.size, (16, 11))
+        red, green, blue = bytes.fromhex(processed["dominant_color"][1:])
+        self.assertGreater(red, 150)
+        self.assertLess(max(green, blue), 100)
+
+        result = self.app.test_cli_runner().invoke(args=["backfill-image-features"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("更新 1 张照片，1 张", result.output)
+        with self.app.app_context():
+            row = get_db().execute(
+                "SELECT placeholder, dominant_color FROM photos WHERE id = ?",
+                (self.photo_one_id,),
+            ).fetchone()
+        self.assertTrue(row["placeholder"].startswith(prefix))
+        for backfilled, uploaded in zip(
+            bytes.fromhex(row["dominant_color"][1:]),
+            bytes.fromhex(processed["dominant_color"][1:]),
+        ):
+            self.assertLessEqual(abs(backfilled - uploaded), 4)
+
+        item = self.client.get("/api/public/photos").get_json()["items"][0]
+        self.assertEqual(item["placeholder"], row["placeholder"])
+        self.assertEqual(item["color"], row["dominant_color"])
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn(f'data-color="{row["dominant_color"]}"', html)
+
+    def test_near_duplicates_are_found_through_the_hash_index(self):
+        self.app.config["IMAGE_WORKERS"] = 0
+
+        def scene(shift=0, brightness=0):
+            image = Image.new("RGB", (640, 480), (40 + brightness, 60, 90))
+            for index in range(6):
+                tone = (200 - index * 25 + brightness, 120 + index * 15, 80)
+                image.paste(Image.new("RGB", (60, 300), tone), (index * 100 + shift, 90))
+            stream = BytesIO()
+            image.save(stream, "JPEG", quality=90)
+            stream.seek(0)
+            return stream
+
+        gradient = Image.linear_gradient("L").resize((640, 480)).convert("RGB")
+        unrelated = BytesIO()
+        gradient.save(unrelated, "JPEG")
+        unrelated.seek(0)
+        with self.app.app_context():
+            connection = get_db()
+            identifiers = []
+            for user_id, source in (
+                (self.user_one_id, scene()),
+                (self.user_one_id, scene(shift=4, brightness=12)),
+                (self.user_one_id, unrelated),
+                (self.user_two_id, scene()),
+            ):
+                processed = process_image(source)
+                identifiers.append(
+                    connection.execute(
+                        """
+                        INSERT INTO photos (
+                            user_id, storage_name, original_name, perceptual_hash
+                        ) VALUES (?, ?, 'scene.jpg', ?)
+                        """,
+                        (user_id, processed["storage_name"], processed["perceptual_hash"]),
+                    ).lastrowid
+                )
+            connection.commit()
+        burst, re_edit, _unrelated, _foreign = identifiers
+
+        token = self.login("user.one", "user-password-2026")
+        payload = self.client.get("/studio/api/photos/near-duplicates").get_json()
+        self.assertEqual(payload["total"], 1)
+        self.assertEqual([photo["id"] for photo in payload["groups"][0]], [re_edit, burst])
+        with patch("fabula.similarity.MultiIndexHash.search") as search:
+            repeated = self.client.get("/studio/api/photos/near-duplicates").get_json()
+            search.assert_not_called()
+        self.assertEqual(repeated, payload)
+        self.assertEqual(
+            self.client.get("/studio/api/photos/near-duplicates?distance=0").get_json()["total"],
+            0,
+        )
+
+        response = self.api("DELETE", f"/studio/api/photos/{re_edit}", token)
+        self.assertEqual(response.status_code, 200)
+        payload = self.client.get("/studio/api/photos/near-duplicates").get_json()
+        self.assertEqual(payload["groups"], [])
+
+        values = [int.from_bytes(os.urandom(8), "big") for _ in range(5000)]
+        for radius in (6, 10):
+            index = MultiIndexHash(block_count(radius, len(values)))
+            for position, value in enumerate(values):
+                index.add(value, position)
+            probe = values[7] ^ 0b1011
+            self.assertEqual(
+                sorted(position for _distance, position in index.search(probe, radius)),
+                [
+                    position
+                    for position, value in enumerate(values)
+                    if hamming_distance(probe, value) <= radius
+                ],
+            )
+            # Pigeonhole probing reaches a small slice of the library.
+            self.assertLess(index.visited, len(values) // 10)
+
+    def test_image_worker_pool_is_sized_by_memory_budget(self):
+        with self.app.app_context():
+            self.app.config.update(IMAGE_WORKERS=4, IMAGE_MEMORY_BUDGET_MB=200)
+            self.assertEqual(image_worker_count(), 2)
+            self.app.config.update(IMAGE_WORKERS=0)
+            self.assertEqual(image_worker_count(), 0)
+
+    def test_image_memory_budget_admits_jobs_until_capacity(self):
+        budget = MemoryBudget(100)
+        admitted = threading.Event()
+
+        def reserve_remaining():
+            with budget.reserve(60):
+                admitted.set()
+
+        with budget.reserve(50) as first:
+            self.assertEqual(first, 50)
+            worker = threading.Thread(target=reserve_remaining)
+            worker.start()
+            self.assertFalse(admitted.wait(0.2))
+        worker.join(5)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(budget.reserved, 0)
+        with budget.reserve(1_000) as oversized:
+            self.assertEqual(oversized, 100)
+
+        with budget.reserve(80), self.assertRaises(ImageProcessingBusy):
+            with budget.reserve(30, timeout=0.05):
+                pass
+
+        with self.app.app_context():
+            self.app.config["IMAGE_MEMORY_BUDGET_MB"] = 64
+            shared = image_memory_budget()
+            with shared.reserve(60 * 1024 * 1024):
+                self.app.config["IMAGE_MEMORY_BUDGET_MB"] = 32
+                # Resizing keeps the reservations already held.
+                self.assertIs(image_memory_budget(), shared)
+                with self.assertRaises(ImageProcessingBusy):
+                    with shared.reserve(1, timeout=0.05):
+                        pass
+            self.assertEqual(shared.reserved, 0)
 
     def test_bulk_delete_rejects_oversized_identifier_lists(self):
         token = self.login("user.one", "user-password-2026")
@@ -1233,6 +2584,17 @@ class FabulaTestCase(unittest.TestCase):
                 "SELECT attempts FROM media_cleanup_queue"
             ).fetchone()
             self.assertEqual(queued["attempts"], 1)
+        # Building another app, as every flask command does, leaves the
+        # queue to the maintenance leader.
+        create_app(self.app.config)
+        with self.app.app_context():
+            connection = get_db()
+            self.assertEqual(
+                connection.execute(
+                    "SELECT COUNT(*) FROM media_cleanup_queue"
+                ).fetchone()[0],
+                1,
+            )
             self.assertEqual(drain_media_deletions(), 1)
             self.assertEqual(
                 connection.execute(
@@ -1258,7 +2620,7 @@ class FabulaTestCase(unittest.TestCase):
                     "SELECT version FROM schema_migrations"
                 ).fetchall()
             }
-        self.assertEqual(versions, {1, 2, 3, 4, 5})
+        self.assertEqual(versions, set(range(1, 14)))
 
     def test_admin_can_update_public_copy(self):
         token = self.login("admin.user", "admin-password-2026")
@@ -1288,6 +2650,39 @@ class FabulaTestCase(unittest.TestCase):
         self.assertIn('value="celadon" checked', studio_html)
         self.assertIn("<h1>用户管理</h1>", studio_html)
 
+    def test_site_settings_are_cached_until_the_revision_changes(self):
+        with self.app.app_context():
+            self.assertEqual(get_site_copy()["site_title"], "Fabula")
+            get_db().execute(
+                """
+                INSERT INTO site_settings (key, value)
+                VALUES ('site_copy', '{"site_title": "未登记"}')
+                """
+            )
+            get_db().commit()
+
+        with self.app.app_context():
+            statements = []
+            get_db().set_trace_callback(statements.append)
+            self.assertEqual(get_site_copy()["site_title"], "Fabula")
+            get_site_images()
+            get_site_copy()["site_title"] = "只改副本"
+            self.assertEqual(get_site_copy()["site_title"], "Fabula")
+            self.assertEqual(len(statements), 1)
+            self.assertIn("'revision'", statements[0])
+            get_db().set_trace_callback(None)
+            save_site_copy({"site_title": "浮光"})
+            self.assertEqual(get_site_copy()["site_title"], "浮光")
+            get_db().rollback()
+
+        with self.app.app_context():
+            self.assertEqual(get_site_copy()["site_title"], "Fabula")
+            save_site_copy({"site_title": "浮光"})
+            get_db().commit()
+
+        with self.app.app_context():
+            self.assertEqual(get_site_copy()["site_title"], "浮光")
+
     def test_admin_can_manage_home_and_login_images(self):
         token = self.login("admin.user", "admin-password-2026")
         studio_html = self.client.get("/studio?tab=site-copy").get_data(as_text=True)
@@ -1785,6 +3180,24 @@ class ApplicationConfigurationTestCase(unittest.TestCase):
                 )
             self.assertEqual(delete_media.call_count, 12)
 
+    def test_maintenance_starts_with_the_first_request_not_cli_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = self.app_config(Path(directory))
+            config["TESTING"] = False
+            app = create_app(config)
+            scheduler = maintenance_scheduler(app)
+            try:
+                result = app.test_cli_runner().invoke(
+                    args=["migrate-media-layout"]
+                )
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertFalse(scheduler.running)
+
+                self.assertEqual(app.test_client().get("/healthz").status_code, 200)
+                self.assertTrue(scheduler.running)
+            finally:
+                scheduler.stop()
+
 
 if __name__ == "__main__":
     unittest.main()